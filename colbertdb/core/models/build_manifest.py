@@ -0,0 +1,132 @@
+"""
+A durable record of the stages of an index build that are complete.
+
+A build started by `ColbertPLAID.index_stream` writes `build.json` in the directory of its
+version and records every stage once its files are on disk: the split of the documents into
+passages, the k-means centroids and codec, each compressed chunk, and the IVF. The record is
+replaced atomically after the files of the stage are synced, so a build that is interrupted
+can be resumed from the first stage that is not recorded. The file is removed once the version
+is complete, and a version that still has one is an unfinished build.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import srsly
+
+BUILD_MANIFEST_FILE = "build.json"
+
+SPLIT = "split"
+KMEANS = "kmeans"
+IVF = "ivf"
+
+
+class BuildManifest:
+    """
+    The completed stages of the build of the index in a directory.
+
+    Chunks are recorded by the thread that writes them, so every update runs under a lock.
+
+    Args:
+        path (Union[str, Path]): The directory of the index being built.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        manifest = srsly.read_json(self.path / BUILD_MANIFEST_FILE)
+        self.stages = set(manifest["stages"])
+        self.chunks = set(manifest["chunks"])
+
+    @classmethod
+    def exists(cls, path: Union[str, Path]) -> bool:
+        """Check whether the index in a directory is an unfinished build."""
+        return Path(path, BUILD_MANIFEST_FILE).exists()
+
+    @classmethod
+    def start(cls, path: Union[str, Path]) -> "BuildManifest":
+        """
+        Record the start of a build, or open the record of the unfinished build in the directory.
+
+        Args:
+            path (Union[str, Path]): The directory of the index.
+
+        Returns:
+            BuildManifest: The record of the build.
+        """
+        if not cls.exists(path):
+            _write_json(Path(path, BUILD_MANIFEST_FILE), {"stages": [], "chunks": []})
+        return cls(path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> Optional["BuildManifest"]:
+        """Open the record of the build in a directory, None if the build is not recorded."""
+        if not cls.exists(path):
+            return None
+        return cls(path)
+
+    def is_complete(self, stage: str) -> bool:
+        """Check whether a stage of the build is recorded."""
+        return stage in self.stages
+
+    def has_chunk(self, chunk_idx: int) -> bool:
+        """Check whether a chunk of passages is recorded as encoded and compressed."""
+        return chunk_idx in self.chunks
+
+    def complete(self, stage: str, files: Iterable[Union[str, Path]] = ()):
+        """
+        Record a stage, once its files are synced to disk.
+
+        Args:
+            stage (str): The stage.
+            files (Iterable[Union[str, Path]]): The files written by the stage, relative to the directory.
+        """
+        _sync(self.path, files)
+        with self.lock:
+            self.stages.add(stage)
+            self._save()
+
+    def complete_chunk(self, chunk_idx: int, files: Iterable[Union[str, Path]] = ()):
+        """
+        Record a chunk, once its files are synced to disk.
+
+        Args:
+            chunk_idx (int): The index of the chunk.
+            files (Iterable[Union[str, Path]]): The files of the chunk, relative to the directory.
+        """
+        _sync(self.path, files)
+        with self.lock:
+            self.chunks.add(chunk_idx)
+            self._save()
+
+    def finish(self):
+        """Remove the record once the index is complete."""
+        Path(self.path, BUILD_MANIFEST_FILE).unlink(missing_ok=True)
+
+    def _save(self):
+        _write_json(
+            self.path / BUILD_MANIFEST_FILE,
+            {"stages": sorted(self.stages), "chunks": sorted(self.chunks)},
+        )
+
+
+def _sync(path: Path, files: Iterable[Union[str, Path]]):
+    """Flush files of a directory to disk."""
+    for name in files:
+        fd = os.open(path / name, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _write_json(path: Path, data: dict):
+    """Write a JSON file and sync it, replacing the existing one once it is complete."""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(srsly.json_dumps(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,229 @@
+"""
+A process-wide registry of ColBERT checkpoints.
+
+Every collection built on the same checkpoint shares a single copy of the model weights.
+Collections, searchers and index updaters receive lightweight views of the shared
+checkpoint which carry their own tokenizers and query/document lengths.
+
+On CPU, a checkpoint can also be loaded as an int8 encoder whose BERT linear layers are
+dynamically quantized, or with an encoder that runs on ONNX Runtime, see `OnnxCheckpoint`.
+Each is a separate copy of the weights, shared by the views that ask for it.
+"""
+
+import copy
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Literal, Optional, Union
+
+import torch
+from colbert.infra import ColBERTConfig
+from colbert.modeling.checkpoint import Checkpoint
+
+from colbertdb.core.models.onnx_checkpoint import OnnxCheckpoint
+
+EncoderBackend = Literal["torch", "onnx"]
+
+
+class _LockedTokenizer:
+    """
+    Serializes calls to a HuggingFace tokenizer shared between checkpoint views.
+
+    Fast tokenizers reconfigure their truncation and padding on every call, so two
+    threads tokenizing with different lengths must not interleave.
+    """
+
+    def __init__(self, tok, lock: threading.Lock):
+        self._tok = tok
+        self._lock = lock
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            return self._tok(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._tok, name)
+
+
+def quantize_encoder(checkpoint: Checkpoint) -> Checkpoint:
+    """
+    Quantize the linear layers of the BERT encoder of a checkpoint to int8, in place.
+
+    Their weights are stored in int8 and their activations are quantized on the fly, which
+    speeds up inference on CPU. The embeddings, the layer norms and the final projection of
+    ColBERT keep their float32 weights.
+
+    Args:
+        checkpoint (Checkpoint): A checkpoint loaded on CPU.
+
+    Returns:
+        Checkpoint: The checkpoint.
+    """
+    if checkpoint.colbert_config.total_visible_gpus > 0:
+        raise ValueError("The int8 encoder can only be used with CPU!")
+    torch.ao.quantization.quantize_dynamic(
+        checkpoint.bert, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+    return checkpoint
+
+
+class CheckpointRegistry:
+    """A registry that loads each checkpoint path once per process and per encoder."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkpoints: Dict[str, Checkpoint] = {}
+        self.tokenizer_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def _key(
+        checkpoint: Union[str, Path],
+        quantized: bool = False,
+        backend: EncoderBackend = "torch",
+    ) -> str:
+        checkpoint = str(checkpoint)
+        if os.path.exists(checkpoint):
+            checkpoint = os.path.abspath(checkpoint)
+        if quantized:
+            return f"{checkpoint} (int8)"
+        if backend != "torch":
+            return f"{checkpoint} ({backend})"
+        return checkpoint
+
+    def get(
+        self,
+        checkpoint: Union[str, Path],
+        quantized: bool = False,
+        backend: EncoderBackend = "torch",
+    ) -> Checkpoint:
+        """
+        Get the shared checkpoint for a path, loading it on first use.
+
+        Args:
+            checkpoint (Union[str, Path]): The path to the checkpoint.
+            quantized (bool): Whether to get the checkpoint with the int8 encoder. Defaults to False.
+            backend (EncoderBackend): "torch", or "onnx" to encode with ONNX Runtime. Defaults to "torch".
+
+        Returns:
+            Checkpoint: The shared checkpoint. Callers must not mutate its tokenizers or config, use `view` instead.
+        """
+        if quantized and backend != "torch":
+            raise ValueError("The int8 encoder can only be used with the torch backend!")
+        key = self._key(checkpoint, quantized, backend)
+        with self.lock:
+            if key not in self.checkpoints:
+                colbert_config = ColBERTConfig.load_from_checkpoint(str(checkpoint))
+                if colbert_config is None:
+                    colbert_config = ColBERTConfig(checkpoint=str(checkpoint))
+                checkpoint_cls = OnnxCheckpoint if backend == "onnx" else Checkpoint
+                shared = checkpoint_cls(
+                    name=str(checkpoint), colbert_config=colbert_config, verbose=0
+                )
+                if quantized:
+                    shared = quantize_encoder(shared)
+                elif backend == "torch" and colbert_config.total_visible_gpus > 0:
+                    shared = shared.cuda()
+                self.checkpoints[key] = shared
+                self.tokenizer_locks[key] = threading.Lock()
+            return self.checkpoints[key]
+
+    def view(
+        self,
+        checkpoint: Union[str, Path],
+        colbert_config: Optional[ColBERTConfig] = None,
+        query_maxlen: Optional[int] = None,
+        doc_maxlen: Optional[int] = None,
+        quantized: bool = False,
+        backend: EncoderBackend = "torch",
+    ) -> Checkpoint:
+        """
+        Get a view of the shared checkpoint with its own config and tokenizers.
+
+        The view shares the model weights with every other view of the same checkpoint,
+        so changing its query or document length does not affect anyone else.
+
+        Args:
+            checkpoint (Union[str, Path]): The path to the checkpoint.
+            colbert_config (Optional[ColBERTConfig]): The config of the collection using the view. Defaults to the checkpoint config.
+            query_maxlen (Optional[int]): The maximum query length of the view. Defaults to the config value.
+            doc_maxlen (Optional[int]): The maximum document length of the view. Defaults to the config value.
+            quantized (bool): Whether the view encodes with the int8 encoder. Defaults to False.
+            backend (EncoderBackend): "torch", or "onnx" to encode with ONNX Runtime. Defaults to "torch".
+
+        Returns:
+            Checkpoint: The checkpoint view.
+        """
+        shared = self.get(checkpoint, quantized, backend)
+        tokenizer_lock = self.tokenizer_locks[self._key(checkpoint, quantized, backend)]
+
+        # A shallow copy of a module shares its submodules, and thus its weights.
+        view = copy.copy(shared)
+        view.colbert_config = ColBERTConfig.from_existing(
+            shared.colbert_config, colbert_config
+        )
+        view.query_tokenizer = copy.copy(shared.query_tokenizer)
+        view.doc_tokenizer = copy.copy(shared.doc_tokenizer)
+        for tokenizer in (view.query_tokenizer, view.doc_tokenizer):
+            if not isinstance(tokenizer.tok, _LockedTokenizer):
+                tokenizer.tok = _LockedTokenizer(tokenizer.tok, tokenizer_lock)
+        view.query_tokenizer.query_maxlen = (
+            query_maxlen or view.colbert_config.query_maxlen
+        )
+        view.doc_tokenizer.doc_maxlen = doc_maxlen or view.colbert_config.doc_maxlen
+        return view
+
+    def loaded_checkpoints(self) -> list[str]:
+        """List the checkpoints currently loaded in memory."""
+        with self.lock:
+            return list(self.checkpoints.keys())
+
+
+def query_from_text(
+    checkpoint: Checkpoint,
+    queries: list[str],
+    query_maxlen: int,
+    bsize: Optional[int] = None,
+    to_cpu: bool = False,
+) -> torch.Tensor:
+    """
+    Encode queries with a per-call maximum query length.
+
+    Args:
+        checkpoint (Checkpoint): The checkpoint or checkpoint view to encode with.
+        queries (list[str]): The queries to encode.
+        query_maxlen (int): The maximum query length for this call.
+        bsize (Optional[int]): The batch size. Defaults to encoding all queries at once.
+        to_cpu (bool): Whether to move the embeddings to the CPU. Defaults to False.
+
+    Returns:
+        torch.Tensor: The query embeddings.
+    """
+    view = copy.copy(checkpoint)
+    view.query_tokenizer = copy.copy(checkpoint.query_tokenizer)
+    view.query_tokenizer.query_maxlen = query_maxlen
+    return view.queryFromText(queries, bsize=bsize, to_cpu=to_cpu)
+
+
+def doc_from_text(
+    checkpoint: Checkpoint, documents: list[str], doc_maxlen: int, **kwargs
+):
+    """
+    Encode documents with a per-call maximum document length.
+
+    Args:
+        checkpoint (Checkpoint): The checkpoint or checkpoint view to encode with.
+        documents (list[str]): The documents to encode.
+        doc_maxlen (int): The maximum document length for this call.
+        **kwargs: Additional keyword arguments passed to `Checkpoint.docFromText`.
+
+    Returns:
+        The output of `Checkpoint.docFromText`.
+    """
+    view = copy.copy(checkpoint)
+    view.doc_tokenizer = copy.copy(checkpoint.doc_tokenizer)
+    view.doc_tokenizer.doc_maxlen = doc_maxlen
+    return view.docFromText(documents, **kwargs)
+
+
+# Initialize the checkpoint registry
+checkpoint_registry = CheckpointRegistry()
@@ -4,18 +4,36 @@ https://github.com/bclavie/RAGatouille/blob/main/ragatouille/models/colbert.py
 
 import time
 import math
-import os
 import shutil
-from collections import defaultdict
+import threading
+import weakref
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Literal, Optional, TypeVar, Union
+from typing import Dict, Iterable, List, Literal, Optional, Tuple, TypeVar, Union
 
 import srsly
 import torch
 import numpy as np
 from colbert.infra import ColBERTConfig, Run, RunConfig
-from colbert.modeling.checkpoint import Checkpoint
+from colbertdb.core.models.build_manifest import SPLIT, BuildManifest
+from colbertdb.core.models.checkpoint_registry import (
+    checkpoint_registry,
+    query_from_text,
+)
+from colbertdb.core.models.delta_segment import DeltaSegment
+from colbertdb.core.models.docid_map import DELETED, DocIdMap
 from colbertdb.core.models.index import PLAIDModelIndex
+from colbertdb.core.models.index_versions import IndexVersions, version_name
+from colbertdb.core.models.metadata_store import MetadataStore
+from colbertdb.core.models.passage_store import (
+    PassageStore,
+    PassageStoreWriter,
+    PassageView,
+)
+from colbertdb.core.models.search_params import SearchParams
+from colbertdb.core.utils.length_batching import PaddingStats, encode_documents
+from colbertdb.core.utils.progress import report_progress
+from colbertdb.core.utils.rwlock import RWLock
 
 
 class ColbertPLAID:
@@ -27,12 +45,23 @@ class ColbertPLAID:
         store_name (Optional[str]): The name of the store. Default is "dev".
         load_from_index (bool): Whether to load the index from disk. Default is False.
         checkpoint (Union[str, Path]): The path to the checkpoint. Default is ".checkpoints/colbertv2.0".
+        quantize_encoder (Optional[bool]): Whether queries are encoded with the int8 encoder of the checkpoint,
+            on CPU only. Passages, which end up in the index, are always encoded with the float32 encoder.
+            Saved with the index, and None loads the saved setting. Default is None, which is False for a new index.
+        encoder_backend (Optional[str]): The backend that encodes queries, documents and the passages of the index:
+            "torch", or "onnx" for ONNX Runtime on CPU, see `OnnxCheckpoint`. Saved with the index, and None
+            loads the saved setting. Default is None, which is "torch" for a new index.
 
     Attributes:
-        collection (List[str]): The collection of documents in the index.
-        pid_docid_map (Dict[int, str]): A mapping from document IDs to PLD IDs.
-        docid_pid_map (Dict[str, List[int]]): A mapping from PLD IDs to document IDs.
-        docid_metadata_map (Optional[Dict[str, dict]]): A mapping from document IDs to metadata. Default is None.
+        collection (PassageStore): The passages of the index, memory-mapped from disk.
+        docid_map (DocIdMap): The mapping between passage IDs and document IDs, memory-mapped from disk.
+        metadata_store (MetadataStore): The metadata of the documents, read from disk as needed.
+        delta (Optional[DeltaSegment]): The passages added since the last merge, searched exhaustively
+            until they are merged into the index.
+        delta_merge_threshold (int): The number of passages in the delta that triggers a background merge.
+        rebuild_from_embeddings (bool): Whether rebuilds reuse the embeddings of the index and of the delta
+            instead of encoding every passage again. Default is True.
+        lock (RWLock): Held for reading by searches and for writing while an update is swapped in.
         base_model_max_tokens (int): The maximum number of tokens in the base model.
         inference_ckpt_len_set (bool): Whether the inference checkpoint length is set. Default is False.
         in_memory_collection (Optional[List[str]]): The in-memory collection of documents. Default is None.
@@ -41,12 +70,18 @@ class ColbertPLAID:
         index_name (Optional[str]): The name of the index.
         loaded_from_index (bool): Whether the index is loaded from disk.
         model_index (Optional[PLAIDModelIndex]): The PLAIDModelIndex object representing the index.
-        index_path (Optional[str]): The path to the index.
+        index_path (Optional[str]): The path to the index, the directory of the collection.
+        index_versions (Optional[IndexVersions]): The versions of the index in the collection directory.
+        index_version (int): The version of the index that is loaded.
         config (ColBERTConfig): The ColBERT configuration.
         run_config (RunConfig): The run configuration.
         index_root (str): The root directory of the index.
         checkpoint (str): The path to the checkpoint.
-        inference_ckpt (Checkpoint): The inference checkpoint.
+        inference_ckpt (Checkpoint): A view of the inference checkpoint, shared with every collection using the same checkpoint.
+        query_ckpt (Checkpoint): The view queries are encoded with, the int8 encoder if `quantize_encoder`
+            and `inference_ckpt` otherwise.
+        quantize_encoder (bool): Whether queries are encoded with the int8 encoder, here and by the searcher.
+        encoder_backend (str): The backend of the inference checkpoint, the searcher and the index builds.
         run_context (RunContext): The run context.
         searcher (Optional[Searcher]): The searcher object.
 
@@ -54,21 +89,33 @@ class ColbertPLAID:
         add_to_index(self, new_documents: List[str], new_pid_docid_map: Dict[int, str], new_docid_metadata_map: Optional[List[dict]] = None, index_name: Optional[str] = None, bsize: int = 32): Adds documents to the index.
         delete_from_index(self, document_ids: Union[TypeVar("T"), List[TypeVar("T")]], index_name: Optional[str] = None): Deletes documents from the index.
         index(self, collection: List[str], pid_docid_map: Dict[int, str], docid_metadata_map: Optional[dict] = None, index_name: Optional["str"] = None, max_document_length: int = 256, overwrite: Union[bool, str] = "reuse", bsize: int = 32): Indexes the given collection of documents.
+        index_stream(self, batches: Iterable[Tuple[List[str], List[str], Optional[Dict[str, dict]]]], index_name: Optional["str"] = None, max_document_length: int = 256, overwrite: Union[bool, str] = "reuse", bsize: int = 32): Indexes a collection that is read a batch at a time.
         search(self, query: Union[str, list[str]], index_name: Optional[str] = None, k: int = 10, force_fast: bool = False, zero_index_ranks: bool = False, doc_ids: Optional[List[str]] = None): Perform a search query on the index.
+        merge_delta(self, bsize: int = 32): Merges the passages added since the last merge into the index.
         delete(self): Deletes the index.
     """
 
+    delta_merge_threshold = 1000
+    rebuild_from_embeddings = True
+
     def __init__(
         self,
         index_name: Optional[str] = None,
         store_name: Optional[str] = None,
         load_from_index: bool = False,
         checkpoint: Union[str, Path] = ".data/.checkpoints/colbertv2.0",
+        quantize_encoder: Optional[bool] = None,
+        encoder_backend: Optional[str] = None,
     ):
         self.collection = None
-        self.pid_docid_map = None
-        self.docid_pid_map = None
-        self.docid_metadata_map = None
+        self.docid_map = None
+        self.metadata_store = None
+        self.delta: Optional[DeltaSegment] = None
+        self._merge_thread: Optional[threading.Thread] = None
+        self.lock = RWLock()
+        self.index_versions: Optional[IndexVersions] = None
+        self.index_version = 0
+        self._version_reference: Optional[weakref.finalize] = None
         self.base_model_max_tokens = 510
         self.inference_ckpt_len_set = False
         self.in_memory_collection = None
@@ -77,22 +124,35 @@ class ColbertPLAID:
         self.index_name = index_name
         self.loaded_from_index = load_from_index
         self.store_name = store_name
+        self.quantize_encoder = bool(quantize_encoder)
+        self.encoder_backend = encoder_backend or "torch"
 
         n_gpu = 1 if torch.cuda.device_count() == 0 else torch.cuda.device_count()
         self.model_index: Optional[PLAIDModelIndex] = None
         index_path = f".data/{store_name}/indexes/{index_name}"
         if load_from_index:
             self.index_path = index_path
-            ckpt_config = ColBERTConfig.load_from_index(str(self.index_path))
-            metadata = srsly.read_json(self.index_path + "/metadata.json")
+            self.index_versions = IndexVersions(index_path)
+            self._hold_version(self.index_versions.acquire_current())
+            version_path = self._version_path()
+            ckpt_config = ColBERTConfig.load_from_index(version_path)
+            metadata = srsly.read_json(version_path + "/metadata.json")
             index_config = metadata["colbertdb"]["index_config"]
+            if quantize_encoder is None:
+                quantize_encoder = metadata["colbertdb"].get("quantize_encoder", False)
+            self.quantize_encoder = quantize_encoder
+            if encoder_backend is None:
+                encoder_backend = metadata["colbertdb"].get("encoder_backend", "torch")
+            self.encoder_backend = encoder_backend
 
             self.model_index = PLAIDModelIndex.load_from_file(
-                index_path=self.index_path,
+                index_path=version_path,
                 index_name=index_name,
                 config=ckpt_config,
                 index_config=index_config,
             )
+            self.model_index.quantized_encoder = self.quantize_encoder
+            self.model_index.encoder_backend = self.encoder_backend
 
             self.config = self.model_index.config
             self.run_config = RunConfig(nranks=n_gpu, root=self.config.root)
@@ -100,7 +160,6 @@ class ColbertPLAID:
             self.config.root = "/".join(split_root)
             self.index_root = self.config.root
             self.checkpoint = self.config.checkpoint
-            self.index_name = self.config.index_name
             self._get_collection_files_from_disk(self.index_path)
 
         else:
@@ -121,9 +180,18 @@ class ColbertPLAID:
             self.config.experiment = store_name
             self.config.root = self.index_root
 
-        self.inference_ckpt = Checkpoint(
-            name=self.checkpoint, colbert_config=self.config
+        # Passages are encoded with the float32 encoder, since they can reach the index.
+        self.inference_ckpt = checkpoint_registry.view(
+            self.checkpoint, colbert_config=self.config, backend=self.encoder_backend
         )
+        self.query_ckpt = self.inference_ckpt
+        if self.quantize_encoder:
+            self.query_ckpt = checkpoint_registry.view(
+                self.checkpoint,
+                colbert_config=self.config,
+                quantized=True,
+                backend=self.encoder_backend,
+            )
 
         self.base_model_max_tokens = (
             self.inference_ckpt.bert.config.max_position_embeddings
@@ -131,51 +199,77 @@ class ColbertPLAID:
         self.run_context = Run().context(self.run_config)
         self.run_context.__enter__()  # Manually enter the context
         self.searcher = None
+        if load_from_index:
+            self._load_delta()
 
-    def _invert_pid_docid_map(self) -> Dict[str, List[int]]:
+    def _hold_version(self, version: int):
         """
-        Inverts the pid_docid_map.
+        Reference the version of the index that is loaded, and release the one loaded before.
 
-        Returns:
-            Dict[str, List[int]]: The inverted pid_docid_map.
+        The reference is also released when this object is garbage collected.
+
+        Args:
+            version (int): The version, already acquired from `index_versions`.
         """
-        d = defaultdict(list)
-        for k, v in self.pid_docid_map.items():
-            d[v].append(k)
-        return d
+        if self._version_reference is not None:
+            self._version_reference()
+        self.index_version = version
+        self._version_reference = weakref.finalize(
+            self, self.index_versions.release, version
+        )
+
+    def _version_path(self, version: Optional[int] = None) -> str:
+        """Return the directory of a version of the index, by default the loaded one."""
+        version = self.index_version if version is None else version
+        return str(self.index_versions.path_of(version))
+
+    def _version_name(self) -> str:
+        """Return the name colbert knows the loaded version of the index by."""
+        return version_name(self.index_name, self.index_version)
 
     def _get_collection_files_from_disk(self, index_path: str):
         """
         Loads the collection files from disk.
 
         Args:
-            index_path (str): The path to the index.
+            index_path (str): The path to the index, the directory of the collection.
 
         Returns:
             None
         """
-        self.collection = srsly.read_json(Path(index_path, "collection.json"))
-        if os.path.exists(str(Path(index_path, "docid_metadata_map.json"))):
-            self.docid_metadata_map = srsly.read_json(
-                str(Path(index_path, "docid_metadata_map.json"))
-            )
-        else:
-            self.docid_metadata_map = None
-        try:
-            self.pid_docid_map = srsly.read_json(
-                str(Path(index_path, "pid_docid_map.json"))
+        version_path = self._version_path()
+        # The passages are read together with the number of them that are in the index.
+        with self.index_versions.update_lock:
+            self.collection = PassageStore.load(version_path)
+            self.metadata_store = MetadataStore.load(index_path)
+            try:
+                self.docid_map = DocIdMap.load(
+                    version_path, num_pids=len(self.collection)
+                )
+            except FileNotFoundError as err:
+                raise FileNotFoundError(
+                    "ERROR: Could not load the document id map from index!",
+                    "This is likely because you are loading an older, incompatible index.",
+                ) from err
+            self.delta = DeltaSegment.load(
+                version_path,
+                PLAIDModelIndex.num_passages(version_path),
+                len(self.collection),
             )
-        except FileNotFoundError as err:
-            raise FileNotFoundError(
-                "ERROR: Could not load pid_docid_map from index!",
-                "This is likely because you are loading an older, incompatible index.",
-            ) from err
-
-        # convert all keys to int when loading from file because saving converts to str
-        self.pid_docid_map = {
-            int(key): value for key, value in self.pid_docid_map.items()
-        }
-        self.docid_pid_map = self._invert_pid_docid_map()
+
+    def _load_delta(self):
+        """
+        Encodes the passages that were added but not merged into the index before it was loaded,
+        and whose embeddings were not saved with the delta, such as the ones of older indexes.
+
+        Returns:
+            None
+        """
+        pending = self.collection[self.delta.end_pid :]
+        if len(pending) == 0:
+            return
+        print(f"Encoding {len(pending)} passages that are not in the index yet...")
+        self.delta.append(*self._encode_index_free_documents(pending, verbose=False))
 
     def add_to_index(
         self,
@@ -188,6 +282,10 @@ class ColbertPLAID:
         """
         Adds documents to the index.
 
+        The new passages are encoded into the delta, where they are searchable as soon as this
+        returns, and are merged into the index in the background once the delta reaches
+        `delta_merge_threshold` passages.
+
         Args:
             new_documents (List[str]): The new documents to be added.
             new_pid_docid_map (Dict[int, str]): The mapping from PLD IDs to document IDs for the new documents.
@@ -199,67 +297,219 @@ class ColbertPLAID:
             None
         """
         self.index_name = index_name if index_name is not None else self.index_name
-        if self.loaded_from_index:
-            index_root = self.config.root
-        else:
+        if not self.loaded_from_index and self.collection is None:
             expected_path_segment = Path(self.config.experiment) / "indexes"
             if str(expected_path_segment) in self.config.root:
                 index_root = self.config.root
             else:
                 index_root = str(Path(self.config.root) / expected_path_segment)
 
-            if not self.collection:
-                collection_path = Path(index_root) / self.index_name / "collection.json"
-                if collection_path.exists():
-                    self._get_collection_files_from_disk(
-                        str(Path(index_root) / self.index_name)
-                    )
+            index_path = Path(index_root) / self.index_name
+            index_versions = IndexVersions(index_path)
+            version_path = index_versions.path_of(index_versions.current())
+            if (version_path / "metadata.json").exists():
+                self.index_path = str(index_path)
+                self.index_versions = index_versions
+                self._hold_version(index_versions.acquire_current())
+                self._get_collection_files_from_disk(self.index_path)
+                self._load_delta()
+
+        new_documents_with_ids = ColbertPLAID._select_new_documents(
+            self.docid_map, new_documents, new_pid_docid_map
+        )
+        new_collection = [doc["content"] for doc in new_documents_with_ids]
+        new_docids = [doc["document_id"] for doc in new_documents_with_ids]
 
-        new_documents_with_ids = [
-            {"content": doc, "document_id": new_pid_docid_map[pid]}
-            for pid, doc in enumerate(new_documents)
-            if new_pid_docid_map[pid] not in self.pid_docid_map.values()
-        ]
+        if len(new_collection) > 0:
+            # New passages are only encoded here. They are searched exhaustively from the
+            # delta until a merge adds them to the index.
+            embeddings, mask = self._encode_index_free_documents(
+                new_collection, bsize=bsize, verbose=False
+            )
+            with self.lock.write():
+                self.collection.append(new_collection)
+                self.docid_map.append(new_docids)
+                self.delta.append(embeddings, mask)
 
-        max_existing_pid = max(self.pid_docid_map.keys(), default=-1)
-        for idx, doc in enumerate(new_documents_with_ids, start=max_existing_pid + 1):
-            self.pid_docid_map[idx] = doc["document_id"]
+                # TODO This has inconsistent behavior for duplicates.
+                if new_docid_metadata_map is not None:
+                    self.metadata_store.put_many(new_docid_metadata_map)
+            self._schedule_merge(bsize)
 
-        new_collection = [doc["content"] for doc in new_documents_with_ids]
+        print(
+            f"Successfully updated index with {len(new_documents_with_ids)} new documents!\n",
+            f"New index size: {len(self.collection)}",
+        )
 
-        self.model_index.add(
-            self.config,
-            self.checkpoint,
-            self.collection,
-            index_root,
-            self.index_name,
-            new_collection,
-            verbose=1,
-            bsize=bsize,
-            store_name=self.store_name,
+    def _schedule_merge(self, bsize: int = 32):
+        """Starts a background merge once the delta is large enough, unless one is running."""
+        if len(self.delta) < self.delta_merge_threshold:
+            return
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return
+        self._merge_thread = threading.Thread(
+            target=self._merge_in_background, args=(bsize,), daemon=True
         )
-        self.config = self.model_index.config
+        self._merge_thread.start()
+
+    def _merge_in_background(self, bsize: int):
+        try:
+            self.merge_delta(bsize=bsize)
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"ERROR: Failed to merge new passages into index {self.index_name}: {err}")
+
+    def merge_delta(self, bsize: int = 32):
+        """
+        Merges the passages added since the last merge into the index.
+
+        Small deltas are compressed with the codec of the index and appended to it, larger ones
+        trigger a rebuild, following the same heuristic as additions used to. Passages added
+        during the merge stay in the delta, and searches keep running against the loaded index
+        and delta until the merged ones are swapped in.
+
+        Args:
+            bsize (int): The batch size for indexing, if the index is rebuilt. Default is 32.
+
+        Returns:
+            None
+        """
+        with self.index_versions.update_lock:
+            with self.lock.read():
+                num_batches = len(self.delta.batches)
+                first_pid, end_pid = self.delta.first_pid, self.delta.end_pid
+                num_live_new = int(
+                    np.count_nonzero(self.docid_map.ordinals[first_pid:] != DELETED)
+                )
+                num_live_indexed = self.docid_map.num_live - num_live_new
+            if num_batches == 0:
+                return
+
+            if PLAIDModelIndex._should_rebuild(num_live_indexed, end_pid - first_pid):
+                self._rebuild_index(num_batches, end_pid, bsize)
+                return
+
+            embeddings, doclens = self.delta.flatten(num_batches)
+            ordinals = self.docid_map.ordinals[first_pid:end_pid]
+            deleted_pids = (np.flatnonzero(ordinals == DELETED) + first_pid).tolist()
+            update = self.model_index.add_encoded(
+                self.config,
+                self.checkpoint,
+                self.collection,
+                self._version_name(),
+                embeddings,
+                doclens,
+                pids_to_remove=deleted_pids,
+            )
+            self.config = self.model_index.config
+
+            # The merged passages move from the delta to the index at once, so that searches
+            # return them exactly once.
+            with self.lock.write():
+                update.apply()
+                self.delta.drop(num_batches)
+
+            self._save_index_metadata()
+        print(f"Merged {end_pid - first_pid} new passages into the index.")
+
+    def _rebuild_index(self, num_batches: int, end_pid: int, bsize: int):
+        """
+        Rebuilds the index with the passages of the first batches of the delta into a new
+        version, then switches to it.
+
+        The loaded version keeps serving searches, and stays on disk for the other
+        processes and collections that loaded it, until the new one is complete. Passages
+        added during the rebuild are carried over to the new version, in the delta.
 
-        # Update and serialize the index metadata + collection.
-        self.collection = self.collection + new_collection
+        Unless `rebuild_from_embeddings` is False, no passage is encoded: the passages of the
+        index are decompressed from it and the ones of the delta come with their embeddings.
+        K-means starts from the centroids of the loaded index.
 
-        # TODO This has inconsistent behavior for duplicates.
-        if new_docid_metadata_map is not None:
-            self.docid_metadata_map = self.docid_metadata_map or defaultdict(
-                lambda: None
+        Args:
+            num_batches (int): The number of batches of the delta to merge.
+            end_pid (int): The pid that follows the last passage of these batches.
+            bsize (int): The batch size for indexing.
+        """
+        # Passages are appended while the index is rebuilt, without the update lock. The pids
+        # below end_pid, and their passages and document ids, do not change while it is held.
+        with self.lock.read():
+            pids = self.docid_map.live_pids()
+        pids = pids[pids < end_pid]
+        embeddings = None
+        if self.rebuild_from_embeddings:
+            embeddings = self.model_index.indexed_embeddings(
+                self.checkpoint,
+                self.collection,
+                self._version_name(),
+                pids,
+                *self.delta.flatten(num_batches),
             )
-            self.docid_metadata_map.update(new_docid_metadata_map)
 
-        self.docid_pid_map = defaultdict(list)
-        for pid, docid in self.pid_docid_map.items():
-            self.docid_pid_map[docid].append(pid)
+        version = self.index_versions.create()
+        version_path = self._version_path(version)
+        try:
+            collection = PassageStore.create(
+                version_path, PassageView(self.collection, pids)
+            )
+            docid_map = DocIdMap.create(
+                version_path, (self.docid_map.docid(pid) for pid in pids)
+            )
+            update = self.model_index.rebuild(
+                self.checkpoint,
+                collection,
+                version_name(self.index_name, version),
+                verbose=1,
+                bsize=bsize,
+                store_name=self.store_name,
+                embeddings=embeddings,
+                init_centroids=PLAIDModelIndex.load_centroids(self._version_path()),
+            )
+            self.config = self.model_index.config
+            self._save_index_metadata(version_path)
+        except Exception:
+            self.index_versions.release(version)
+            raise
+
+        with self.lock.write():
+            carried_pids = range(end_pid, len(self.collection))
+            collection.append(self.collection.get_many(carried_pids))
+            docid_map.append([self.docid_map.docid(pid) for pid in carried_pids])
+            self.index_versions.switch(version)
+            update.apply()
+            self.delta.drop(num_batches, first_pid=len(pids), path=version_path)
+            old_collection, old_docid_map = self.collection, self.docid_map
+            self.collection, self.docid_map = collection, docid_map
+        old_collection.close()
+        old_docid_map.close()
+        # Deletes the previous version if nothing else uses it.
+        self._hold_version(version)
+        print(f"Rebuilt the index with {len(pids)} passages.")
+
+    @staticmethod
+    def _select_new_documents(
+        docid_map: DocIdMap,
+        new_documents: List[str],
+        new_pid_docid_map: Dict[int, str],
+    ) -> List[dict]:
+        """
+        Pairs new passages with their document IDs, skipping the documents that are already indexed.
 
-        self._save_index_metadata()
+        The index is queried once per distinct document and the passages are filtered against a set,
+        so the cost grows with the number of new passages and not with the size of the index.
 
-        print(
-            f"Successfully updated index with {len(new_documents_with_ids)} new documents!\n",
-            f"New index size: {len(self.collection)}",
-        )
+        Args:
+            docid_map (DocIdMap): The document id map of the index.
+            new_documents (List[str]): The new passages.
+            new_pid_docid_map (Dict[int, str]): The document ID of each new passage, by position.
+
+        Returns:
+            List[dict]: The passages to add, as dicts with "content" and "document_id" keys.
+        """
+        existing_docids = docid_map.existing(new_pid_docid_map.values())
+        return [
+            {"content": doc, "document_id": new_pid_docid_map[pid]}
+            for pid, doc in enumerate(new_documents)
+            if new_pid_docid_map[pid] not in existing_docids
+        ]
 
     def delete_from_index(
         self,
@@ -296,76 +546,68 @@ class ColbertPLAID:
             "delete_from_index support will be more thorough in future versions",
         )
 
-        pids_to_remove = []
-        for pid, docid in self.pid_docid_map.items():
-            if docid in document_ids:
-                pids_to_remove.append(pid)
-
-        self.model_index.delete(
-            self.config,
-            self.checkpoint,
-            self.collection,
-            self.index_name,
-            pids_to_remove,
-            verbose=1,
-        )
-
-        # Update and serialize the index metadata + collection.
-        self.collection = [
-            doc for pid, doc in enumerate(self.collection) if pid not in pids_to_remove
-        ]
-        self.pid_docid_map = {
-            pid: docid
-            for pid, docid in self.pid_docid_map.items()
-            if pid not in pids_to_remove
-        }
+        if isinstance(document_ids, str):
+            document_ids = [document_ids]
+
+        with self.index_versions.update_lock:
+            pids_to_remove = self.docid_map.pids(document_ids)
+            # Passages of the delta are only marked as deleted, a merge skips them.
+            indexed_pids = [pid for pid in pids_to_remove if pid < self.delta.first_pid]
+
+            update = None
+            if len(indexed_pids) > 0:
+                update = self.model_index.delete(
+                    self.config,
+                    self.checkpoint,
+                    self.collection,
+                    self._version_name(),
+                    indexed_pids,
+                    verbose=1,
+                )
 
-        if self.docid_metadata_map is not None:
-            self.docid_metadata_map = {
-                docid: metadata
-                for docid, metadata in self.docid_metadata_map.items()
-                if docid not in document_ids
-            }
+            # The passages stay in the store so that the remaining passage ids still match the index.
+            with self.lock.write():
+                if update is not None:
+                    update.apply()
+                self.docid_map.remove(pids_to_remove)
+                self.metadata_store.delete_many(document_ids)
 
-        self._save_index_metadata()
+            if update is not None:
+                self._save_index_metadata()
 
         print(f"Successfully deleted documents with these IDs: {document_ids}")
 
-    def _write_collection_files_to_disk(self):
-        """
-        Writes the collection files to disk.
-
-        Returns:
-            None
-        """
-        srsly.write_json(self.index_path + "/collection.json", self.collection)
-        srsly.write_json(self.index_path + "/pid_docid_map.json", self.pid_docid_map)
-        if self.docid_metadata_map is not None:
-            srsly.write_json(
-                self.index_path + "/docid_metadata_map.json", self.docid_metadata_map
-            )
-
-        # update the in-memory inverted map every time the files are saved to disk
-        self.docid_pid_map = self._invert_pid_docid_map()
-
     def delete(self):
         print("Deleting index...")
-        self._delete_from_disk()
+        if self.index_versions is None:
+            self._delete_from_disk()
+            return
+        # Waits for a running merge.
+        with self.index_versions.update_lock:
+            self._delete_from_disk()
 
     def _delete_from_disk(self):
         print(self.index_path)
+        if self.metadata_store is not None:
+            self.metadata_store.close()
+        if self._version_reference is not None:
+            self._version_reference.detach()
         shutil.rmtree(self.index_path, ignore_errors=True)
 
-    def _save_index_metadata(self):
+    def _save_index_metadata(self, version_path: Optional[str] = None):
         assert self.model_index is not None
 
-        model_metadata = srsly.read_json(self.index_path + "/metadata.json")
+        metadata_path = (version_path or self._version_path()) + "/metadata.json"
+        model_metadata = srsly.read_json(metadata_path)
         index_config = self.model_index.export_metadata()
         index_config["index_name"] = self.index_name
         # Ensure that the additional metadata we store does not collide with anything else.
-        model_metadata["colbertdb"] = {"index_config": index_config}  # type: ignore
-        srsly.write_json(self.index_path + "/metadata.json", model_metadata)
-        self._write_collection_files_to_disk()
+        model_metadata["colbertdb"] = {  # type: ignore
+            "index_config": index_config,
+            "quantize_encoder": self.quantize_encoder,
+            "encoder_backend": self.encoder_backend,
+        }
+        srsly.write_json(metadata_path, model_metadata)
 
     def index(
         self,
@@ -392,7 +634,49 @@ class ColbertPLAID:
         Returns:
             str: The path to the index.
         """
-        self.collection = collection
+        docids = [pid_docid_map[pid] for pid in range(len(collection))]
+        return self.index_stream(
+            [(collection, docids, docid_metadata_map)],
+            index_name=index_name,
+            max_document_length=max_document_length,
+            overwrite=overwrite,
+            bsize=bsize,
+        )
+
+    def index_stream(
+        self,
+        batches: Iterable[Tuple[List[str], List[str], Optional[Dict[str, dict]]]],
+        index_name: Optional["str"] = None,
+        max_document_length: int = 256,
+        overwrite: Union[bool, str] = "reuse",
+        bsize: int = 32,
+    ):
+        """
+        Indexes a collection that is read a batch at a time, without holding it in memory.
+
+        The passages, their document IDs and the metadata are written to disk as the batches are read.
+        The index is then built from the memory-mapped passages: the centroids are trained on a sample
+        of them, and the passages are encoded and compressed one chunk at a time.
+
+        The build records its completed stages in a BuildManifest. With `overwrite="resume"`, an
+        unfinished build of the collection is resumed from its first incomplete stage or chunk, and
+        the batches are not read again if their split was recorded.
+
+        Args:
+            batches (Iterable[Tuple[List[str], List[str], Optional[Dict[str, dict]]]]): The passages of
+                each batch, the document ID of each passage, and the metadata of the documents of the batch.
+            index_name (Optional[str], optional): The name of the index. If not provided, a default name will be used. Defaults to None.
+            max_document_length (int, optional): The maximum length of a document. Defaults to 256.
+            overwrite (Union[bool, str], optional): Specifies whether to overwrite an existing index, reuse it,
+                or "resume" an unfinished build. Defaults to "reuse".
+            bsize (int, optional): The batch size for indexing. Defaults to 32.
+
+        Returns:
+            str: The path to the index.
+
+        Raises:
+            ValueError: If a batch does not have one document ID per passage.
+        """
         self.config.doc_maxlen = max_document_length
 
         if index_name is not None:
@@ -410,32 +694,97 @@ class ColbertPLAID:
             Path(self.run_config.root) / Path(self.run_config.experiment) / "indexes"
         )
 
-        self.pid_docid_map = pid_docid_map
-
-        # inverted mapping for returning full docs
-        self.docid_pid_map = defaultdict(list)
-        for pid, docid in self.pid_docid_map.items():
-            self.docid_pid_map[docid].append(pid)
-
-        self.docid_metadata_map = docid_metadata_map
+        # Every build goes into a new version, which replaces the current one once complete.
+        # A resumed build continues the newest unfinished one instead, any other build discards them.
+        self.index_versions = IndexVersions(self.index_path)
+        version = None
+        if overwrite == "resume":
+            version = self.index_versions.acquire_unfinished()
+        else:
+            self.index_versions.discard_unfinished()
+        if version is None:
+            version = self.index_versions.create()
+        version_path = self._version_path(version)
+        manifest = BuildManifest.start(version_path)
+        try:
+            if overwrite == "resume" and manifest.is_complete(SPLIT):
+                print(f"Resuming the unfinished build of {self.index_name}...")
+                # The metadata was split into the version with the passages, and is part of the stage.
+                self.metadata_store = MetadataStore.load(version_path)
+                self.collection = PassageStore(version_path)
+                self.docid_map = DocIdMap(version_path)
+            else:
+                self._split_to_disk(batches, version_path)
+                manifest.complete(
+                    SPLIT, [x.name for x in Path(version_path).iterdir() if x.is_file()]
+                )
 
-        self.model_index = PLAIDModelIndex.construct(
-            self.config,
-            self.checkpoint,
-            self.collection,
-            self.index_name,
-            overwrite,
-            verbose=1,
-            bsize=bsize,
-            store_name=self.store_name,
-        )
-        self.config = self.model_index.config
-        self._save_index_metadata()
+            self.model_index = PLAIDModelIndex.construct(
+                self.config,
+                self.checkpoint,
+                self.collection,
+                version_name(self.index_name, version),
+                overwrite,
+                verbose=1,
+                bsize=bsize,
+                store_name=self.store_name,
+                encoder_backend=self.encoder_backend,
+            )
+            self.model_index.quantized_encoder = self.quantize_encoder
+            self.config = self.model_index.config
+            self._save_index_metadata(version_path)
+        except Exception:
+            self.index_versions.release(version)
+            raise
+        self.index_versions.switch(version)
+        manifest.finish()
+        self._hold_version(version)
+        self.delta = DeltaSegment(len(self.collection), path=version_path)
+        # The metadata store of the version replaced the shared one.
+        self.metadata_store.close()
+        self.metadata_store = MetadataStore.load(self.index_path)
 
         print("Done indexing!")
 
         return self.index_path
 
+    def _split_to_disk(
+        self,
+        batches: Iterable[Tuple[List[str], List[str], Optional[Dict[str, dict]]]],
+        version_path: str,
+    ):
+        """
+        Writes the passages, document IDs and metadata of the batches to disk as they are read.
+
+        Args:
+            batches (Iterable[Tuple[List[str], List[str], Optional[Dict[str, dict]]]]): The batches, as described in `index_stream`.
+            version_path (str): The directory of the version being built.
+
+        Raises:
+            ValueError: If a batch does not have one document ID per passage.
+        """
+        # The document ID of every passage, in the format of a passage store, until the map is built.
+        docids_path = Path(version_path, "docids.tmp")
+        # The shared store keeps the metadata of the current version until this one replaces it.
+        self.metadata_store = MetadataStore.create(version_path)
+        with PassageStoreWriter(version_path) as passages_writer, PassageStoreWriter(
+            docids_path
+        ) as docids_writer:
+            for passages, docids, docid_metadata_map in batches:
+                if len(passages) != len(docids):
+                    raise ValueError("Every passage must have a document ID")
+                passages_writer.write(passages)
+                docids_writer.write(docids)
+                if docid_metadata_map:
+                    self.metadata_store.put_many(docid_metadata_map)
+                report_progress(passages_split=passages_writer.num_passages)
+
+        self.collection = PassageStore(version_path)
+        docids_store = PassageStore(docids_path)
+        self.docid_map = DocIdMap.create(version_path, docids_store)
+        docids_store.close()
+        shutil.rmtree(docids_path)
+
     def search(
         self,
         query: Union[str, list[str]],
@@ -443,7 +792,8 @@ class ColbertPLAID:
         k: int = 10,
         force_fast: bool = False,
         zero_index_ranks: bool = False,
-        doc_ids: Optional[List[str]] = None,
+        doc_ids: Optional[Union[List[str], List[Optional[List[str]]]]] = None,
+        search_params: Optional[SearchParams] = None,
     ):
         """
         Perform a search query on the index.
@@ -454,80 +804,151 @@ class ColbertPLAID:
             k (int): The number of search results to retrieve. Defaults to 10.
             force_fast (bool): Whether to force fast search. Defaults to False.
             zero_index_ranks (bool): Whether to use zero-indexed ranks in the search results. Defaults to False.
-            doc_ids (Optional[List[str]]): A list of document IDs to restrict the search to. Defaults to None.
+            doc_ids (Optional[Union[List[str], List[Optional[List[str]]]]]): A list of document IDs to restrict
+                the search to. For a list of queries, one list per query, where None does not restrict the query.
+                Defaults to None.
+            search_params (Optional[SearchParams]): The settings of this search, including its `k`, which
+                replace `k`. Defaults to None.
 
         Returns:
             Union[List[List[Dict[str, Any]]], List[Dict[str, Any]], None]: The search results. If only one query string is provided, a list of dictionaries is returned. If multiple query strings are provided, a list of lists of dictionaries is returned. If no results are found, None is returned.
         """
-        pids = None
-        if doc_ids is not None:
-            pids = []
-            for doc_id in doc_ids:
-                pids.extend(self.docid_pid_map[doc_id])
-
-        force_reload = index_name is not None and index_name != self.index_name
-        if index_name is not None:
-            if self.index_name is not None and self.index_name != index_name:
-                print(
-                    f"New index_name received!",
-                    f"Updating current index_name ({self.index_name}) to {index_name}",
-                )
-            self.index_name = index_name
-        else:
-            if self.index_name is None:
-                print(
-                    "Cannot search without an index_name! Please provide one.",
-                    "Returning empty results.",
-                )
-                return None
-
-        results = self.model_index.search(
-            self.config,
-            self.checkpoint,
-            self.collection,
-            self.index_name,
-            self.base_model_max_tokens,
-            query,
-            k,
-            pids,
-            force_reload,
-            force_fast=force_fast,
-        )
-
-        to_return = []
-
-        for result in results:
-            result_for_query = []
-            for id_, rank, score in zip(*result):
-                document_id = self.pid_docid_map[id_]
-                result_dict = {
-                    "content": self.collection[id_],
-                    "score": score,
-                    "rank": rank - 1 if zero_index_ranks else rank,
-                    "document_id": document_id,
-                    "passage_id": id_,
-                }
+        # The index, passages and document ids are swapped together by updates.
+        with self.lock.read():
+            if isinstance(query, str):
+                pids, delta_pids = self._restrict_pids(doc_ids)
+                delta_scorer = partial(self._score_delta, pids=delta_pids)
+            else:
+                if doc_ids is not None and len(doc_ids) != len(query):
+                    raise ValueError("doc_ids must have one list per query")
+                restrictions = [
+                    self._restrict_pids(ids)
+                    for ids in (doc_ids if doc_ids is not None else [None] * len(query))
+                ]
+                pids = [query_pids for query_pids, _ in restrictions]
+                delta_scorer = [
+                    partial(self._score_delta, pids=delta_pids)
+                    for _, delta_pids in restrictions
+                ]
 
-                if self.docid_metadata_map is not None:
-                    if document_id in self.docid_metadata_map:
-                        doc_metadata = self.docid_metadata_map[document_id]
-                        result_dict["metadata"] = doc_metadata
+            force_reload = index_name is not None and index_name != self.index_name
+            if index_name is not None:
+                if self.index_name is not None and self.index_name != index_name:
+                    print(
+                        f"New index_name received!",
+                        f"Updating current index_name ({self.index_name}) to {index_name}",
+                    )
+                self.index_name = index_name
+            else:
+                if self.index_name is None:
+                    print(
+                        "Cannot search without an index_name! Please provide one.",
+                        "Returning empty results.",
+                    )
+                    return None
+
+            results = self.model_index.search(
+                self.config,
+                self.checkpoint,
+                self.collection,
+                self._version_name(),
+                self.base_model_max_tokens,
+                query,
+                k,
+                pids,
+                force_reload,
+                delta_scorer=delta_scorer if len(self.delta) > 0 else None,
+                force_fast=force_fast,
+                params=search_params,
+            )
 
-                result_for_query.append(result_dict)
+            to_return = []
 
-            to_return.append(result_for_query)
+            # Only the metadata of the returned documents is read from the store.
+            docids = {
+                id_: self.docid_map.docid(id_) for result in results for id_ in result[0]
+            }
+            docid_metadata_map = self.metadata_store.get_many(docids.values())
 
-        if len(to_return) == 1:
-            return to_return[0]
-        return to_return
+            for result in results:
+                result_for_query = []
+                for id_, rank, score in zip(*result):
+                    document_id = docids[id_]
+                    result_dict = {
+                        "content": self.collection[id_],
+                        "score": score,
+                        "rank": rank - 1 if zero_index_ranks else rank,
+                        "document_id": document_id,
+                        "passage_id": id_,
+                    }
+
+                    if document_id in docid_metadata_map:
+                        result_dict["metadata"] = docid_metadata_map[document_id]
+
+                    result_for_query.append(result_dict)
+
+                to_return.append(result_for_query)
+
+            if len(to_return) == 1:
+                return to_return[0]
+            return to_return
+
+    def _restrict_pids(
+        self, doc_ids: Optional[List[str]]
+    ) -> Tuple[Optional[List[int]], Optional[List[int]]]:
+        """The pids of the passages of some documents, in the index and in the delta segment."""
+        if doc_ids is None:
+            return None, None
+        pids = self.docid_map.pids(doc_ids)
+        return (
+            [pid for pid in pids if pid < self.delta.first_pid],
+            [pid for pid in pids if pid >= self.delta.first_pid],
+        )
 
     def _search(self, query: str, k: int, pids: Optional[List[int]] = None):
         assert self.model_index is not None
-        return self.model_index._search(query, k, pids)
+        params = self.model_index.resolve_search_params(
+            SearchParams(k=k), [query], self.base_model_max_tokens
+        )
+        return self.model_index._search(query, params, pids)
 
-    def _batch_search(self, query: list[str], k: int):
+    def _batch_search(
+        self, query: list[str], k: int, pids: Optional[List[Optional[List[int]]]] = None
+    ):
         assert self.model_index is not None
-        return self.model_index._batch_search(query, k)
+        params = self.model_index.resolve_search_params(
+            SearchParams(k=k), query, self.base_model_max_tokens
+        )
+        return self.model_index._batch_search(query, params, pids)
+
+    def _score_delta(
+        self, Q: torch.Tensor, k: int, pids: Optional[List[int]] = None
+    ) -> Tuple[List[int], List[float]]:
+        """
+        Scores the passages of the delta against an encoded query with exact MaxSim.
+
+        Args:
+            Q (torch.Tensor): The encoded query, of shape (1, tokens, dim).
+            k (int): The number of passages to return.
+            pids (Optional[List[int]]): The passages to restrict the search to. Defaults to None.
+
+        Returns:
+            Tuple[List[int], List[float]]: The pids and scores of the best k passages that have not been deleted.
+        """
+        all_pids, all_scores = [], []
+        for first_pid, embeddings, mask in self.delta.enumerate_batches():
+            batch_pids = np.arange(first_pid, first_pid + len(embeddings))
+            keep = self.docid_map.ordinals[batch_pids] != DELETED
+            if pids is not None:
+                keep &= np.isin(batch_pids, pids)
+            if not keep.any():
+                continue
+            keep_idx = torch.from_numpy(np.flatnonzero(keep)).to(embeddings.device)
+            scores = self._colbert_score(Q, embeddings[keep_idx], mask[keep_idx])
+            all_pids.extend(batch_pids[keep].tolist())
+            all_scores.extend(scores.cpu().tolist())
+        best = sorted(zip(all_scores, all_pids), reverse=True)[:k]
+        return [pid for _, pid in best], [score for score, _ in best]
 
     def _colbert_score(self, Q, D_padded, D_mask):
         if ColBERTConfig().total_visible_gpus > 0:
@@ -654,12 +1075,14 @@ class ColbertPLAID:
         if isinstance(queries, str):
             queries = [queries]
         maxlen = max([int(len(x.split(" ")) * 1.35) for x in queries])
-        self.inference_ckpt.query_tokenizer.query_maxlen = max(
-            min(maxlen, self.base_model_max_tokens), 32
-        )
         embedded_queries = [
             x.unsqueeze(0)
-            for x in self.inference_ckpt.queryFromText(queries, bsize=bsize)
+            for x in query_from_text(
+                self.query_ckpt,
+                queries,
+                query_maxlen=max(min(maxlen, self.base_model_max_tokens), 32),
+                bsize=bsize,
+            )
         ]
         return embedded_queries
 
@@ -689,9 +1112,18 @@ class ColbertPLAID:
                 )
                 print("BSIZE:")
                 print(bsize)
-        embedded_docs = self.inference_ckpt.docFromText(
-            documents, bsize=bsize, showprogress=verbose
-        )[0]
+        padding = PaddingStats()
+        embedded_docs = encode_documents(
+            self.inference_ckpt,
+            documents,
+            max_batch_tokens=bsize * self.inference_ckpt.doc_tokenizer.doc_maxlen,
+            keep_dims=True,
+            stats=padding,
+        )
+        if verbose:
+            print(
+                f"Encoded {len(documents)} documents with a padding efficiency of {padding.efficiency:.1%}"
+            )
         doc_mask = torch.full(embedded_docs.shape[:2], -float("inf")).to(
             embedded_docs.device
         )
@@ -757,10 +1189,10 @@ class ColbertPLAID:
             print(f"encodings: {encodings.shape}")
             print(f"doc_masks: {doc_masks.shape}")
 
-        if hasattr(self, "in_memory_collection"):
+        if getattr(self, "in_memory_collection", None) is not None:
             if self.in_memory_metadata is not None:
                 if document_metadatas is None:
-                    self.in_memory_metadatas.extend([None] * len(documents))
+                    self.in_memory_metadata.extend([None] * len(documents))
                 else:
                     self.in_memory_metadata.extend(document_metadatas)
             elif document_metadatas is not None:
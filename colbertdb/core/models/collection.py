@@ -1,16 +1,34 @@
 """ A module for the Collection class, which represents a collection of indexed and searchable documents."""
 
+from itertools import islice
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, TypeVar, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 from uuid import uuid4
 
+import srsly
+
 from colbertdb.core.models.store import Store
 from colbertdb.core.utils.documentutils import (
     llama_index_sentence_splitter,
     CorpusProcessor,
+    TokenChunker,
 )
 from colbertdb.core.models.colbertplaid import ColbertPLAID
 from colbertdb.core.models.pydantic_models import Document
+from colbertdb.core.models.search_params import SearchParams
+from colbertdb.core.utils.progress import report_progress
 
 
 class Collection:
@@ -23,6 +41,10 @@ class Collection:
     model_name: Union[str, None] = None
     model: Union[ColbertPLAID, None] = None
     corpus_processor: Optional[CorpusProcessor] = None
+    # The number of processes that split documents, see CorpusProcessor.
+    split_workers: int = 1
+    # The number of wordpieces consecutive chunks may share when documents are split into "tokens".
+    token_chunk_overlap: int = 0
 
     @classmethod
     def create(
@@ -31,6 +53,9 @@ class Collection:
         name: str,
         store_name: Optional[str] = "default",
         checkpoint: Union[str, Path] = ".data/.checkpoints/colbertv2.0",
+        resume: bool = False,
+        quantize_encoder: bool = False,
+        encoder_backend: str = "torch",
     ) -> "Collection":
         """Load a ColBERT model from a pre-trained checkpoint.
 
@@ -40,6 +65,10 @@ class Collection:
             verbose (int): The level of ColBERT verbosity requested. By default, 1, which will filter out most internal logs.
             index_root (Optional[str]): The root directory where indexes will be stored. If None, will use the default directory, '.ragatouille/'.
 
+            resume (bool): Whether to resume an unfinished build of the collection instead of starting over.
+            quantize_encoder (bool): Whether queries are encoded with the int8 encoder of the checkpoint, see ColbertPLAID. Saved with the collection.
+            encoder_backend (str): The backend that encodes queries and documents, "torch" or "onnx", see ColbertPLAID. Saved with the collection.
+
         Returns:
             cls (Collection): The current instance of Collection, with the model initialised.
         """
@@ -49,17 +78,88 @@ class Collection:
             store_name=store_name,
             load_from_index=False,
             checkpoint=checkpoint,
+            quantize_encoder=quantize_encoder,
+            encoder_backend=encoder_backend,
+        )
+        instance.index(
+            collection,
+            index_name=name,
+            overwrite_index="resume" if resume else True,
+            bsize=32,
+        )
+        return instance
+
+    @classmethod
+    def create_from_stream(
+        cls,
+        documents: Union[Iterable[Document], str, Path],
+        name: str,
+        store_name: Optional[str] = "default",
+        checkpoint: Union[str, Path] = ".data/.checkpoints/colbertv2.0",
+        batch_size: int = 1000,
+        resume: bool = False,
+        quantize_encoder: bool = False,
+        encoder_backend: str = "torch",
+    ) -> "Collection":
+        """Create a collection from documents that are read as it is indexed, for corpora that do not fit in memory.
+
+        Parameters:
+            documents (Union[Iterable[Document], str, Path]): An iterable of documents, or the path to a JSONL file with one document per line.
+            name (str): The name of the index.
+            store_name (Optional[str]): The name of the store. Defaults to "default".
+            checkpoint (Union[str, Path]): The path to the checkpoint.
+            batch_size (int): The number of documents that are split and written to disk at a time.
+            resume (bool): Whether to resume an unfinished build of the collection instead of starting over.
+            quantize_encoder (bool): Whether queries are encoded with the int8 encoder of the checkpoint, see ColbertPLAID. Saved with the collection.
+            encoder_backend (str): The backend that encodes queries and documents, "torch" or "onnx", see ColbertPLAID. Saved with the collection.
+
+        Returns:
+            cls (Collection): The new collection.
+        """
+        instance = cls()
+        instance.model = ColbertPLAID(
+            index_name=name,
+            store_name=store_name,
+            load_from_index=False,
+            checkpoint=checkpoint,
+            quantize_encoder=quantize_encoder,
+            encoder_backend=encoder_backend,
+        )
+        instance.index_stream(
+            documents,
+            index_name=name,
+            overwrite_index="resume" if resume else True,
+            bsize=32,
+            batch_size=batch_size,
         )
-        instance.index(collection, index_name=name, bsize=32)
         return instance
 
     @classmethod
-    def load(cls, name: str, store_name: str = "default") -> "Collection":
-        """Load an Index and the associated ColBERT encoder from an existing document index."""
+    def load(
+        cls,
+        name: str,
+        store_name: str = "default",
+        quantize_encoder: Optional[bool] = None,
+        encoder_backend: Optional[str] = None,
+    ) -> "Collection":
+        """Load an Index and the associated ColBERT encoder from an existing document index.
+
+        Parameters:
+            name (str): The name of the collection.
+            store_name (str): The name of the store. Defaults to "default".
+            quantize_encoder (Optional[bool]): Whether queries are encoded with the int8 encoder of the checkpoint.
+                Defaults to None, the setting the collection was saved with.
+            encoder_backend (Optional[str]): The backend that encodes queries and documents, "torch" or "onnx".
+                Defaults to None, the setting the collection was saved with.
+        """
         print(f"Loading index {name} from store {store_name}...")
         instance = cls()
         instance.model = ColbertPLAID(
-            index_name=name, store_name=store_name, load_from_index=True
+            index_name=name,
+            store_name=store_name,
+            load_from_index=True,
+            quantize_encoder=quantize_encoder,
+            encoder_backend=encoder_backend,
         )
         return instance
 
@@ -99,7 +199,7 @@ class Collection:
     def _process_corpus(
         self,
         collection: List[Document],
-        document_splitter_fn: Optional[Callable[[str], List[str]]],
+        document_splitter_fn: Optional[Union[Callable, Literal["tokens"]]],
         max_document_length: int,
     ) -> Tuple[List[str], Dict[int, str], Dict[str, Dict[Any, Any]]]:
         """
@@ -117,20 +217,22 @@ class Collection:
             collection_len=len(collection),
         )
 
+        report_progress(stage="splitting", documents_total=len(collection))
         if document_splitter_fn is not None:
             print("Splitting documents...")
-            self.corpus_processor = CorpusProcessor(
-                document_splitter_fn=document_splitter_fn,
-            )
-            collection_with_ids = self.corpus_processor.process_corpus(
-                document_corpus,
-                document_ids,
-                chunk_size=max_document_length,
+            self.corpus_processor = self._corpus_processor(
+                document_splitter_fn, max_document_length
             )
+            with self.corpus_processor:
+                collection_with_ids = self.corpus_processor.process_corpus(
+                    document_corpus,
+                    document_ids,
+                    chunk_size=max_document_length,
+                )
         else:
             collection_with_ids = [
                 {"document_id": x, "content": y}
-                for x, y in zip(document_ids, collection)
+                for x, y in zip(document_ids, document_corpus)
             ]
 
         pid_docid_map = {
@@ -147,7 +249,9 @@ class Collection:
         overwrite_index: Union[bool, str] = True,
         max_document_length: int = 256,
         split_documents: bool = True,
-        document_splitter_fn: Optional[Callable] = llama_index_sentence_splitter,
+        document_splitter_fn: Optional[
+            Union[Callable, Literal["tokens"]]
+        ] = llama_index_sentence_splitter,
         bsize: int = 32,
     ):
         """Build an index from a list of documents.
@@ -156,38 +260,170 @@ class Collection:
             collection (list[str]): The collection of documents to index.
             document_ids (Optional[list[str]]): An optional list of document ids. Ids will be generated at index time if not supplied.
             index_name (str): The name of the index that will be built.
-            overwrite_index (Union[bool, str]): Whether to overwrite an existing index with the same name.
+            overwrite_index (Union[bool, str]): Whether to overwrite an existing index with the same name, or "resume" an unfinished build.
             max_document_length (int): The maximum length of a document. Documents longer than this will be split into chunks.
             split_documents (bool): Whether to split documents into chunks.
-            document_splitter_fn (Optional[Callable]): A function to split documents into chunks. If None and by default, will use the llama_index_sentence_splitter.
+            document_splitter_fn (Optional[Union[Callable, Literal["tokens"]]]): A function to split documents into chunks, or "tokens" to pack whole sentences into chunks of `max_document_length` wordpieces of the encoder. If None and by default, will use the llama_index_sentence_splitter.
             preprocessing_fn (Optional[Union[Callable, list[Callable]]]): A function or list of functions to preprocess documents. If None and by default, will not preprocess documents.
             bsize (int): The batch size to use for encoding the passages.
 
         Returns:
             index (str): The path to the index that was built.
         """
-        if not split_documents:
-            document_splitter_fn = None
-        collection, pid_docid_map, docid_metadata_map = self._process_corpus(
+        # The documents are split as they are indexed, so a resumed build does not split them again.
+        return self.index_stream(
             collection,
-            document_splitter_fn,
-            max_document_length,
+            index_name=index_name,
+            overwrite_index=overwrite_index,
+            max_document_length=max_document_length,
+            split_documents=split_documents,
+            document_splitter_fn=document_splitter_fn,
+            bsize=bsize,
         )
-        return self.model.index(
-            collection,
-            pid_docid_map=pid_docid_map,
-            docid_metadata_map=docid_metadata_map,
+
+    def index_stream(
+        self,
+        documents: Union[Iterable[Document], str, Path],
+        index_name: str = None,
+        overwrite_index: Union[bool, str] = True,
+        max_document_length: int = 256,
+        split_documents: bool = True,
+        document_splitter_fn: Optional[
+            Union[Callable, Literal["tokens"]]
+        ] = llama_index_sentence_splitter,
+        bsize: int = 32,
+        batch_size: int = 1000,
+    ):
+        """Build an index from documents that are read, split and written to disk a batch at a time.
+
+        Neither the documents nor their embeddings are ever all held in memory: the passages are
+        written to the passage store as they are split, and the index is built from it a chunk at a time.
+        Documents keep their `document_id` if they have one, and get a generated one otherwise.
+
+        Parameters:
+            documents (Union[Iterable[Document], str, Path]): An iterable of documents, or the path to a JSONL file with one document per line.
+            index_name (str): The name of the index that will be built.
+            overwrite_index (Union[bool, str]): Whether to overwrite an existing index with the same name, or "resume" an unfinished build.
+            max_document_length (int): The maximum length of a document. Documents longer than this will be split into chunks.
+            split_documents (bool): Whether to split documents into chunks.
+            document_splitter_fn (Optional[Union[Callable, Literal["tokens"]]]): A function to split documents into chunks, or "tokens" to pack whole sentences into chunks of `max_document_length` wordpieces of the encoder. If None and by default, will use the llama_index_sentence_splitter.
+            bsize (int): The batch size to use for encoding the passages.
+            batch_size (int): The number of documents that are split and written to disk at a time.
+
+        Returns:
+            index (str): The path to the index that was built.
+        """
+        if isinstance(documents, (str, Path)):
+            documents = read_jsonl_documents(documents)
+        if not split_documents:
+            document_splitter_fn = None
+        return self.model.index_stream(
+            self._stream_corpus(
+                documents, document_splitter_fn, max_document_length, batch_size
+            ),
             index_name=index_name,
             max_document_length=max_document_length,
             overwrite=overwrite_index,
             bsize=bsize,
         )
 
+    def _corpus_processor(
+        self,
+        document_splitter_fn: Union[Callable, Literal["tokens"]],
+        max_document_length: int,
+    ) -> CorpusProcessor:
+        """
+        Creates the corpus processor of a splitter, resolving "tokens" to a TokenChunker with the tokenizer of the encoder.
+
+        The tokenizer already runs on several threads, so a TokenChunker always runs in this process.
+        """
+        if document_splitter_fn == "tokens":
+            return CorpusProcessor(
+                document_splitter_fn=TokenChunker.for_doc_maxlen(
+                    self.model.inference_ckpt.doc_tokenizer.tok,
+                    max_document_length,
+                    overlap=self.token_chunk_overlap,
+                ),
+            )
+        return CorpusProcessor(
+            document_splitter_fn=document_splitter_fn,
+            num_workers=self.split_workers,
+        )
+
+    def _stream_corpus(
+        self,
+        documents: Iterable[Document],
+        document_splitter_fn: Optional[Union[Callable, Literal["tokens"]]],
+        max_document_length: int,
+        batch_size: int,
+    ) -> Iterator[Tuple[List[str], List[str], Dict[str, Dict[Any, Any]]]]:
+        """
+        Splits documents a batch at a time, yielding the passages of each batch, the document ID of
+        every passage and the metadata of the documents of the batch.
+
+        Raises:
+            ValueError: If a document ID is empty or is used by more than one document.
+        """
+        report_progress(stage="splitting", documents_split=0)
+        if hasattr(documents, "__len__"):
+            report_progress(documents_total=len(documents))
+        if document_splitter_fn is not None:
+            print("Splitting documents...")
+            self.corpus_processor = self._corpus_processor(
+                document_splitter_fn, max_document_length
+            )
+            # Batches large enough to keep every worker busy with a few shards.
+            num_workers = self.corpus_processor.num_workers
+            if num_workers > 1:
+                batch_size = max(
+                    batch_size, 4 * num_workers * self.corpus_processor.shard_size
+                )
+        seen_document_ids = set()
+        documents_split = 0
+        iterator = iter(documents)
+        try:
+            while batch := list(islice(iterator, batch_size)):
+                document_ids = [getattr(x, "document_id", None) for x in batch]
+                document_ids = [
+                    x if x is not None else str(uuid4()) for x in document_ids
+                ]
+                for document_id in document_ids:
+                    if not document_id.strip():
+                        raise ValueError("document_ids must not contain empty strings")
+                    if document_id in seen_document_ids:
+                        raise ValueError("document_ids must be unique")
+                    seen_document_ids.add(document_id)
+
+                if document_splitter_fn is not None:
+                    passages_with_ids = self.corpus_processor.process_corpus(
+                        [x.content for x in batch],
+                        document_ids,
+                        chunk_size=max_document_length,
+                    )
+                else:
+                    passages_with_ids = [
+                        {"document_id": x, "content": y.content}
+                        for x, y in zip(document_ids, batch)
+                    ]
+
+                documents_split += len(batch)
+                report_progress(documents_split=documents_split)
+                yield (
+                    [x["content"] for x in passages_with_ids],
+                    [x["document_id"] for x in passages_with_ids],
+                    {x: y.metadata or {} for x, y in zip(document_ids, batch)},
+                )
+        finally:
+            if document_splitter_fn is not None:
+                self.corpus_processor.close()
+
     def add_to_index(
         self,
         collection: list[Document],
         split_documents: bool = True,
-        document_splitter_fn: Optional[Callable] = llama_index_sentence_splitter,
+        document_splitter_fn: Optional[
+            Union[Callable, Literal["tokens"]]
+        ] = llama_index_sentence_splitter,
         bsize: int = 32,
     ):
         """Add documents to an existing index.
@@ -217,6 +453,14 @@ class Collection:
             bsize=bsize,
         )
 
+    def merge_delta(self, bsize: int = 32):
+        """Merge the documents added since the last merge into the index, waiting for a running merge.
+
+        Parameters:
+            bsize (int): The batch size to use for encoding the passages, if the index is rebuilt.
+        """
+        self.model.merge_delta(bsize=bsize)
+
     def delete_from_index(
         self,
         document_ids: Union[TypeVar("T"), List[TypeVar("T")]],
@@ -245,6 +489,7 @@ class Collection:
         force_fast: bool = False,
         zero_index_ranks: bool = False,
         doc_ids: Optional[list[str]] = None,
+        search_params: Optional[SearchParams] = None,
         **kwargs,
     ):
         """Query an index.
@@ -255,6 +500,8 @@ class Collection:
             k (int): The number of results to return for each query.
             force_fast (bool): Whether to force the use of a faster but less accurate search method.
             zero_index_ranks (bool): Whether to zero the index ranks of the results. By default, result rank 1 is the highest ranked result
+            doc_ids (Optional[list[str]]): The documents to restrict the search to.
+            search_params (Optional[SearchParams]): The PLAID settings of the search, such as a profile's. Its `k` is replaced by `k`.
 
         Returns:
             results (Union[list[dict], list[list[dict]]]): A list of dict containing individual results for each query. If a list of queries is provided, returns a list of lists of dicts. Each result is a dict with keys `content`, `score`, `rank`, and 'document_id'. If metadata was indexed for the document, it will be returned under the "document_metadata" key.
@@ -277,9 +524,51 @@ class Collection:
             force_fast=force_fast,
             zero_index_ranks=zero_index_ranks,
             doc_ids=doc_ids,
+            search_params=search_params.replace(k=k) if search_params else None,
             **kwargs,
         )
 
+    def search_batch(
+        self,
+        queries: list[str],
+        k: Union[int, list[Optional[int]]] = 10,
+        zero_index_ranks: bool = False,
+        force_fast: bool = False,
+        search_params: Optional[SearchParams] = None,
+        doc_ids: Optional[list[Optional[list[str]]]] = None,
+    ) -> list[list[dict[str, Any]]]:
+        """Query an index with a batch of queries at once.
+
+        The queries are encoded in a single forward pass and share candidate generation.
+
+        Parameters:
+            queries (list[str]): The queries to search for.
+            k (Union[int, list[Optional[int]]]): The number of results to return, either for every query or per query.
+            zero_index_ranks (bool): Whether to zero the index ranks of the results. By default, result rank 1 is the highest ranked result
+            force_fast (bool): Whether to force the use of a faster but less accurate search method.
+            search_params (Optional[SearchParams]): The PLAID settings of the search, shared by every query. Its `k` is replaced by `k`.
+            doc_ids (Optional[list[Optional[list[str]]]]): The documents to restrict each query to, one list per query, where None does not restrict the query.
+
+        Returns:
+            results (list[list[dict]]): A list of results for each query, in the same order as the queries.
+        """
+        ks = k if isinstance(k, list) else [k] * len(queries)
+        if len(ks) != len(queries):
+            raise ValueError("k must be an int or a list with one value per query")
+        ks = [x if x else 10 for x in ks]
+
+        results = self.model.search(
+            query=queries,
+            k=max(ks),
+            force_fast=force_fast,
+            zero_index_ranks=zero_index_ranks,
+            doc_ids=doc_ids,
+            search_params=search_params.replace(k=max(ks)) if search_params else None,
+        )
+        if len(queries) == 1:
+            results = [results]
+        return [result[:query_k] for result, query_k in zip(results, ks)]
+
     def rerank(
         self,
         query: Union[str, list[str]],
@@ -370,3 +659,18 @@ class Collection:
             force (bool): Whether to force the clearing of encoded documents without enforcing a 10s wait time.
         """
         self.model.clear_encoded_docs(force=force)
+
+
+def read_jsonl_documents(path: Union[str, Path]) -> Iterator[Document]:
+    """
+    Read documents lazily from a JSONL file.
+
+    Args:
+        path (Union[str, Path]): The file, with one JSON object per line with a `content` key and
+            optionally `document_id` and `metadata` keys.
+
+    Returns:
+        Iterator[Document]: The documents, in the order of the file.
+    """
+    for line in srsly.read_jsonl(path):
+        yield Document(**line)
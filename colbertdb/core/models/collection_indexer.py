@@ -0,0 +1,435 @@
+"""
+The colbert indexing pipeline, adapted to encode with the shared checkpoints and to report progress.
+
+The passages can also come with embeddings that were already computed, which are then indexed
+instead of encoding the passages again. They are given as an object with a
+`lookup(pids) -> (embeddings, doclens)` method, which returns the float32 embeddings of some
+passages of the collection, concatenated in pid order, and the number of embeddings of each.
+The centroids of a previous index can also be given to initialise k-means, and the centroids
+can be trained by another engine than faiss, such as `PLAIDModelIndex.pytorch_kmeans`.
+
+Builds recorded in a BuildManifest record their stages as they complete, and a build resumed
+with `overwrite="resume"` skips the stages that were recorded.
+"""
+
+import os
+
+import torch
+import colbert.utils.distributed as distributed
+import torch.multiprocessing as mp
+import tqdm
+from colbert import Indexer
+from colbert.data import Collection
+from colbert.indexing.collection_encoder import CollectionEncoder
+from colbert.indexing.collection_indexer import CollectionIndexer
+from colbert.indexing.index_saver import IndexSaver
+from colbert.infra import ColBERTConfig, Run
+from colbert.infra.launcher import Launcher
+
+try:
+    import faiss
+except ImportError:
+    print("WARNING: faiss must be imported for indexing")
+
+from colbertdb.core.models.build_manifest import IVF, KMEANS, BuildManifest
+from colbertdb.core.models.checkpoint_registry import checkpoint_registry
+from colbertdb.core.utils.length_batching import PaddingStats, encode_documents
+from colbertdb.core.utils.progress import report_progress
+from colbertdb.core.utils.torch_kmeans import warm_start_centroids
+
+
+def encode(
+    config,
+    collection,
+    shared_lists,
+    shared_queues,
+    verbose: int = 3,
+    embeddings=None,
+    init_centroids=None,
+    kmeans_engine=None,
+    encoder_backend="torch",
+):
+    """Launcher entry point, the equivalent of `colbert.indexing.collection_indexer.encode`."""
+    _ = shared_queues
+    encoder = ColbertDBCollectionIndexer(
+        config=config,
+        collection=collection,
+        verbose=verbose,
+        embeddings=embeddings,
+        init_centroids=init_centroids,
+        kmeans_engine=kmeans_engine,
+        encoder_backend=encoder_backend,
+    )
+    encoder.run(shared_lists)
+
+
+class ColbertDBCollectionIndexer(CollectionIndexer):
+    """
+    A colbert CollectionIndexer that encodes with a view of a shared checkpoint
+    and reports its progress through `report_progress`.
+
+    If `embeddings` are given, the passages are not encoded: the centroids are trained on a
+    sample of these embeddings and all of them are compressed with the new centroids.
+    If `init_centroids` are given, k-means starts from them instead of from random points.
+    If a `kmeans_engine` is given, it trains the centroids instead of faiss. It is called like
+    `_train_kmeans`, with this indexer, the sample and the shared lists.
+    The passages are encoded with the `encoder_backend` of the checkpoint, "torch" or "onnx".
+    """
+
+    # Training stops once an iteration lowers the inertia by less than this fraction.
+    kmeans_tolerance = 1e-3
+
+    # pylint: disable=super-init-not-called
+    def __init__(
+        self,
+        config: ColBERTConfig,
+        collection,
+        verbose: int = 2,
+        embeddings=None,
+        init_centroids=None,
+        kmeans_engine=None,
+        encoder_backend="torch",
+    ):
+        self.verbose = verbose
+        self.embeddings = embeddings
+        self.init_centroids = init_centroids
+        self.kmeans_engine = kmeans_engine
+        self.config = config
+        self.rank, self.nranks = self.config.rank, self.config.nranks
+
+        self.use_gpu = self.config.total_visible_gpus > 0
+
+        if self.config.rank == 0 and self.verbose > 1:
+            self.config.help()
+
+        self.collection = Collection.cast(collection)
+        self.checkpoint = checkpoint_registry.view(
+            self.config.checkpoint, colbert_config=self.config, backend=encoder_backend
+        )
+
+        self.encoder = ColbertDBCollectionEncoder(config, self.checkpoint)
+        # Ranks in other processes would race on the record of the build.
+        self.manifest = (
+            BuildManifest.load(config.index_path_) if self.nranks == 1 else None
+        )
+        self.saver = ColbertDBIndexSaver(config, self.manifest)
+
+    def run(self, shared_lists):
+        """
+        Run the stages of the build, like `CollectionIndexer.run`.
+
+        If the build is resumed, the stages its manifest records are skipped: the plan and codec
+        are loaded instead of sampling and training the centroids again, the recorded chunks are
+        not encoded again, and neither is the IVF built again.
+        """
+        resume = self.config.resume and self.manifest is not None
+        with torch.inference_mode():
+            if resume and self.manifest.is_complete(KMEANS) and self._try_load_plan():
+                Run().print_main("#> Resuming the build after k-means.")
+                report_progress(
+                    stage="sampling",
+                    passages_total=len(self.collection),
+                    chunks_total=self.num_chunks,
+                )
+            else:
+                # The sample of an interrupted k-means is gone, so its plan cannot be reused.
+                if resume and os.path.exists(self._plan_path()):
+                    os.remove(self._plan_path())
+                self.setup()
+                distributed.barrier(self.rank)
+                # Without a manifest, colbert resumes from any codec that was saved.
+                if resume or not self.config.resume or not self.saver.try_load_codec():
+                    self.train(shared_lists)
+                if self.manifest is not None:
+                    self.manifest.complete(
+                        KMEANS,
+                        ["plan.json", "centroids.pt", "avg_residual.pt", "buckets.pt"],
+                    )
+            distributed.barrier(self.rank)
+
+            self.index()
+            distributed.barrier(self.rank)
+
+            if resume and self.manifest.is_complete(IVF):
+                return
+            self.finalize()
+            distributed.barrier(self.rank)
+            if self.manifest is not None:
+                self.manifest.complete(
+                    IVF,
+                    ["ivf.pid.pt", "metadata.json"]
+                    + [f"{i}.metadata.json" for i in range(self.num_chunks)],
+                )
+
+    def _plan_path(self) -> str:
+        return os.path.join(self.config.index_path_, "plan.json")
+
+    def _chunk_is_saved(self, chunk_idx: int) -> bool:
+        """Check whether a resumed build already saved a chunk."""
+        if not self.config.resume:
+            return False
+        if self.manifest is not None:
+            return self.manifest.has_chunk(chunk_idx)
+        return self.saver.check_chunk_exists(chunk_idx)
+
+    def setup(self):
+        report_progress(stage="sampling", passages_total=len(self.collection))
+        super().setup()
+        report_progress(chunks_total=self.num_chunks)
+
+    def _sample_embeddings(self, sampled_pids):
+        """Save the embeddings of the sampled passages of this rank, like `CollectionIndexer._sample_embeddings`."""
+        if self.embeddings is None:
+            return super()._sample_embeddings(sampled_pids)
+
+        local_pids = [
+            pid
+            for pid, _ in self.collection.enumerate(rank=self.rank)
+            if pid in sampled_pids
+        ]
+        local_sample_embs, doclens = self.embeddings.lookup(local_pids)
+        self.num_sample_embs = torch.tensor([local_sample_embs.size(0)])
+        self.avg_doclen_est = sum(doclens) / len(doclens) if doclens else 0
+
+        Run().print(
+            f"avg_doclen_est = {self.avg_doclen_est} \t len(local_sample) = {len(local_pids):,}"
+        )
+        torch.save(
+            local_sample_embs.half(),
+            os.path.join(self.config.index_path_, f"sample.{self.rank}.pt"),
+        )
+        return self.avg_doclen_est
+
+    def _train_kmeans(self, sample, shared_lists):
+        """
+        Train the centroids with faiss one iteration at a time, so that every iteration can be reported.
+
+        faiss subsamples the training points with a fixed seed, so restarting from the previous
+        centroids for each iteration is equivalent to a single run with all the iterations.
+        The iterations stop early once the inertia, the sum of the squared distances of the
+        points to their centroid, converges.
+        """
+        if self.kmeans_engine is not None:
+            return self.kmeans_engine(self, sample, shared_lists)
+        if self.use_gpu:
+            torch.cuda.empty_cache()
+
+        niters = self.config.kmeans_niters
+        kmeans = faiss.Kmeans(
+            self.config.dim,
+            self.num_partitions,
+            niter=1,
+            gpu=self.use_gpu,
+            verbose=False,
+            seed=123,
+        )
+        init_centroids = None
+        if self.init_centroids is not None:
+            init_centroids = warm_start_centroids(
+                sample, self.init_centroids, self.num_partitions
+            ).numpy()
+        sample = sample.float().numpy()
+
+        report_progress(stage="kmeans", kmeans_iteration=0, kmeans_iterations=niters)
+        inertia = None
+        for iteration in range(niters):
+            kmeans.train(sample, init_centroids=init_centroids)
+            init_centroids = kmeans.centroids
+            previous_inertia, inertia = inertia, float(kmeans.obj[-1])
+            report_progress(kmeans_iteration=iteration + 1, kmeans_inertia=inertia)
+            if (
+                previous_inertia is not None
+                and previous_inertia - inertia <= self.kmeans_tolerance * previous_inertia
+            ):
+                break
+        if self.verbose > 0:
+            Run().print_main(
+                f"#> K-means stopped after {iteration + 1} iterations "
+                f"with an inertia of {inertia:.2f}."
+            )
+
+        centroids = torch.from_numpy(kmeans.centroids)
+        centroids = torch.nn.functional.normalize(centroids, dim=-1)
+        if self.use_gpu:
+            centroids = centroids.half()
+        else:
+            centroids = centroids.float()
+
+        return centroids
+
+    def index(self):
+        """
+        Encode and save all the passages of the collection in chunks, like `CollectionIndexer.index`.
+        """
+        report_progress(stage="encoding", passages_encoded=0, chunks_written=0)
+        passages_encoded, chunks_written = 0, 0
+        with self.saver.thread():
+            batches = self.collection.enumerate_batches(rank=self.rank)
+            for chunk_idx, offset, passages in tqdm.tqdm(
+                batches, disable=self.rank > 0
+            ):
+                if self._chunk_is_saved(chunk_idx):
+                    if self.verbose > 2:
+                        Run().print_main(
+                            f"#> Found chunk {chunk_idx} in the index already, skipping encoding..."
+                        )
+                    continue
+                if self.embeddings is None:
+                    embs, doclens = self.encoder.encode_passages(passages)
+                else:
+                    embs, doclens = self.embeddings.lookup(
+                        range(offset, offset + len(passages))
+                    )
+                    embs = embs.half() if self.use_gpu else embs.float()
+                if self.use_gpu:
+                    assert embs.dtype == torch.float16
+                else:
+                    assert embs.dtype == torch.float32
+                    embs = embs.half()
+                if self.verbose > 1:
+                    Run().print_main(
+                        f"#> Saving chunk {chunk_idx}: \t {len(passages):,} passages "
+                        f"and {embs.size(0):,} embeddings. From #{offset:,} onward."
+                    )
+
+                self.saver.save_chunk(chunk_idx, offset, embs, doclens)
+                del embs, doclens
+
+                passages_encoded += len(passages)
+                chunks_written += 1
+                report_progress(
+                    passages_encoded=passages_encoded,
+                    chunks_written=chunks_written,
+                    padding_efficiency=round(self.encoder.padding.efficiency, 4),
+                )
+
+    def finalize(self):
+        report_progress(stage="finalizing")
+        super().finalize()
+
+
+class ColbertDBCollectionEncoder(CollectionEncoder):
+    """
+    A colbert CollectionEncoder that encodes passages in length-bucketed batches.
+
+    A batch holds at most `index_bsize * doc_maxlen` tokens, padding included, so short passages
+    are encoded many at a time. The tokens and padded tokens of all the batches are counted in
+    `padding`. Passages pooled with a `pool_factor` are encoded by colbert.
+    """
+
+    def __init__(self, config: ColBERTConfig, checkpoint):
+        super().__init__(config, checkpoint)
+        self.padding = PaddingStats()
+
+    def encode_passages(self, passages):
+        if self.config.pool_factor > 1:
+            return super().encode_passages(passages)
+
+        Run().print(f"#> Encoding {len(passages)} passages..")
+        if len(passages) == 0:
+            return None, None
+
+        with torch.inference_mode():
+            embs, doclens = encode_documents(
+                self.checkpoint,
+                passages,
+                max_batch_tokens=self.config.index_bsize * self.config.doc_maxlen,
+                stats=self.padding,
+            )
+        return embs, doclens
+
+
+class ColbertDBIndexSaver(IndexSaver):
+    """An IndexSaver that records the chunks it writes in the manifest of the build, if any."""
+
+    def __init__(self, config: ColBERTConfig, manifest=None):
+        super().__init__(config)
+        self.manifest = manifest
+
+    def _write_chunk_to_disk(self, chunk_idx, offset, compressed_embs, doclens):
+        super()._write_chunk_to_disk(chunk_idx, offset, compressed_embs, doclens)
+        if self.manifest is not None:
+            self.manifest.complete_chunk(
+                chunk_idx,
+                [
+                    f"{chunk_idx}.codes.pt",
+                    f"{chunk_idx}.residuals.pt",
+                    f"doclens.{chunk_idx}.json",
+                    f"{chunk_idx}.metadata.json",
+                ],
+            )
+
+
+class ColbertDBIndexer(Indexer):
+    """A colbert Indexer that runs the ColbertDBCollectionIndexer."""
+
+    embeddings = None
+    init_centroids = None
+    kmeans_engine = None
+    encoder_backend = "torch"
+
+    def index(
+        self,
+        name,
+        collection,
+        overwrite=False,
+        embeddings=None,
+        init_centroids=None,
+        kmeans_engine=None,
+        encoder_backend="torch",
+    ):
+        """
+        Index a collection, like `Indexer.index`.
+
+        Args:
+            name (str): The name of the index.
+            collection (Collection): The passages.
+            overwrite (Union[bool, str]): How to handle an existing index. Defaults to False.
+            embeddings (optional): The embeddings of the passages, to index instead of encoding
+                them, as described in this module. Defaults to None.
+            init_centroids (Optional[torch.Tensor]): The centroids of a previous index, to start
+                k-means from. Defaults to None.
+            kmeans_engine (Optional[Callable]): Trains the centroids instead of faiss, as
+                described in ColbertDBCollectionIndexer. Defaults to None.
+            encoder_backend (str): The backend that encodes the passages, "torch" or "onnx". Defaults to "torch".
+
+        Returns:
+            str: The path to the index.
+        """
+        self.embeddings = embeddings
+        self.init_centroids = init_centroids
+        self.kmeans_engine = kmeans_engine
+        self.encoder_backend = encoder_backend
+        return super().index(name, collection, overwrite=overwrite)
+
+    # Indexer.index calls its private `__launch`, which is mangled to this name.
+    def _Indexer__launch(self, collection):  # pylint: disable=invalid-name
+        launcher = Launcher(encode)
+        if self.config.nranks == 1 and self.config.avoid_fork_if_possible:
+            launcher.launch_without_fork(
+                self.config,
+                collection,
+                [],
+                [],
+                self.verbose,
+                self.embeddings,
+                self.init_centroids,
+                self.kmeans_engine,
+                self.encoder_backend,
+            )
+            return
+
+        manager = mp.Manager()
+        shared_lists = [manager.list() for _ in range(self.config.nranks)]
+        shared_queues = [manager.Queue(maxsize=1) for _ in range(self.config.nranks)]
+        launcher.launch(
+            self.config,
+            collection,
+            shared_lists,
+            shared_queues,
+            self.verbose,
+            self.embeddings,
+            self.init_centroids,
+            self.kmeans_engine,
+            self.encoder_backend,
+        )
@@ -0,0 +1,173 @@
+"""
+The passages added to a collection since its index was last built or merged into.
+
+Adding a passage to the compressed index means updating the IVF and the residual chunks on
+disk, and rebuilding it means retraining the centroids. Passages are instead first kept here
+with their uncompressed embeddings, where they are searchable as soon as they are encoded, and
+are merged into the index in batches.
+
+The batches are also saved in a `delta` directory of the version of the index, one file per
+batch named by the pid of its first passage, so loading the collection does not encode them
+again. The pids of a version only ever grow, so a file that is left behind still holds the
+embeddings of its passages.
+"""
+
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import torch
+
+DELTA_DIR = "delta"
+
+
+class DeltaSegment:
+    """
+    Passages with the pids that follow the ones of the index, and their uncompressed embeddings.
+
+    The embeddings are kept in the padded batches they were encoded in, which are searched
+    exhaustively with MaxSim. Merges take the oldest batches, so passages added during a merge
+    stay in the segment.
+
+    Args:
+        first_pid (int): The pid of the first passage of the segment, the number of passages of the index.
+        batches (Optional[List[Tuple[torch.Tensor, torch.Tensor]]]): The padded embeddings and mask of
+            each batch of passages, in pid order. Defaults to None.
+        path (Optional[Union[str, Path]]): The directory of the version of the index the batches are
+            saved in. Defaults to None, which keeps them in memory only.
+    """
+
+    def __init__(
+        self,
+        first_pid: int,
+        batches: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None,
+        path: Optional[Union[str, Path]] = None,
+    ):
+        self.first_pid = first_pid
+        self.batches = batches or []
+        self.path = Path(path) / DELTA_DIR if path is not None else None
+
+    @classmethod
+    def load(
+        cls, path: Union[str, Path], first_pid: int, num_pids: int
+    ) -> "DeltaSegment":
+        """
+        Load the batches saved in a version of the index.
+
+        The batches are read in pid order from `first_pid`, up to the first passage that has
+        no saved batch, or that is not among the `num_pids` passages of the version.
+
+        Args:
+            path (Union[str, Path]): The directory of the version of the index.
+            first_pid (int): The number of passages of the index.
+            num_pids (int): The number of passages of the version.
+
+        Returns:
+            DeltaSegment: The segment, whose `end_pid` is the first passage that was not loaded.
+        """
+        delta = cls(first_pid, path=path)
+        saved = {}
+        if delta.path.exists():
+            saved = {
+                int(file.stem): file
+                for file in delta.path.glob("*.pt")
+                if file.stem.isdigit()
+            }
+        while delta.end_pid in saved:
+            batch = torch.load(saved[delta.end_pid], weights_only=True)
+            if delta.end_pid + len(batch["embeddings"]) > num_pids:
+                break
+            delta.batches.append((batch["embeddings"], batch["mask"]))
+        return delta
+
+    def __len__(self) -> int:
+        return sum(len(embeddings) for embeddings, _ in self.batches)
+
+    @property
+    def end_pid(self) -> int:
+        """The pid that follows the last passage of the segment."""
+        return self.first_pid + len(self)
+
+    def __contains__(self, pid: int) -> bool:
+        return self.first_pid <= pid < self.end_pid
+
+    def append(self, embeddings: torch.Tensor, mask: torch.Tensor):
+        """
+        Add a batch of passages, which get the next pids.
+
+        Args:
+            embeddings (torch.Tensor): The embeddings of the passages, padded to (passages, tokens, dim).
+            mask (torch.Tensor): Their mask, as returned by the encoder.
+        """
+        self._save(self.end_pid, embeddings, mask)
+        self.batches.append((embeddings, mask))
+
+    def enumerate_batches(
+        self,
+    ) -> Iterator[Tuple[int, torch.Tensor, torch.Tensor]]:
+        """Iterate over the batches with the pid of their first passage."""
+        pid = self.first_pid
+        for embeddings, mask in self.batches:
+            yield pid, embeddings, mask
+            pid += len(embeddings)
+
+    def flatten(self, num_batches: int) -> Tuple[torch.Tensor, List[int]]:
+        """
+        Return the embeddings of the oldest batches without padding, like the index encoder does.
+
+        The encoder zeroes the embeddings of padding and punctuation tokens, which the index
+        does not store.
+
+        Args:
+            num_batches (int): The number of batches.
+
+        Returns:
+            Tuple[torch.Tensor, List[int]]: The embeddings of every passage, concatenated, and
+                the number of embeddings of each passage.
+        """
+        flat, doclens = [], []
+        for embeddings, _ in self.batches[:num_batches]:
+            kept = embeddings.abs().sum(-1) != 0
+            flat.append(embeddings[kept])
+            doclens.extend(kept.sum(-1).tolist())
+        return torch.cat(flat), doclens
+
+    def drop(
+        self,
+        num_batches: int,
+        first_pid: Optional[int] = None,
+        path: Optional[Union[str, Path]] = None,
+    ):
+        """
+        Remove the oldest batches, once they are in the index.
+
+        Args:
+            num_batches (int): The number of batches.
+            first_pid (Optional[int]): The new pid of the first passage that is left, if the
+                index was rebuilt. Defaults to the pid that follows the removed passages.
+            path (Optional[Union[str, Path]]): The directory of the new version of the index, if
+                it was rebuilt, where the batches that are left are saved. Defaults to None.
+        """
+        removed = list(self.enumerate_batches())[:num_batches]
+        self.batches = self.batches[num_batches:]
+        if first_pid is None:
+            first_pid = self.first_pid + sum(len(embeddings) for _, embeddings, _ in removed)
+        self.first_pid = first_pid
+
+        if path is not None:
+            # The previous version, and its batches, are deleted once it is released.
+            self.path = Path(path) / DELTA_DIR
+            for pid, embeddings, mask in self.enumerate_batches():
+                self._save(pid, embeddings, mask)
+        elif self.path is not None:
+            for pid, _, _ in removed:
+                (self.path / f"{pid}.pt").unlink(missing_ok=True)
+
+    def _save(self, pid: int, embeddings: torch.Tensor, mask: torch.Tensor):
+        """Save a batch, replacing the file at once so a load never reads a partial one."""
+        if self.path is None:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path / f"{pid}.pt.tmp"
+        torch.save({"embeddings": embeddings, "mask": mask}, tmp_path)
+        os.replace(tmp_path, self.path / f"{pid}.pt")
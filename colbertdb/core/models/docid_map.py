@@ -0,0 +1,391 @@
+"""
+An on-disk mapping between passage ids and document ids, read through mmap.
+
+Every passage stores the ordinal of its document (`pid_docids.ordinals`, -1 once deleted),
+and the document ids themselves are interned in a string table (`docids.bin` and
+`docids.offsets`, in the format of the passage store). The inverse mapping is a CSR index:
+the pids of the document with ordinal `o` are `docid_pids.indices[indptr[o]:indptr[o + 1]]`.
+A document id is looked up in `docids.hash`, an open-addressing hash table of ordinals with
+linear probing. Every append gives its documents new ordinals, so a document that passages
+are added to has one ordinal per append, and the files only ever grow at their end.
+All the arrays are raw little-endian int64 files.
+"""
+
+import hashlib
+import os
+from collections.abc import Sequence as SequenceABC
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Union
+
+import numpy as np
+import srsly
+
+from colbertdb.core.models.passage_store import PassageStore
+
+ORDINALS_FILE = "pid_docids.ordinals"
+INDPTR_FILE = "docid_pids.indptr"
+INDICES_FILE = "docid_pids.indices"
+HASH_FILE = "docids.hash"
+LEGACY_PID_DOCID_MAP_FILE = "pid_docid_map.json"
+
+DELETED = -1
+# An unused slot of the hash table.
+_EMPTY = -1
+
+_DTYPE = np.dtype("<i8")
+
+
+class DocIdTable(PassageStore):
+    """The interned document ids of a DocIdMap, indexed by ordinal."""
+
+    blob_file = "docids.bin"
+    offsets_file = "docids.offsets"
+
+
+class DocIdMap:
+    """
+    Maps passage ids to document ids and back without a Python object per passage.
+
+    Looking up the document of a passage is O(1), and the passages of a document O(k) in its
+    number of passages. The reverse lookup of a document id probes the hash table on disk, so
+    nothing is built in memory when the map is opened, and the cost of every mutation depends
+    on the number of passages and documents it changes, not on the size of the map, apart from
+    the table doubling in size once half full.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        if not Path(path, HASH_FILE).exists():
+            # Maps written before the hash table was kept on disk.
+            table = DocIdTable(path)
+            _write_array(self.path / HASH_FILE, _build_hash(table, len(table)))
+            table.close()
+        self._reopen()
+        self.num_live = int(np.count_nonzero(self.ordinals != DELETED))
+
+    @classmethod
+    def exists(cls, path: Union[str, Path]) -> bool:
+        """Check whether a document id map exists in a directory."""
+        return Path(path, ORDINALS_FILE).exists()
+
+    @classmethod
+    def create(cls, path: Union[str, Path], docids: Iterable[str]) -> "DocIdMap":
+        """
+        Write a new document id map, replacing any existing one in the directory.
+
+        Args:
+            path (Union[str, Path]): The directory of the map.
+            docids (Iterable[str]): The document id of every passage, in pid order.
+
+        Returns:
+            DocIdMap: The new map.
+        """
+        _write_map(Path(path), docids)
+        return cls(path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], num_pids: int) -> "DocIdMap":
+        """
+        Open the document id map of a directory, converting a legacy `pid_docid_map.json` if needed.
+
+        Args:
+            path (Union[str, Path]): The directory of the map.
+            num_pids (int): The number of passages in the index, used to convert a legacy map
+                from which deleted passages were dropped.
+
+        Returns:
+            DocIdMap: The map.
+
+        Raises:
+            FileNotFoundError: If the directory has no document id map.
+        """
+        legacy_path = Path(path, LEGACY_PID_DOCID_MAP_FILE)
+        if not cls.exists(path) and legacy_path.exists():
+            print(f"Converting {legacy_path} to a document id map...")
+            pid_docid_map = {
+                int(pid): docid for pid, docid in srsly.read_json(legacy_path).items()
+            }
+            docid_map = cls.create(
+                path,
+                (pid_docid_map.get(pid, "") for pid in range(num_pids)),
+            )
+            docid_map.remove([pid for pid in range(num_pids) if pid not in pid_docid_map])
+            legacy_path.unlink()
+            return docid_map
+        if not cls.exists(path):
+            raise FileNotFoundError(f"No document id map in {path}")
+        return cls(path)
+
+    def close(self):
+        """Unmap the files of the map."""
+        self.table.close()
+        self.ordinals = self.indptr = self.indices = self.slots = None
+
+    def __len__(self) -> int:
+        """The number of passage ids, including the ones of deleted passages."""
+        return len(self.ordinals)
+
+    def __contains__(self, docid: str) -> bool:
+        """Check whether a document has passages that have not been deleted."""
+        return len(self.pids([docid])) > 0
+
+    def docid(self, pid: int) -> Optional[str]:
+        """Return the document id of a passage, or None if it was deleted."""
+        ordinal = int(self.ordinals[pid])
+        if ordinal == DELETED:
+            return None
+        return self.table[ordinal]
+
+    def pids(self, docids: Iterable[str]) -> List[int]:
+        """
+        Return the ids of the passages of some documents that have not been deleted.
+
+        Args:
+            docids (Iterable[str]): The document ids. Unknown ids are ignored.
+
+        Returns:
+            List[int]: The passage ids, grouped by document.
+        """
+        pids: List[int] = []
+        for docid in docids:
+            for ordinal in self._lookup(docid):
+                candidates = self.indices[self.indptr[ordinal] : self.indptr[ordinal + 1]]
+                pids.extend(candidates[self.ordinals[candidates] == ordinal].tolist())
+        return pids
+
+    def existing(self, docids: Iterable[str]) -> Set[str]:
+        """
+        Return which of some documents have passages that have not been deleted.
+
+        Args:
+            docids (Iterable[str]): The document ids, possibly repeated.
+
+        Returns:
+            Set[str]: The ids of the documents that are in the map.
+        """
+        return {docid for docid in set(docids) if docid in self}
+
+    def live_pids(self) -> np.ndarray:
+        """Return the ids of the passages that have not been deleted, in order."""
+        return np.flatnonzero(self.ordinals != DELETED)
+
+    def append(self, docids: Sequence[str]):
+        """
+        Give the next passage ids to the passages of some documents.
+
+        Args:
+            docids (Sequence[str]): The document id of every new passage, in pid order.
+        """
+        if len(docids) == 0:
+            return
+        # The documents of the batch get new ordinals, even those that already have passages,
+        # so the CSR index of the batch goes after the existing one.
+        num_docids = len(self.table)
+        ordinal_by_docid: Dict[str, int] = {}
+        ordinals = np.fromiter(
+            (
+                num_docids + ordinal_by_docid.setdefault(docid, len(ordinal_by_docid))
+                for docid in docids
+            ),
+            dtype=_DTYPE,
+            count=len(docids),
+        )
+        first_pid = len(self)
+
+        self.table.append(ordinal_by_docid.keys())
+        _append_array(self.path / ORDINALS_FILE, ordinals)
+        self.num_live += len(ordinals)
+        indptr, indices = _build_csr(ordinals - num_docids, len(ordinal_by_docid))
+        _append_array(self.path / INDPTR_FILE, int(self.indptr[-1]) + indptr[1:])
+        _append_array(self.path / INDICES_FILE, first_pid + indices)
+        self._reopen()
+        # The hash table is written last, so a lookup only finds ordinals that are mapped.
+        self._insert(ordinal_by_docid.keys(), num_docids)
+        self.slots = _read_array(self.path / HASH_FILE)
+
+    def remove(self, pids: Iterable[int]):
+        """
+        Mark passages as deleted. Their ids are not reused.
+
+        Args:
+            pids (Iterable[int]): The ids of the passages to delete.
+        """
+        pids = np.unique(np.asarray(list(pids), dtype=_DTYPE))
+        if len(pids) == 0:
+            return
+        self.num_live -= int(np.count_nonzero(self.ordinals[pids] != DELETED))
+        # Write the entries in place: flushing a writable memmap would sync the whole file.
+        # The passages of a document are consecutive, so the pids are written in runs.
+        runs = np.split(pids, np.flatnonzero(np.diff(pids) != 1) + 1)
+        with open(self.path / ORDINALS_FILE, "r+b") as f:
+            for run in runs:
+                os.pwrite(
+                    f.fileno(),
+                    np.full(len(run), DELETED, dtype=_DTYPE).tobytes(),
+                    int(run[0]) * _DTYPE.itemsize,
+                )
+        self._reopen()
+
+    def rewrite(self, docids: Iterable[str]):
+        """
+        Replace the content of the map, for example when the index was rebuilt.
+
+        Args:
+            docids (Iterable[str]): The document id of every passage, in pid order.
+        """
+        self.close()
+        _write_map(self.path, docids)
+        self._reopen()
+        self.num_live = int(np.count_nonzero(self.ordinals != DELETED))
+
+    def _lookup(self, docid: str) -> List[int]:
+        """Return the ordinals of a document id, in order, probing the hash table."""
+        mask = len(self.slots) - 1
+        slot = _docid_hash(docid) & mask
+        ordinals = []
+        while (ordinal := int(self.slots[slot])) != _EMPTY:
+            if self.table[ordinal] == docid:
+                ordinals.append(ordinal)
+            slot = (slot + 1) & mask
+        return sorted(ordinals)
+
+    def _insert(self, docids: Iterable[str], first_ordinal: int):
+        """
+        Add the new ordinals of some document ids to the hash table.
+
+        Args:
+            docids (Iterable[str]): The document ids, in the order of their ordinals.
+            first_ordinal (int): The ordinal of the first document id.
+        """
+        docids = list(docids)
+        num_docids = first_ordinal + len(docids)
+        if 2 * num_docids > len(self.slots):
+            # The table is rebuilt twice as large, so the probes stay short.
+            _write_array(self.path / HASH_FILE, _build_hash(self.table, num_docids))
+            return
+        mask = len(self.slots) - 1
+        new_slots: Dict[int, int] = {}
+        for ordinal, docid in enumerate(docids, first_ordinal):
+            slot = _docid_hash(docid) & mask
+            while self.slots[slot] != _EMPTY or slot in new_slots:
+                slot = (slot + 1) & mask
+            new_slots[slot] = ordinal
+        # Write the slots in place, like removals write the ordinals of the passages.
+        with open(self.path / HASH_FILE, "r+b") as f:
+            for slot, ordinal in new_slots.items():
+                os.pwrite(
+                    f.fileno(),
+                    np.array([ordinal], dtype=_DTYPE).tobytes(),
+                    slot * _DTYPE.itemsize,
+                )
+
+    def _reopen(self):
+        """Map the files again after they changed."""
+        self.table = DocIdTable(self.path)
+        self.ordinals = _read_array(self.path / ORDINALS_FILE)
+        self.indptr = _read_array(self.path / INDPTR_FILE)
+        self.indices = _read_array(self.path / INDICES_FILE)
+        self.slots = _read_array(self.path / HASH_FILE)
+
+
+class LivePassages(SequenceABC):
+    """
+    The passages of a store that have not been deleted, in pid order.
+
+    The length comes from the document id map, and the live pids are only listed when the
+    passages are read, so checking the size of a collection does not scan the map.
+    """
+
+    def __init__(self, store: Sequence[str], docid_map: DocIdMap):
+        self.store = store
+        self.docid_map = docid_map
+
+    @cached_property
+    def pids(self) -> np.ndarray:
+        """The ids of the passages that have not been deleted."""
+        return self.docid_map.live_pids()
+
+    def __len__(self) -> int:
+        return self.docid_map.num_live
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.store[self.pids[idx]]
+
+    def __iter__(self) -> Iterator[str]:
+        for pid in self.pids:
+            yield self.store[pid]
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _write_map(path: Path, docids: Iterable[str]):
+    """Write all the files of a map."""
+    path.mkdir(parents=True, exist_ok=True)
+    ordinal_by_docid: Dict[str, int] = {}
+    ordinals = np.fromiter(
+        (ordinal_by_docid.setdefault(docid, len(ordinal_by_docid)) for docid in docids),
+        dtype=_DTYPE,
+    )
+    DocIdTable.create(path, ordinal_by_docid.keys())
+    _write_array(path / ORDINALS_FILE, ordinals)
+    indptr, indices = _build_csr(ordinals, len(ordinal_by_docid))
+    _write_array(path / INDPTR_FILE, indptr)
+    _write_array(path / INDICES_FILE, indices)
+    _write_array(
+        path / HASH_FILE, _build_hash(ordinal_by_docid.keys(), len(ordinal_by_docid))
+    )
+
+
+def _build_csr(ordinals: np.ndarray, num_docids: int):
+    """Group the passage ids by document ordinal, skipping deleted passages."""
+    pids = np.flatnonzero(ordinals != DELETED)
+    live_ordinals = ordinals[pids]
+    order = np.argsort(live_ordinals, kind="stable")
+    indptr = np.zeros(num_docids + 1, dtype=_DTYPE)
+    np.cumsum(np.bincount(live_ordinals, minlength=num_docids), out=indptr[1:])
+    return indptr, pids[order].astype(_DTYPE)
+
+
+def _docid_hash(docid: str) -> int:
+    """Hash a document id the same way in every process, which hash() does not."""
+    return int.from_bytes(
+        hashlib.blake2b(docid.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def _build_hash(docids: Iterable[str], num_docids: int) -> np.ndarray:
+    """Build a hash table, less than half full, of document ids in the order of their ordinals."""
+    capacity = 1 << max(3, (2 * num_docids).bit_length())
+    mask = capacity - 1
+    slots = [_EMPTY] * capacity
+    for ordinal, docid in enumerate(docids):
+        slot = _docid_hash(docid) & mask
+        while slots[slot] != _EMPTY:
+            slot = (slot + 1) & mask
+        slots[slot] = ordinal
+    return np.array(slots, dtype=_DTYPE)
+
+
+def _read_array(path: Path) -> np.ndarray:
+    """Map a raw int64 array file, which np.memmap cannot do for an empty file."""
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=_DTYPE)
+    return np.memmap(path, dtype=_DTYPE, mode="r")
+
+
+def _write_array(path: Path, array: np.ndarray):
+    """Write a raw int64 array file, replacing the existing one once it is complete."""
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(np.ascontiguousarray(array, dtype=_DTYPE).tobytes())
+    os.replace(tmp_path, path)
+
+
+def _append_array(path: Path, array: np.ndarray):
+    """Append to a raw int64 array file."""
+    with open(path, "ab") as f:
+        f.write(np.ascontiguousarray(array, dtype=_DTYPE).tobytes())
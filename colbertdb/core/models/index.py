@@ -2,15 +2,401 @@
 https://github.com/bclavie/RAGatouille/blob/main/ragatouille/models/index.py
 """
 
+import copy
+import json
+import os
+import threading
+from dataclasses import asdict
+from functools import partial
 from pathlib import Path
-from typing import Any, List, Optional, TypeVar, Union
+from typing import Any, Callable, List, Optional, Sequence, Tuple, TypeVar, Union
 
 
-from colbert import Indexer, IndexUpdater, Searcher
+import torch
+from colbert import IndexUpdater, Searcher
+from colbert.data import Collection
+from colbert.indexing.codecs.residual_embeddings import ResidualEmbeddings
+from colbert.indexing.collection_encoder import CollectionEncoder
 from colbert.indexing.collection_indexer import CollectionIndexer
 from colbert.infra import ColBERTConfig, Run, RunConfig
+from colbert.search.index_storage import IndexScorer
+from colbert.search.strided_tensor import StridedTensor
 
+from colbertdb.core.models.checkpoint_registry import (
+    checkpoint_registry,
+    query_from_text,
+)
+from colbertdb.core.models.collection_indexer import ColbertDBIndexer
+from colbertdb.core.models.passage_store import ChainedPassages
+from colbertdb.core.models.search_params import SearchParams, dense_search_defaults
 from colbertdb.core.utils import torch_kmeans
+from colbertdb.core.utils.progress import report_progress
+
+
+def _as_colbert_collection(collection) -> Collection:
+    """
+    Wrap a sequence of passages, such as a PassageStore, in a colbert Collection.
+    """
+    if isinstance(collection, (str, list, Collection)):
+        return Collection.cast(collection)
+    return Collection(data=collection)
+
+
+# Scores the passages that are not in the index against an encoded query: (Q, k) -> (pids, scores)
+DeltaScorer = Callable[[torch.Tensor, int], Tuple[List[int], List[float]]]
+
+
+def _merge_results(
+    pids: List[int],
+    scores: List[float],
+    delta_pids: List[int],
+    delta_scores: List[float],
+    k: int,
+) -> list:
+    """Merge the best k results from the index and from the passages that are not in it yet."""
+    merged = sorted(
+        zip(list(pids) + list(delta_pids), list(scores) + list(delta_scores)),
+        key=lambda x: x[1],
+        reverse=True,
+    )[:k]
+    return [
+        [pid for pid, _ in merged],
+        list(range(1, len(merged) + 1)),
+        [score for _, score in merged],
+    ]
+
+
+class SharedCheckpointSearcher(Searcher):
+    """
+    A colbert Searcher that encodes queries with a view of a shared checkpoint
+    instead of loading its own copy of the model weights.
+
+    If `quantized`, queries are encoded with the int8 encoder of the checkpoint, and with
+    ONNX Runtime if `backend` is "onnx". The passages that updates add to the index are
+    encoded with `passage_checkpoint`, which never uses the int8 encoder.
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(
+        self,
+        index: str,
+        checkpoint: Optional[Union[str, Path]] = None,
+        collection: Optional[List[str]] = None,
+        config: Optional[ColBERTConfig] = None,
+        index_root: Optional[str] = None,
+        verbose: int = 3,
+        quantized: bool = False,
+        backend: str = "torch",
+    ):
+        self.verbose = verbose
+        initial_config = ColBERTConfig.from_existing(config, Run().config)
+
+        index_root = index_root if index_root else initial_config.index_root_
+        self.index = os.path.join(index_root, index)
+        self.index_config = ColBERTConfig.load_from_index(self.index)
+
+        checkpoint = str(checkpoint or self.index_config.checkpoint)
+        self.checkpoint_config = ColBERTConfig.load_from_checkpoint(checkpoint)
+        self.config = ColBERTConfig.from_existing(
+            self.checkpoint_config, self.index_config, initial_config
+        )
+
+        self.collection = _as_colbert_collection(
+            collection if collection is not None else self.config.collection
+        )
+        self.configure(checkpoint=checkpoint, collection=self.collection)
+
+        self.checkpoint = checkpoint_registry.view(
+            checkpoint, colbert_config=self.config, quantized=quantized, backend=backend
+        )
+        self.passage_checkpoint = self.checkpoint
+        if quantized:
+            self.passage_checkpoint = checkpoint_registry.view(
+                checkpoint, colbert_config=self.config, backend=backend
+            )
+        use_gpu = self.config.total_visible_gpus > 0
+        if self.config.load_index_with_mmap and use_gpu:
+            raise ValueError("Memory-mapped index can only be used with CPU!")
+        self.ranker = IndexScorer(
+            self.index, use_gpu, self.config.load_index_with_mmap
+        )
+
+
+def _staging_copy(searcher: Searcher) -> Searcher:
+    """
+    Copy a searcher so that its ranker can be updated while the original serves searches.
+
+    The copy shares the codec, config and checkpoint of the original. Only the objects
+    that an IndexUpdater reassigns attributes of are copied, and their tensors are
+    replaced rather than modified in place, so no tensor is copied here.
+    """
+    staging = copy.copy(searcher)
+    staging.ranker = copy.copy(searcher.ranker)
+    staging.ranker.embeddings = copy.copy(searcher.ranker.embeddings)
+    return staging
+
+
+def _merge_into_ivf(
+    ivf: torch.Tensor,
+    ivf_lengths: torch.Tensor,
+    codes: torch.Tensor,
+    doclens: List[int],
+    first_pid: int,
+):
+    """
+    Add the passages with the given centroid codes to an ivf, in a single pass over it.
+
+    The new pids are greater than all the existing ones, so appending them to the list of
+    each centroid keeps the lists sorted, like the passage-by-passage IndexUpdater does.
+
+    Args:
+        ivf (torch.Tensor): The pids of every centroid, concatenated.
+        ivf_lengths (torch.Tensor): The number of pids of every centroid.
+        codes (torch.Tensor): The centroid of every embedding of the new passages.
+        doclens (List[int]): The number of embeddings of every new passage.
+        first_pid (int): The pid of the first new passage.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: The new ivf and its lengths.
+    """
+    pids = torch.repeat_interleave(
+        torch.arange(first_pid, first_pid + len(doclens)), torch.tensor(doclens)
+    )
+    # Sorted by centroid, then pid, with each passage listed once per centroid.
+    centroids, pids = torch.unique(torch.stack((codes.long(), pids)), dim=1)
+    added_lengths = torch.bincount(centroids, minlength=len(ivf_lengths))
+    old_ends = torch.cumsum(ivf_lengths.long(), dim=0)
+    added_starts = torch.cumsum(added_lengths, dim=0) - added_lengths
+
+    new_ivf = torch.empty(len(ivf) + len(pids), dtype=ivf.dtype)
+    # Existing entries move back by the entries added to the centroids before theirs,
+    # and the new entries of a centroid go right after its existing ones.
+    old_centroids = torch.repeat_interleave(
+        torch.arange(len(ivf_lengths)), ivf_lengths.long()
+    )
+    new_ivf[torch.arange(len(ivf)) + added_starts[old_centroids]] = ivf
+    new_ivf[torch.arange(len(pids)) + old_ends[centroids]] = pids.to(ivf.dtype)
+    return new_ivf, (ivf_lengths + added_lengths).to(ivf_lengths.dtype)
+
+
+class SharedCheckpointIndexUpdater(IndexUpdater):
+    """
+    A colbert IndexUpdater that encodes new passages with the searcher's float32 checkpoint view.
+
+    The changes are made to a staging copy of the searcher, `self.searcher`, that replaces
+    the original once they are complete, so the original keeps serving searches in the
+    meantime. The ivf is taken from the searcher instead of being loaded from disk again,
+    and new passages are merged into it in one vectorized pass, so the cost of an update
+    grows with the number of passages it changes rather than with the size of the index.
+    Removed passages keep their embeddings in memory, where they are unreachable since
+    the ivf no longer lists them, until the index is loaded from disk again.
+
+    It also keeps the index consistent across updates: the searcher's ivf is padded with
+    zeros, which `remove` would otherwise take for pid 0, and `persist_to_disk` adds the
+    size of the whole index to `num_embeddings`, so it is recounted from the chunks.
+    """
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, config: ColBERTConfig, searcher: Searcher):
+        self.config = config
+        self.searcher = _staging_copy(searcher)
+        self.index_path = searcher.index
+        self.has_checkpoint = True
+        self.checkpoint = searcher.passage_checkpoint
+        self.encoder = CollectionEncoder(config, self.checkpoint)
+
+        ivf = searcher.ranker.ivf
+        self.curr_ivf_lengths = ivf.lengths
+        self.curr_ivf = ivf.tensor[: int(ivf.lengths.sum())]
+
+        self.removed_pids = []
+        self.first_new_emb = torch.sum(searcher.ranker.doclens).item()
+        self.first_new_pid = len(searcher.ranker.doclens)
+
+    def update_searcher(self, compressed_embs, doclens, curr_pid):
+        ranker = self.searcher.ranker
+        # The last 512 rows of the embeddings are padding for the strided views.
+        ranker.embeddings.codes = torch.cat(
+            (
+                ranker.embeddings.codes[:-512],
+                compressed_embs.codes,
+                ranker.embeddings.codes[-512:],
+            )
+        )
+        ranker.embeddings.residuals = torch.cat(
+            (
+                ranker.embeddings.residuals[:-512],
+                compressed_embs.residuals,
+                ranker.embeddings.residuals[-512:],
+            )
+        )
+        ranker.doclens = torch.cat((ranker.doclens, torch.tensor(doclens)))
+
+        self.curr_ivf, self.curr_ivf_lengths = _merge_into_ivf(
+            self.curr_ivf,
+            self.curr_ivf_lengths,
+            compressed_embs.codes,
+            doclens,
+            curr_pid,
+        )
+        ranker.ivf = StridedTensor(
+            self.curr_ivf, self.curr_ivf_lengths, use_gpu=False
+        )
+        ranker.set_embeddings_strided()
+
+    def add_embeddings(self, embs: torch.Tensor, doclens: List[int]) -> List[int]:
+        """
+        Add passages that were already encoded, like `add` does with their text.
+
+        Args:
+            embs (torch.Tensor): The embeddings of every passage, concatenated.
+            doclens (List[int]): The number of embeddings of each passage.
+
+        Returns:
+            List[int]: The pids of the passages.
+        """
+        start_pid = len(self.searcher.ranker.doclens)
+        compressed_embs = self.searcher.ranker.codec.compress(embs)
+        self.update_searcher(compressed_embs, doclens, start_pid)
+        return list(range(start_pid, start_pid + len(doclens)))
+
+    def _remove_pid_from_ivf(self, pids):
+        mask = torch.isin(
+            self.curr_ivf, torch.tensor(list(pids), dtype=self.curr_ivf.dtype)
+        )
+        centroids = torch.repeat_interleave(
+            torch.arange(len(self.curr_ivf_lengths)), self.curr_ivf_lengths.long()
+        )
+        removed_lengths = torch.bincount(
+            centroids[mask], minlength=len(self.curr_ivf_lengths)
+        )
+        self.curr_ivf = self.curr_ivf[~mask]
+        self.curr_ivf_lengths = self.curr_ivf_lengths - removed_lengths.to(
+            self.curr_ivf_lengths.dtype
+        )
+        self.searcher.ranker.ivf = StridedTensor(
+            self.curr_ivf, self.curr_ivf_lengths, use_gpu=False
+        )
+
+    def persist_to_disk(self):
+        super().persist_to_disk()
+        self._load_metadata()
+        self.metadata["num_embeddings"] = sum(
+            self._load_chunk_metadata(chunk_idx)["num_embeddings"]
+            for chunk_idx in range(self.metadata["num_chunks"])
+        )
+        with open(
+            os.path.join(self.index_path, "metadata.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(self.metadata, f)
+
+
+def _token_indices(
+    offsets: torch.Tensor, doclens: torch.Tensor, pids: torch.Tensor
+) -> torch.Tensor:
+    """Return the indices of the embeddings of some passages, concatenated in the given order."""
+    lengths = doclens[pids].long()
+    ends = lengths.cumsum(0)
+    return torch.arange(int(ends[-1]) if len(ends) else 0) + torch.repeat_interleave(
+        offsets[pids] - (ends - lengths), lengths
+    )
+
+
+class IndexedEmbeddings:
+    """
+    The embeddings of passages that were already encoded, to rebuild an index without
+    encoding them again.
+
+    The passages of the loaded index are decompressed from their residual codes, and the
+    passages that follow it come with their full-precision embeddings. The new index gets
+    new centroids and compresses these embeddings again, so only the passages that were
+    never indexed carry no quantization error.
+
+    Args:
+        searcher (Searcher): The searcher of the loaded index.
+        pids (Sequence[int]): The pid of every passage of the new collection, in increasing
+            order. Pids past the loaded index are passages of `new_embeddings`.
+        new_embeddings (torch.Tensor): The embeddings of the passages that follow the loaded
+            index, concatenated.
+        new_doclens (List[int]): The number of embeddings of each of these passages.
+    """
+
+    def __init__(
+        self,
+        searcher: Searcher,
+        pids: Sequence[int],
+        new_embeddings: torch.Tensor,
+        new_doclens: List[int],
+    ):
+        ranker = searcher.ranker
+        self.codec = ranker.codec
+        self.codes = ranker.embeddings.codes
+        self.residuals = ranker.embeddings.residuals
+        self.doclens = ranker.doclens
+        self.offsets = torch.cumsum(self.doclens, 0) - self.doclens
+        self.pids = torch.as_tensor(pids, dtype=torch.long)
+
+        self.new_embeddings = new_embeddings.float().cpu()
+        self.new_doclens = torch.tensor(new_doclens, dtype=torch.long)
+        self.new_offsets = torch.cumsum(self.new_doclens, 0) - self.new_doclens
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def lookup(self, positions: Sequence[int]) -> Tuple[torch.Tensor, List[int]]:
+        """
+        Return the embeddings of some passages of the new collection.
+
+        Args:
+            positions (Sequence[int]): The positions of the passages in the new collection,
+                in increasing order.
+
+        Returns:
+            Tuple[torch.Tensor, List[int]]: The float32 embeddings of the passages, concatenated,
+                and the number of embeddings of each.
+        """
+        pids = self.pids[torch.as_tensor(list(positions), dtype=torch.long)]
+        indexed = pids < len(self.doclens)
+        indexed_pids, new_pids = pids[indexed], pids[~indexed] - len(self.doclens)
+
+        tokens = _token_indices(self.offsets, self.doclens, indexed_pids)
+        embeddings = [self.new_embeddings[:0]]
+        if len(tokens) > 0:
+            compressed = ResidualEmbeddings(self.codes[tokens], self.residuals[tokens])
+            embeddings.append(self.codec.decompress(compressed).float().cpu())
+        embeddings.append(
+            self.new_embeddings[
+                _token_indices(self.new_offsets, self.new_doclens, new_pids)
+            ]
+        )
+        doclens = self.doclens[indexed_pids].tolist() + self.new_doclens[new_pids].tolist()
+        return torch.cat(embeddings), doclens
+
+
+class IndexUpdate:
+    """
+    A change to an index that has been written to disk but is not searched yet.
+
+    Attributes:
+        rebuilt (bool): Whether the index was rebuilt, in which case the passage ids start again from 0.
+    """
+
+    def __init__(
+        self,
+        model_index: "PLAIDModelIndex",
+        searcher: Optional[Searcher],
+        rebuilt: bool = False,
+    ):
+        self.model_index = model_index
+        self.searcher = searcher
+        self.rebuilt = rebuilt
+
+    def apply(self):
+        """
+        Make the change visible by swapping in the updated searcher. Callers hold the
+        lock that searches hold, so that a search sees either the old or the new index.
+        """
+        self.model_index.searcher = self.searcher
 
 
 class PLAIDModelIndex:
@@ -23,16 +409,31 @@ class PLAIDModelIndex:
     pytorch_kmeans = staticmethod(
         torch_kmeans._train_kmeans
     )  # pylint: disable=protected-access
+    # The clustering that trains the centroids: "faiss", "torch" for `pytorch_kmeans`, or
+    # "auto" for `pytorch_kmeans` on CPU, where it is faster than faiss, and faiss on GPU.
+    kmeans_engine = "auto"
+    # The number of threads of `pytorch_kmeans` on CPU, None for the number torch uses.
+    kmeans_num_threads: Optional[int] = None
+    # Training sets of more points than this are clustered in mini-batches by `pytorch_kmeans`
+    # on CPU, of `kmeans_minibatch_size` points or more.
+    kmeans_minibatch_threshold: Optional[int] = 1 << 17
+    kmeans_minibatch_size = 1 << 14
 
     def __init__(self, config: ColBERTConfig) -> None:
         self.config = config
         self.searcher: Optional[Searcher] = None
+        # Held while the searcher is loaded by a search, which never changes its config.
+        self.searcher_lock = threading.Lock()
+        # Whether searchers encode queries with the int8 encoder of the checkpoint.
+        self.quantized_encoder = False
+        # The backend that encodes queries and passages: "torch", or "onnx" for ONNX Runtime.
+        self.encoder_backend = "torch"
 
     @staticmethod
     def construct(
         config: ColBERTConfig,
         checkpoint: Union[str, Path],
-        collection: List[str],
+        collection: Sequence[str],
         index_name: Optional["str"] = None,
         overwrite: Union[bool, str] = "reuse",
         verbose: bool = True,
@@ -45,7 +446,7 @@ class PLAIDModelIndex:
         Args:
             config (ColBERTConfig): The configuration for the ColBERT model.
             checkpoint (Union[str, Path]): The path to the checkpoint file.
-            collection (List[str]): The list of documents in the collection.
+            collection (Sequence[str]): The list of documents in the collection.
             index_name (Optional[str], optional): The name of the index. Defaults to None.
             overwrite (Union[bool, str], optional): Whether to overwrite an existing index or reuse it. Defaults to "reuse".
             verbose (bool, optional): Whether to print verbose output. Defaults to True.
@@ -59,6 +460,37 @@ class PLAIDModelIndex:
             checkpoint, collection, index_name, overwrite, verbose, store_name, **kwargs
         )
 
+    @staticmethod
+    def num_passages(index_path: Union[str, Path]) -> int:
+        """
+        Count the passages of an index on disk, including the deleted ones, which keep their pid.
+
+        Args:
+            index_path (Union[str, Path]): The directory of the index.
+
+        Returns:
+            int: The number of passages, the pid that the next added passage gets.
+        """
+        with open(os.path.join(index_path, "metadata.json"), encoding="utf-8") as f:
+            num_chunks = json.load(f)["num_chunks"]
+        last_chunk_path = os.path.join(index_path, f"{num_chunks - 1}.metadata.json")
+        with open(last_chunk_path, encoding="utf-8") as f:
+            last_chunk = json.load(f)
+        return last_chunk["passage_offset"] + last_chunk["num_passages"]
+
+    @staticmethod
+    def load_centroids(index_path: Union[str, Path]) -> torch.Tensor:
+        """
+        Load the centroids of an index on disk.
+
+        Args:
+            index_path (Union[str, Path]): The directory of the index.
+
+        Returns:
+            torch.Tensor: The centroids, of shape (partitions, dim).
+        """
+        return torch.load(os.path.join(index_path, "centroids.pt"), map_location="cpu")
+
     @staticmethod
     def load_from_file(
         index_path: Union[str, Path],
@@ -86,11 +518,13 @@ class PLAIDModelIndex:
     def build(
         self,
         checkpoint: Union[str, Path],
-        collection: List[str],
+        collection: Sequence[str],
         index_name: Optional[str] = None,
         overwrite: Union[bool, str] = "reuse",
         verbose: bool = True,
         store_name: Optional[str] = None,
+        embeddings: Optional[IndexedEmbeddings] = None,
+        init_centroids: Optional[torch.Tensor] = None,
         **kwargs,
     ) -> "PLAIDModelIndex":
         """
@@ -98,11 +532,15 @@ class PLAIDModelIndex:
 
         Args:
             checkpoint (Union[str, Path]): The path to the checkpoint file or the checkpoint file itself.
-            collection (List[str]): The collection of documents to build the index from.
+            collection (Sequence[str]): The collection of documents to build the index from.
             index_name (Optional[str]): The name of the index. If not provided, a default name will be used.
             overwrite (Union[bool, str]): Specifies whether to overwrite an existing index with the same name.
                 If set to "reuse", the existing index will be reused. If set to True, the existing index will be overwritten.
             verbose (bool): Specifies whether to print verbose output during the indexing process.
+            embeddings (Optional[IndexedEmbeddings]): The embeddings of the passages, which are
+                then not encoded. Defaults to None.
+            init_centroids (Optional[torch.Tensor]): The centroids of a previous index of these
+                passages, to start k-means from. Defaults to None.
             **kwargs: Additional keyword arguments.
 
         Returns:
@@ -114,6 +552,7 @@ class PLAIDModelIndex:
         """
         bsize = kwargs.get("bsize", PLAIDModelIndex._DEFAULT_INDEX_BSIZE)
         assert isinstance(bsize, int)
+        self.encoder_backend = kwargs.get("encoder_backend", self.encoder_backend)
 
         nbits = 2
         if len(collection) < 5000:
@@ -128,6 +567,8 @@ class PLAIDModelIndex:
         # Instruct colbert-ai to disable forking if nranks == 1
         self.config.avoid_fork_if_possible = True
 
+        # Warm-started builds get the same budget, and usually stop well before it, once the
+        # inertia stops improving.
         if len(collection) > 100000:
             self.config.kmeans_niters = 4
         elif len(collection) > 50000:
@@ -135,10 +576,23 @@ class PLAIDModelIndex:
         else:
             self.config.kmeans_niters = 20
 
-        print("Using faiss for clustering")
+        engine = self.kmeans_engine
+        if engine == "auto":
+            engine = "faiss" if self.config.total_visible_gpus > 0 else "torch"
+        kmeans_engine = None
+        if engine == "torch":
+            print("Using PyTorch for clustering")
+            kmeans_engine = partial(
+                PLAIDModelIndex.pytorch_kmeans,
+                num_threads=self.kmeans_num_threads,
+                minibatch_threshold=self.kmeans_minibatch_threshold,
+                minibatch_size=self.kmeans_minibatch_size,
+            )
+        else:
+            print("Using faiss for clustering")
 
         with Run().context(RunConfig(experiment=store_name)):
-            indexer = Indexer(
+            indexer = ColbertDBIndexer(
                 checkpoint=checkpoint,
                 config=self.config,
                 verbose=verbose,
@@ -146,95 +600,261 @@ class PLAIDModelIndex:
             print("Configuring the index...")
             indexer.configure(avoid_fork_if_possible=True)
             print("Indexing")
-            indexer.index(name=index_name, collection=collection, overwrite=overwrite)
+            indexer.index(
+                name=index_name,
+                collection=_as_colbert_collection(collection),
+                overwrite=overwrite,
+                embeddings=embeddings,
+                init_centroids=init_centroids,
+                kmeans_engine=kmeans_engine,
+                encoder_backend=self.encoder_backend,
+            )
 
         return self
 
     def _load_searcher(
         self,
         checkpoint: Union[str, Path],
-        collection: List[str],
+        collection: Sequence[str],
         index_name: Optional[str],
-        force_fast: bool = False,
     ):
         print(
             f"Loading searcher for index {index_name} for the first time...",
             "This may take a few seconds",
         )
-        self.searcher = Searcher(
+        self.searcher = self._new_searcher(checkpoint, collection, index_name)
+        print("Searcher loaded!")
+
+    def _new_searcher(
+        self,
+        checkpoint: Union[str, Path],
+        collection: Sequence[str],
+        index_name: Optional[str],
+    ) -> Searcher:
+        searcher = SharedCheckpointSearcher(
             checkpoint=checkpoint,
             config=None,
             collection=collection,
             index_root=self.config.root,
             index=index_name,
+            quantized=self.quantized_encoder,
+            backend=self.encoder_backend,
+        )
+
+        # The "balanced" settings of searches, by size of the collection. Faster or more
+        # exhaustive searches pass their own settings instead.
+        searcher.configure(ndocs=1024)
+        searcher.configure(ncells=16)
+        if len(searcher.collection) < 10000:
+            searcher.configure(ncells=8)
+            searcher.configure(centroid_score_threshold=0.4)
+        elif len(searcher.collection) < 100000:
+            searcher.configure(ncells=4)
+            searcher.configure(centroid_score_threshold=0.45)
+        # Otherwise, use defaults for k
+        return searcher
+
+    def _encode_queries(self, searcher: Searcher, queries: List[str], query_maxlen: int):
+        """Encode queries like `Searcher.encode`, without changing the searcher's query length."""
+        bsize = 128 if len(queries) > 128 else None
+        return query_from_text(
+            searcher.checkpoint, queries, query_maxlen, bsize=bsize, to_cpu=True
         )
 
-        if not force_fast:
-            self.searcher.configure(ndocs=1024)
-            self.searcher.configure(ncells=16)
-            if len(self.searcher.collection) < 10000:
-                self.searcher.configure(ncells=8)
-                self.searcher.configure(centroid_score_threshold=0.4)
-            elif len(self.searcher.collection) < 100000:
-                self.searcher.configure(ncells=4)
-                self.searcher.configure(centroid_score_threshold=0.45)
-            # Otherwise, use defaults for k
+    def _search(
+        self,
+        query: str,
+        params: SearchParams,
+        pids: Optional[List[int]] = None,
+        delta_scorer: Optional[DeltaScorer] = None,
+    ):
+        searcher = self.searcher
+        assert searcher is not None
+        Q = self._encode_queries(searcher, [query], params.query_maxlen)
+        if pids is not None and len(pids) == 0:
+            result = [[], [], []]
         else:
-            # Use fast settingss
-            self.searcher.configure(ncells=1)
-            self.searcher.configure(centroid_score_threshold=0.5)
-            self.searcher.configure(ndocs=256)
+            pids, scores = searcher.ranker.rank(
+                params.colbert_config(searcher.config), Q, pids=pids
+            )
+            pids, scores = pids[: params.k], scores[: params.k]
+            result = [pids, list(range(1, len(pids) + 1)), scores]
+        if delta_scorer is not None:
+            result = _merge_results(result[0], result[2], *delta_scorer(Q, params.k), params.k)
+        return result
 
-        print("Searcher loaded!")
+    def _batch_search(
+        self,
+        query: list[str],
+        params: SearchParams,
+        pids: Optional[List[Optional[List[int]]]] = None,
+        delta_scorers: Optional[List[DeltaScorer]] = None,
+    ):
+        """
+        Search a batch of queries.
 
-    def _search(self, query: str, k: int, pids: Optional[List[int]] = None):
-        assert self.searcher is not None
-        return self.searcher.search(query, k=k, pids=pids)
+        All queries are encoded in a single forward pass, and their tokens are scored against
+        the centroids in a single matrix product before candidates are gathered per query.
+        A query restricted to a list of pids, like `_search`, scores those passages instead.
+        """
+        searcher = self.searcher
+        assert searcher is not None
+        ranker = searcher.ranker
+        config = params.colbert_config(searcher.config)
+        k = params.k
 
-    def _batch_search(self, query: list[str], k: int):
-        assert self.searcher is not None
-        queries = {i: x for i, x in enumerate(query)}
-        results = self.searcher.search_all(queries, k=k)
-        results = [
-            [list(zip(*value))[i] for i in range(3)]
-            for value in results.todict().values()
-        ]
+        Q = self._encode_queries(searcher, query, params.query_maxlen)
+        Q_candidates = Q[:, : config.query_maxlen]
+        if ranker.use_gpu:
+            Q_candidates = Q_candidates.cuda().half()
+        query_len = Q_candidates.size(1)
+
+        results = []
+        with torch.inference_mode():
+            all_centroid_scores = ranker.codec.centroids @ Q_candidates.flatten(0, 1).T
+            for query_idx in range(Q.size(0)):
+                query_pids = pids[query_idx] if pids is not None else None
+                centroid_scores = None
+                if query_pids is not None:
+                    candidates = torch.tensor(query_pids, dtype=torch.int32)
+                else:
+                    centroid_scores = all_centroid_scores[
+                        :, query_idx * query_len : (query_idx + 1) * query_len
+                    ]
+                    if config.ncells == 1:
+                        cells = centroid_scores.argmax(dim=0, keepdim=True).permute(1, 0)
+                    else:
+                        cells = centroid_scores.topk(
+                            config.ncells, dim=0, sorted=False
+                        ).indices.permute(1, 0)
+                    cells = cells.flatten().contiguous().unique(sorted=False)
+                    candidates, _ = ranker.ivf.lookup(cells)
+                    candidates = torch.unique(candidates)
+
+                if len(candidates) == 0:
+                    query_result, query_scores = [], []
+                else:
+                    if ranker.use_gpu:
+                        candidates = candidates.cuda()
+                    scores, candidates = ranker.score_pids(
+                        config, Q[query_idx : query_idx + 1], candidates, centroid_scores
+                    )
+                    sorter = scores.sort(descending=True)
+                    query_result = candidates[sorter.indices].tolist()[:k]
+                    query_scores = sorter.values.tolist()[:k]
+                if delta_scorers is not None:
+                    results.append(
+                        _merge_results(
+                            query_result,
+                            query_scores,
+                            *delta_scorers[query_idx](Q[query_idx : query_idx + 1], k),
+                            k,
+                        )
+                    )
+                else:
+                    results.append(
+                        [query_result, list(range(1, len(query_result) + 1)), query_scores]
+                    )
         return results
 
-    def _upgrade_searcher_maxlen(self, maxlen: int, base_model_max_tokens: int):
+    def resolve_search_params(
+        self,
+        params: SearchParams,
+        queries: List[str],
+        base_model_max_tokens: int,
+    ) -> SearchParams:
+        """
+        Fill in the settings of a search that are left to None, without changing the searcher.
+
+        `k` is capped to the size of the index. `ndocs` is at least four times `k`, or the
+        searcher's value, and `ncells` and the threshold are the searcher's. `ncells` is capped
+        to the number of centroids of the index. Settings the searcher
+        does not have either get the defaults of colbert's dense search for `k`. The queries are
+        encoded to 1.35 tokens per word of the longest one, at least 32 and at most
+        `base_model_max_tokens`.
+
+        Args:
+            params (SearchParams): The settings of the search.
+            queries (List[str]): The queries.
+            base_model_max_tokens (int): The maximum number of tokens in the base model.
+
+        Returns:
+            SearchParams: The settings of the search, all set.
+        """
         assert self.searcher is not None
-        # Keep maxlen stable at 32 for short queries for easier visualisation
-        maxlen = min(max(maxlen, 32), base_model_max_tokens)
-        self.searcher.config.query_maxlen = maxlen
-        self.searcher.checkpoint.query_tokenizer.query_maxlen = maxlen
+        searcher_config = self.searcher.config
+        k = params.k
+        if k > len(self.searcher.collection):
+            print(
+                "WARNING: k value is larger than the number of documents in the index!",
+                f"Lowering k to {len(self.searcher.collection)}...",
+            )
+            k = len(self.searcher.collection)
+
+        settings = {
+            "ncells": searcher_config.ncells,
+            "centroid_score_threshold": searcher_config.centroid_score_threshold,
+            "ndocs": searcher_config.ndocs,
+        }
+        if settings["ndocs"] is not None:
+            settings["ndocs"] = max(k * 4, settings["ndocs"])
+        for key, value in dense_search_defaults(k).items():
+            if getattr(params, key) is not None:
+                settings[key] = getattr(params, key)
+            elif settings[key] is None:
+                settings[key] = value
+        # A query token cannot probe more centroids than the index has.
+        settings["ncells"] = min(
+            settings["ncells"], self.searcher.ranker.codec.centroids.size(0)
+        )
+
+        query_maxlen = params.query_maxlen
+        if query_maxlen is None:
+            # Keep maxlen stable at 32 for short queries for easier visualisation
+            query_maxlen = max(32, max(int(len(x.split(" ")) * 1.35) for x in queries))
+        query_maxlen = min(query_maxlen, base_model_max_tokens)
+        return params.replace(k=k, query_maxlen=query_maxlen, **settings)
 
     def search(
         self,
         config: ColBERTConfig,
         checkpoint: Union[str, Path],
-        collection: List[str],
+        collection: Sequence[str],
         index_name: Optional[str],
         base_model_max_tokens: int,
         query: Union[str, list[str]],
         k: int = 10,
-        pids: Optional[List[int]] = None,
+        pids: Optional[Union[List[int], List[Optional[List[int]]]]] = None,
         force_reload: bool = False,
+        delta_scorer: Optional[Union[DeltaScorer, List[DeltaScorer]]] = None,
+        params: Optional[SearchParams] = None,
         **kwargs,
     ) -> list[tuple[list, list, list]]:
         """
         Perform a search on the index.
 
+        The searcher is only configured when it is loaded. Everything else about the search is
+        passed along in a SearchParams, so concurrent searches can share the searcher.
+
         Args:
             config (ColBERTConfig): The configuration for ColBERT.
             checkpoint (Union[str, Path]): The path to the checkpoint.
-            collection (List[str]): The collection of documents.
+            collection (Sequence[str]): The collection of documents.
             index_name (Optional[str]): The name of the index.
             base_model_max_tokens (int): The maximum number of tokens in the base model.
             query (Union[str, list[str]]): The query or list of queries to search for.
             k (int, optional): The number of documents to retrieve. Defaults to 10.
-            pids (Optional[List[int]], optional): The list of document IDs to retrieve. Defaults to None.
+            pids (Optional[List[int]], optional): The list of document IDs to retrieve. For a list of
+                queries, one list per query, where None does not restrict the query. Defaults to None.
             force_reload (bool, optional): Whether to force reload the index. Defaults to False.
-            **kwargs: Additional keyword arguments.
+            delta_scorer (Optional[DeltaScorer], optional): Scores the passages that are not in the
+                index yet against an encoded query, returning the pids and scores of the best k.
+                They are merged with the results from the index. For a list of queries, one scorer
+                per query. Defaults to None.
+            params (Optional[SearchParams], optional): The settings of the search, which then
+                replace `k`. Settings left to None are resolved by `resolve_search_params`. Defaults to None.
+            **kwargs: Additional keyword arguments. `force_fast` searches with the "fast" profile,
+                under the settings set in `params`.
 
         Returns:
             list[tuple[list, list, list]]: A list of search results, where each result is a tuple containing three lists:
@@ -248,44 +868,20 @@ class PLAIDModelIndex:
         assert isinstance(force_fast, bool)
 
         if self.searcher is None or force_reload:
-            self._load_searcher(
-                checkpoint,
-                collection,
-                index_name,
-                force_fast,
-            )
+            with self.searcher_lock:
+                if self.searcher is None or force_reload:
+                    self._load_searcher(checkpoint, collection, index_name)
         assert self.searcher is not None
 
-        base_ncells = self.searcher.config.ncells
-        base_ndocs = self.searcher.config.ndocs
-
-        if k > len(self.searcher.collection):
-            print(
-                "WARNING: k value is larger than the number of documents in the index!",
-                f"Lowering k to {len(self.searcher.collection)}...",
-            )
-            k = len(self.searcher.collection)
-
-        # For smaller collections, we need a higher ncells value to ensure we return enough results
-        if k > (32 * self.searcher.config.ncells):
-            self.searcher.configure(ncells=min((k // 32 + 2), base_ncells))
-
-        self.searcher.configure(ndocs=max(k * 4, base_ndocs))
-
+        if params is None:
+            params = SearchParams(k=k)
+        if force_fast:
+            params = SearchParams.from_profile("fast", **asdict(params))
+        queries = [query] if isinstance(query, str) else query
+        params = self.resolve_search_params(params, queries, base_model_max_tokens)
         if isinstance(query, str):
-            query_length = int(len(query.split(" ")) * 1.35)
-            self._upgrade_searcher_maxlen(query_length, base_model_max_tokens)
-            results = [self._search(query, k, pids)]
-        else:
-            longest_query_length = max([int(len(x.split(" ")) * 1.35) for x in query])
-            self._upgrade_searcher_maxlen(longest_query_length, base_model_max_tokens)
-            results = self._batch_search(query, k)
-
-        # Restore original ncells&ndocs if it had to be changed for large k values
-        self.searcher.configure(ncells=base_ncells)
-        self.searcher.configure(ndocs=base_ndocs)
-
-        return results  # type: ignore
+            return [self._search(query, params, pids, delta_scorer)]
+        return self._batch_search(query, params, pids, delta_scorer)
 
     @staticmethod
     def _should_rebuild(current_len: int, new_doc_len: int) -> bool:
@@ -298,21 +894,26 @@ class PLAIDModelIndex:
         self,
         config: ColBERTConfig,
         checkpoint: Union[str, Path],
-        collection: List[str],
+        collection: Sequence[str],
         index_root: str,
         index_name: str,
         new_collection: List[str],
         verbose: bool = True,
         store_name: Optional[str] = None,
         **kwargs,
-    ) -> None:
+    ) -> IndexUpdate:
         """
         Adds new documents to the index.
 
+        The new passages are encoded and written to disk while the loaded searcher keeps
+        serving searches, and only show up in them once the returned update is applied.
+        They are added to a copy of the loaded searcher rather than to one loaded from disk,
+        so adding a few passages takes time proportional to those passages.
+
         Args:
             config (ColBERTConfig): The configuration for the ColBERT model.
             checkpoint (Union[str, Path]): The path to the checkpoint file.
-            collection (List[str]): The existing collection of documents.
+            collection (Sequence[str]): The passages of the existing collection that have not been deleted, in pid order.
             index_root (str): The root directory for the index.
             index_name (str): The name of the index.
             new_collection (List[str]): The new collection of documents to be added.
@@ -320,78 +921,211 @@ class PLAIDModelIndex:
             **kwargs: Additional keyword arguments.
 
         Returns:
-            None
+            IndexUpdate: The update to apply. It is marked as rebuilt if the index was rebuilt
+                from `collection` followed by `new_collection`, in which case the passage ids
+                start again from 0. Otherwise the new passages were appended to the index.
         """
         self.config = config
+        # Searchers are loaded from `config.root`, like in `search`.
+        _ = index_root
 
         bsize = kwargs.get("bsize", PLAIDModelIndex._DEFAULT_INDEX_BSIZE)
         assert isinstance(bsize, int)
 
-        searcher = Searcher(
-            checkpoint=checkpoint,
-            config=None,
-            collection=collection,
-            index=index_name,
-            index_root=index_root,
-            verbose=verbose,
-        )
-
-        if PLAIDModelIndex._should_rebuild(
-            len(searcher.collection), len(new_collection)
-        ):
-            self.build(
-                checkpoint=checkpoint,
-                collection=collection + new_collection,
-                index_name=index_name,
-                overwrite="force_silent_overwrite",
+        if PLAIDModelIndex._should_rebuild(len(collection), len(new_collection)):
+            return self.rebuild(
+                checkpoint,
+                ChainedPassages(collection, new_collection),
+                index_name,
                 verbose=verbose,
                 store_name=store_name,
                 **kwargs,
             )
-        else:
-            if self.config.index_bsize != bsize:  # Update bsize if it's different
-                self.config.index_bsize = bsize
 
-            updater = IndexUpdater(
-                config=self.config, searcher=searcher, checkpoint=checkpoint
+        if self.searcher is None:
+            self._load_searcher(checkpoint, collection, index_name)
+        if self.config.index_bsize != bsize:  # Update bsize if it's different
+            self.config.index_bsize = bsize
+
+        report_progress(
+            stage="encoding",
+            passages_total=len(new_collection),
+            passages_encoded=0,
+        )
+        updater = SharedCheckpointIndexUpdater(self.config, self.searcher)
+        updater.add(new_collection)
+        report_progress(stage="writing", passages_encoded=len(new_collection))
+        updater.persist_to_disk()
+        return IndexUpdate(self, updater.searcher)
+
+    def rebuild(
+        self,
+        checkpoint: Union[str, Path],
+        collection: Sequence[str],
+        index_name: str,
+        verbose: bool = True,
+        store_name: Optional[str] = None,
+        embeddings: Optional[IndexedEmbeddings] = None,
+        init_centroids: Optional[torch.Tensor] = None,
+        **kwargs,
+    ) -> IndexUpdate:
+        """
+        Builds a new index of a collection and loads a searcher for it, to replace the loaded one.
+
+        The loaded searcher keeps serving searches from memory during the build. To also keep
+        the index on disk intact, build into a directory other than the one it was loaded from.
+
+        Args:
+            checkpoint (Union[str, Path]): The path to the checkpoint file.
+            collection (Sequence[str]): All the passages of the new index, in pid order.
+            index_name (str): The name of the new index.
+            verbose (bool, optional): Whether to print verbose output. Defaults to True.
+            store_name (Optional[str]): The name of the store. Defaults to None.
+            embeddings (Optional[IndexedEmbeddings]): The embeddings of the passages, from
+                `indexed_embeddings`, to reuse instead of encoding the passages. Defaults to None.
+            init_centroids (Optional[torch.Tensor]): The centroids of the loaded index, from
+                `load_centroids`, to start k-means from. Defaults to None.
+            **kwargs: Additional keyword arguments for `build`.
+
+        Returns:
+            IndexUpdate: The update to apply, marked as rebuilt.
+
+        Raises:
+            RuntimeError: If the new index does not have one entry per passage.
+        """
+        self.build(
+            checkpoint=checkpoint,
+            collection=collection,
+            index_name=index_name,
+            overwrite="force_silent_overwrite",
+            verbose=verbose,
+            store_name=store_name,
+            embeddings=embeddings,
+            init_centroids=init_centroids,
+            **kwargs,
+        )
+        report_progress(stage="verifying")
+        searcher = self._new_searcher(checkpoint, collection, index_name)
+        num_passages = len(searcher.ranker.doclens)
+        if num_passages != len(collection):
+            raise RuntimeError(
+                f"The rebuilt index {index_name} has {num_passages} passages "
+                f"instead of {len(collection)}."
             )
-            updater.add(new_collection)
-            updater.persist_to_disk()
+        return IndexUpdate(self, searcher, rebuilt=True)
+
+    def indexed_embeddings(
+        self,
+        checkpoint: Union[str, Path],
+        collection: Sequence[str],
+        index_name: str,
+        pids: Sequence[int],
+        new_embeddings: torch.Tensor,
+        new_doclens: List[int],
+    ) -> IndexedEmbeddings:
+        """
+        Collects the embeddings of some passages of the index and of passages that follow it,
+        to rebuild the index with them through `rebuild`.
+
+        Args:
+            checkpoint (Union[str, Path]): The path to the checkpoint.
+            collection (Sequence[str]): The collection of documents.
+            index_name (str): The name of the index.
+            pids (Sequence[int]): The pids of the passages of the new index, in increasing order.
+            new_embeddings (torch.Tensor): The embeddings of the passages that follow the index,
+                concatenated.
+            new_doclens (List[int]): The number of embeddings of each of these passages.
+
+        Returns:
+            IndexedEmbeddings: The embeddings of the passages of the new index.
+        """
+        if self.searcher is None:
+            self._load_searcher(checkpoint, collection, index_name)
+        return IndexedEmbeddings(self.searcher, pids, new_embeddings, new_doclens)
 
     def delete(
         self,
         config: ColBERTConfig,
         checkpoint: Union[str, Path],
-        collection: List[str],
+        collection: Sequence[str],
         index_name: str,
         pids_to_remove: Union[TypeVar("T"), List[TypeVar("T")]],
         verbose: bool = True,
-    ) -> None:
+    ) -> IndexUpdate:
         """
         Delete documents from the index.
 
+        Like `add`, the passages are removed from a copy of the loaded searcher and from
+        the index on disk, and stay searchable until the returned update is applied.
+
         Args:
             config (ColBERTConfig): The configuration for ColBERT.
             checkpoint (Union[str, Path]): The path to the checkpoint.
-            collection (List[str]): The collection of documents.
+            collection (Sequence[str]): The collection of documents.
             index_name (str): The name of the index.
             pids_to_remove (Union[TypeVar("T"), List[TypeVar("T")]]): The document IDs to remove from the index.
             verbose (bool, optional): Whether to print verbose output. Defaults to True.
+
+        Returns:
+            IndexUpdate: The update to apply.
         """
         self.config = config
+        _ = verbose
 
-        # Initialize the searcher and updater
-        searcher = Searcher(
-            checkpoint=checkpoint,
-            config=None,
-            collection=collection,
-            index=index_name,
-            verbose=verbose,
-        )
-        updater = IndexUpdater(config=config, searcher=searcher, checkpoint=checkpoint)
+        if self.searcher is None:
+            self._load_searcher(checkpoint, collection, index_name)
+        updater = SharedCheckpointIndexUpdater(config, self.searcher)
 
+        report_progress(stage="removing")
         updater.remove(pids_to_remove)
+        report_progress(stage="writing")
+        updater.persist_to_disk()
+        return IndexUpdate(self, updater.searcher)
+
+    def add_encoded(
+        self,
+        config: ColBERTConfig,
+        checkpoint: Union[str, Path],
+        collection: Sequence[str],
+        index_name: str,
+        embeddings: torch.Tensor,
+        doclens: List[int],
+        pids_to_remove: Optional[List[int]] = None,
+    ) -> IndexUpdate:
+        """
+        Adds passages that were already encoded to the index, without encoding them again.
+
+        Like `add`, the passages are added to a copy of the loaded searcher and to the index
+        on disk, and only show up in searches once the returned update is applied.
+
+        Args:
+            config (ColBERTConfig): The configuration for ColBERT.
+            checkpoint (Union[str, Path]): The path to the checkpoint.
+            collection (Sequence[str]): The collection of documents.
+            index_name (str): The name of the index.
+            embeddings (torch.Tensor): The embeddings of every new passage, concatenated.
+            doclens (List[int]): The number of embeddings of each new passage.
+            pids_to_remove (Optional[List[int]]): New passages that were deleted in the meantime,
+                which are added to keep the pids of the next ones, then removed. Defaults to None.
+
+        Returns:
+            IndexUpdate: The update to apply.
+        """
+        self.config = config
+
+        if self.searcher is None:
+            self._load_searcher(checkpoint, collection, index_name)
+        updater = SharedCheckpointIndexUpdater(config, self.searcher)
+
+        report_progress(stage="writing", passages_total=len(doclens))
+        updater.add_embeddings(embeddings, doclens)
         updater.persist_to_disk()
+        # Passages are removed from the chunks on disk, so the new ones are written first.
+        if pids_to_remove:
+            report_progress(stage="removing")
+            updater.remove(pids_to_remove)
+            updater.persist_to_disk()
+        return IndexUpdate(self, updater.searcher)
 
     def _export_config(self) -> dict[str, Any]:
         return {}
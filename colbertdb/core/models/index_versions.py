@@ -0,0 +1,197 @@
+"""
+The versions of the index of a collection.
+
+Every build of a collection goes into a new `versions/<n>` subdirectory of the collection
+directory, together with the passages and document ids numbered like its pids, and the
+`CURRENT` file names the version that is loaded. `CURRENT` is replaced atomically, so a load
+sees either the previous index or the new one, never one that is still being written.
+Collections built before versioning have their index in the collection directory itself,
+which is version 0. The metadata store is shared by all the versions: a build writes the
+metadata of its documents into a store in its own directory, which replaces the shared one when
+the build becomes current, so the current version keeps its metadata until then.
+
+Loaded collections hold a reference to their version, and a version is deleted once it is
+neither current nor referenced, unless it is an unfinished build that can be resumed.
+References are counted per process, and so is the lock that serializes the updates of the
+index of a collection.
+"""
+
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from colbertdb.core.models.build_manifest import BuildManifest
+from colbertdb.core.models.metadata_store import METADATA_STORE_FILE
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+# Reads of CURRENT, reservations and deletions of versions are serialized, so that a
+# version cannot be deleted between being read from CURRENT and being referenced.
+_lock = threading.Lock()
+_references: Dict[Tuple[str, int], int] = {}
+_update_locks: Dict[str, threading.Lock] = {}
+
+
+def version_name(index_name: str, version: int) -> str:
+    """Return the name of a version of an index, relative to the directory of the indexes."""
+    if version == 0:
+        return index_name
+    return f"{index_name}/{VERSIONS_DIR}/{version}"
+
+
+class IndexVersions:
+    """
+    The versions of the index in a collection directory.
+
+    Args:
+        path (Union[str, Path]): The directory of the collection.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.key = os.path.abspath(self.path)
+
+    @property
+    def update_lock(self) -> threading.Lock:
+        """The lock held while the index of the collection is written, shared by every copy."""
+        with _lock:
+            return _update_locks.setdefault(self.key, threading.Lock())
+
+    def path_of(self, version: int) -> Path:
+        """Return the directory of a version."""
+        if version == 0:
+            return self.path
+        return self.path / VERSIONS_DIR / str(version)
+
+    def current(self) -> int:
+        """Return the current version, 0 for an index built before versioning."""
+        try:
+            return int((self.path / CURRENT_FILE).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return 0
+
+    def acquire_current(self) -> int:
+        """Reference the current version and return it. Release it with `release`."""
+        with _lock:
+            version = self.current()
+            # A switch that was interrupted before the metadata of the version replaced the shared one.
+            self._install_metadata(version)
+            self._acquire(version)
+        return version
+
+    def create(self) -> int:
+        """
+        Create the directory of a new version to build an index in.
+
+        Returns:
+            int: The new version, referenced until it is released with `release`.
+        """
+        with _lock:
+            version = max([self.current(), *self._versions()]) + 1
+            self.path_of(version).mkdir(parents=True)
+            self._acquire(version)
+        return version
+
+    def acquire_unfinished(self) -> Optional[int]:
+        """
+        Reference the newest unfinished build that is newer than the current version, to resume it.
+
+        Returns:
+            Optional[int]: The version, referenced until it is released with `release`, or None if
+                there is no unfinished build that is not already referenced.
+        """
+        with _lock:
+            current = self.current()
+            for version in sorted(self._versions(), reverse=True):
+                if version <= current:
+                    break
+                if (self.key, version) not in _references and BuildManifest.exists(
+                    self.path_of(version)
+                ):
+                    self._acquire(version)
+                    return version
+        return None
+
+    def discard_unfinished(self):
+        """Delete the unfinished builds that are not referenced."""
+        with _lock:
+            for version in self._versions():
+                if (self.key, version) not in _references and BuildManifest.exists(
+                    self.path_of(version)
+                ):
+                    self._delete(version)
+
+    def switch(self, version: int):
+        """
+        Make a version, whose index is complete, the current one.
+
+        If the version was built with its own metadata store, it replaces the shared one.
+        """
+        tmp_path = self.path / f"{CURRENT_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(version))
+            f.flush()
+            os.fsync(f.fileno())
+        with _lock:
+            os.replace(tmp_path, self.path / CURRENT_FILE)
+            self._install_metadata(version)
+
+    def release(self, version: int):
+        """Drop a reference to a version, and delete the versions that are no longer used."""
+        with _lock:
+            key = (self.key, version)
+            _references[key] -= 1
+            if _references[key] == 0:
+                del _references[key]
+        self.collect_garbage()
+
+    def collect_garbage(self):
+        """Delete the versions that are neither current nor referenced."""
+        with _lock:
+            if not self.path.is_dir():
+                return
+            current = self.current()
+            for version in [0, *self._versions()]:
+                if (
+                    version != current
+                    and (self.key, version) not in _references
+                    and not (version != 0 and BuildManifest.exists(self.path_of(version)))
+                ):
+                    self._delete(version)
+
+    def _acquire(self, version: int):
+        key = (self.key, version)
+        _references[key] = _references.get(key, 0) + 1
+
+    def _install_metadata(self, version: int):
+        """Replace the shared metadata store with the one the version was built with, if any."""
+        if version == 0:
+            return
+        metadata_path = self.path_of(version) / METADATA_STORE_FILE
+        if metadata_path.exists():
+            os.replace(metadata_path, self.path / METADATA_STORE_FILE)
+
+    def _versions(self) -> List[int]:
+        """List the versions that have a directory."""
+        versions_path = self.path / VERSIONS_DIR
+        if not versions_path.is_dir():
+            return []
+        return [int(x.name) for x in versions_path.iterdir() if x.name.isdigit()]
+
+    def _delete(self, version: int):
+        if version != 0:
+            shutil.rmtree(self.path_of(version), ignore_errors=True)
+            return
+        # Version 0 is every file of the collection directory that is not shared.
+        for entry in self.path.iterdir():
+            if entry.name == VERSIONS_DIR or entry.name.startswith(
+                (CURRENT_FILE, METADATA_STORE_FILE)
+            ):
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
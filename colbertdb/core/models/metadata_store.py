@@ -0,0 +1,154 @@
+"""
+An SQLite store of the metadata of the documents of a collection.
+
+The metadata of each document is a JSON object in a row keyed by document id, so adding or
+deleting documents only touches their own rows and a search only reads the rows of the
+documents it returns.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import srsly
+
+METADATA_STORE_FILE = "metadata.sqlite3"
+LEGACY_METADATA_FILE = "docid_metadata_map.json"
+
+# SQLite limits the number of parameters of a statement, 999 in older versions.
+_MAX_PARAMETERS = 900
+
+
+class MetadataStore:
+    """
+    The metadata of the documents of a collection, keyed by document id.
+
+    The connection is shared by the threads that search the collection, so every
+    statement runs under a lock.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            str(self.path / METADATA_STORE_FILE), check_same_thread=False
+        )
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents "
+                "(document_id TEXT PRIMARY KEY, metadata TEXT NOT NULL)"
+            )
+
+    @classmethod
+    def create(
+        cls, path: Union[str, Path], metadata: Optional[Dict[str, dict]] = None
+    ) -> "MetadataStore":
+        """
+        Create a metadata store, replacing any existing one in the directory.
+
+        Args:
+            path (Union[str, Path]): The directory of the store.
+            metadata (Optional[Dict[str, dict]]): The metadata of each document. Defaults to None.
+
+        Returns:
+            MetadataStore: The new store.
+        """
+        Path(path).mkdir(parents=True, exist_ok=True)
+        Path(path, METADATA_STORE_FILE).unlink(missing_ok=True)
+        store = cls(path)
+        if metadata:
+            store.put_many(metadata)
+        return store
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "MetadataStore":
+        """
+        Open the metadata store of a directory, converting a legacy `docid_metadata_map.json` if needed.
+
+        Args:
+            path (Union[str, Path]): The directory of the store.
+
+        Returns:
+            MetadataStore: The store.
+        """
+        legacy_path = Path(path, LEGACY_METADATA_FILE)
+        if not Path(path, METADATA_STORE_FILE).exists() and legacy_path.exists():
+            print(f"Converting {legacy_path} to a metadata store...")
+            store = cls.create(path, srsly.read_json(legacy_path))
+            legacy_path.unlink()
+            return store
+        return cls(path)
+
+    def close(self):
+        """Close the connection to the store."""
+        with self.lock:
+            self.connection.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM documents"
+            ).fetchone()
+        return count
+
+    def get(self, document_id: str) -> Optional[dict]:
+        """Return the metadata of a document, or None if it has none."""
+        return self.get_many([document_id]).get(document_id)
+
+    def get_many(self, document_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        Fetch the metadata of some documents.
+
+        Args:
+            document_ids (Iterable[str]): The document ids. Ids without metadata are skipped.
+
+        Returns:
+            Dict[str, dict]: The metadata of each document that has some.
+        """
+        metadata = {}
+        with self.lock:
+            for batch in _batches(list(dict.fromkeys(document_ids))):
+                rows = self.connection.execute(
+                    "SELECT document_id, metadata FROM documents "
+                    f"WHERE document_id IN ({', '.join('?' * len(batch))})",
+                    batch,
+                )
+                for document_id, value in rows:
+                    metadata[document_id] = srsly.json_loads(value)
+        return metadata
+
+    def put_many(self, metadata: Dict[str, Any]):
+        """
+        Set the metadata of some documents in a single transaction, replacing their previous metadata.
+
+        Args:
+            metadata (Dict[str, Any]): The metadata of each document.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO documents (document_id, metadata) VALUES (?, ?)",
+                (
+                    (document_id, srsly.json_dumps(value))
+                    for document_id, value in metadata.items()
+                ),
+            )
+
+    def delete_many(self, document_ids: Iterable[str]):
+        """
+        Delete the metadata of some documents in a single transaction.
+
+        Args:
+            document_ids (Iterable[str]): The document ids.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM documents WHERE document_id = ?",
+                ((document_id,) for document_id in document_ids),
+            )
+
+
+def _batches(items: List[str]) -> Iterable[List[str]]:
+    """Split a list of statement parameters into batches SQLite accepts."""
+    for start in range(0, len(items), _MAX_PARAMETERS):
+        yield items[start : start + _MAX_PARAMETERS]
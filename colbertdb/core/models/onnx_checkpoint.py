@@ -0,0 +1,187 @@
+"""
+An ONNX Runtime backend for the ColBERT encoder, on CPU.
+
+The encoder of a checkpoint, BERT followed by the ColBERT projection and normalisation, is
+exported to ONNX the first time it is loaded with this backend. The export is cached in an
+`onnx` directory next to the checkpoint, with a fingerprint of the checkpoint files, and is
+exported again when they change. `OnnxCheckpoint` then encodes queries and documents with an
+ONNX Runtime session, and everything else, tokenizers and masking included, is colbert's. The
+torch weights are only loaded to export them, and are released once the session is created.
+
+The backend needs the `onnx` extra of colbertdb: `pip install colbertdb[onnx]`.
+"""
+
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+import srsly
+import torch
+from colbert.modeling.checkpoint import Checkpoint
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+ONNX_DIR = "onnx"
+ONNX_MODEL_FILE = "encoder.onnx"
+ONNX_EXPORT_FILE = "export.json"
+# The exports of checkpoints that are not a local directory, such as HuggingFace model names.
+ONNX_CACHE_ROOT = ".data/.checkpoints/onnx"
+
+
+class _Encoder(torch.nn.Module):
+    """The part of ColBERT that is exported: token embeddings before the query or document mask."""
+
+    def __init__(self, checkpoint: Checkpoint):
+        super().__init__()
+        self.bert = checkpoint.bert
+        self.linear = checkpoint.linear
+
+    def forward(self, input_ids, attention_mask):
+        embeddings = self.linear(self.bert(input_ids, attention_mask=attention_mask)[0])
+        return torch.nn.functional.normalize(embeddings, p=2, dim=2)
+
+
+def export_dir(checkpoint: Union[str, Path]) -> Path:
+    """The directory of the ONNX export of a checkpoint."""
+    if os.path.isdir(checkpoint):
+        return Path(checkpoint) / ONNX_DIR
+    return Path(ONNX_CACHE_ROOT) / str(checkpoint).replace("/", "--")
+
+
+def _fingerprint(checkpoint: Union[str, Path], opset_version: int) -> dict:
+    """Identifies the files of a checkpoint and the exporter an export was made from."""
+    files = {}
+    if os.path.isdir(checkpoint):
+        for entry in sorted(os.scandir(checkpoint), key=lambda x: x.name):
+            if entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return {"files": files, "opset_version": opset_version, "torch": torch.__version__}
+
+
+def export_encoder(
+    checkpoint: Checkpoint, path: Union[str, Path], opset_version: int = 17
+) -> Path:
+    """
+    Export the encoder of a checkpoint to ONNX, unless an export of the same checkpoint is cached.
+
+    Args:
+        checkpoint (Checkpoint): The checkpoint, loaded on CPU.
+        path (Union[str, Path]): The directory of the export.
+        opset_version (int): The ONNX opset to export to. Defaults to 17.
+
+    Returns:
+        Path: The path to the ONNX model.
+    """
+    path = Path(path)
+    model_path = path / ONNX_MODEL_FILE
+    fingerprint = _fingerprint(checkpoint.name, opset_version)
+    if model_path.exists() and (path / ONNX_EXPORT_FILE).exists():
+        if srsly.read_json(path / ONNX_EXPORT_FILE) == fingerprint:
+            return model_path
+
+    print(f"Exporting the encoder of {checkpoint.name} to ONNX...")
+    path.mkdir(parents=True, exist_ok=True)
+    tmp_path = path / f"{ONNX_MODEL_FILE}.tmp"
+    sample = torch.ones(2, 8, dtype=torch.long)
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            _Encoder(checkpoint).eval(),
+            (sample, sample),
+            str(tmp_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["embeddings"],
+            dynamic_axes={
+                name: axes for name in ["input_ids", "attention_mask", "embeddings"]
+            },
+            opset_version=opset_version,
+            dynamo=False,
+        )
+    os.replace(tmp_path, model_path)
+    srsly.write_json(path / ONNX_EXPORT_FILE, fingerprint)
+    return model_path
+
+
+class OnnxCheckpoint(Checkpoint):
+    """
+    A colbert Checkpoint that encodes queries and documents with ONNX Runtime on CPU.
+
+    The session runs with every graph optimisation. Its thread pools are set by the class
+    attributes below, None leaving the choice to ONNX Runtime. Only the configuration of the
+    torch model is kept, on the meta device, so the weights are held by the session alone.
+
+    Args:
+        name (str): The path to the checkpoint.
+        colbert_config (Optional[ColBERTConfig]): The config of the checkpoint. Defaults to None.
+        verbose (int): The verbosity of colbert. Defaults to 3.
+    """
+
+    # The number of threads that run an operator, and that run independent operators.
+    intra_op_num_threads: Optional[int] = None
+    inter_op_num_threads: Optional[int] = None
+    opset_version = 17
+
+    def __init__(self, name, colbert_config=None, verbose: int = 3):
+        if onnxruntime is None:
+            raise ImportError(
+                "onnx and onnxruntime must be installed to use the ONNX backend, "
+                "see the onnx extra of colbertdb"
+            )
+        super().__init__(name, colbert_config=colbert_config, verbose=verbose)
+        if self.colbert_config.total_visible_gpus > 0:
+            raise ValueError("The ONNX backend can only be used with CPU!")
+
+        self.onnx_path = export_encoder(self, export_dir(name), self.opset_version)
+        self.model.to("meta")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if self.intra_op_num_threads is not None:
+            options.intra_op_num_threads = self.intra_op_num_threads
+        if self.inter_op_num_threads is not None:
+            options.inter_op_num_threads = self.inter_op_num_threads
+        self.session = onnxruntime.InferenceSession(
+            str(self.onnx_path), options, providers=["CPUExecutionProvider"]
+        )
+
+    @property
+    def device(self):
+        """The device of the embeddings, since the torch model no longer has weights."""
+        return torch.device("cpu")
+
+    def _encode(self, input_ids, attention_mask) -> torch.Tensor:
+        (embeddings,) = self.session.run(
+            ["embeddings"],
+            {
+                "input_ids": input_ids.cpu().numpy(),
+                "attention_mask": attention_mask.cpu().numpy(),
+            },
+        )
+        return torch.from_numpy(embeddings)
+
+    def query(self, input_ids, attention_mask, to_cpu=False):
+        """Encode tokenized queries, like `ColBERT.query`."""
+        _ = to_cpu
+        Q = self._encode(input_ids, attention_mask)
+        mask = torch.tensor(self.mask(input_ids, skiplist=[])).unsqueeze(2).float()
+        return Q * mask
+
+    def doc(self, input_ids, attention_mask, keep_dims=True, to_cpu=False):
+        """Encode tokenized documents, like `ColBERT.doc`."""
+        _ = to_cpu
+        assert keep_dims in [True, False, "return_mask"]
+        D = self._encode(input_ids, attention_mask)
+        mask = torch.tensor(self.mask(input_ids, skiplist=self.skiplist)).unsqueeze(2).float()
+        D = D * mask
+
+        if keep_dims is False:
+            mask = mask.bool().squeeze(-1)
+            return [d[mask[idx]] for idx, d in enumerate(D)]
+        if keep_dims == "return_mask":
+            return D, mask.bool()
+        return D
@@ -0,0 +1,304 @@
+"""
+An on-disk store of the passages of a collection, read through mmap.
+
+The passages are kept as a single UTF-8 blob (`passages.bin`) and an array of int64 offsets
+into it (`passages.offsets`), with one more offset than there are passages. Passage `pid`
+is the bytes between offsets `pid` and `pid + 1`. Adding passages appends to both files
+and never rewrites the existing data.
+"""
+
+import mmap
+import os
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+import srsly
+
+BLOB_FILE = "passages.bin"
+OFFSETS_FILE = "passages.offsets"
+LEGACY_COLLECTION_FILE = "collection.json"
+
+_OFFSET_DTYPE = np.dtype("<i8")
+
+
+class PassageStore(Sequence):
+    """
+    A read-mostly sequence of passages backed by memory-mapped files.
+
+    Passage ids are stable: passages are only ever appended, and deleted documents are
+    dropped from the pid to document id map rather than from the store.
+    """
+
+    blob_file = BLOB_FILE
+    offsets_file = OFFSETS_FILE
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._offsets: Optional[np.ndarray] = None
+        self._blob: Optional[mmap.mmap] = None
+        self._open()
+
+    @classmethod
+    def exists(cls, path: Union[str, Path]) -> bool:
+        """Check whether a passage store exists in a directory."""
+        return Path(path, cls.offsets_file).exists()
+
+    @classmethod
+    def create(cls, path: Union[str, Path], passages: Iterable[str]) -> "PassageStore":
+        """
+        Write a new passage store, replacing any existing one in the directory.
+
+        Args:
+            path (Union[str, Path]): The directory of the store.
+            passages (Iterable[str]): The passages, in pid order.
+
+        Returns:
+            PassageStore: The new store.
+        """
+        with PassageStoreWriter(path, cls) as writer:
+            writer.write(passages)
+        return cls(path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "PassageStore":
+        """
+        Open the passage store of a directory, converting a legacy `collection.json` if needed.
+
+        Args:
+            path (Union[str, Path]): The directory of the store.
+
+        Returns:
+            PassageStore: The store.
+        """
+        legacy_path = Path(path, LEGACY_COLLECTION_FILE)
+        if not cls.exists(path) and legacy_path.exists():
+            print(f"Converting {legacy_path} to a passage store...")
+            store = cls.create(path, srsly.read_json(legacy_path))
+            legacy_path.unlink()
+            return store
+        return cls(path)
+
+    def _open(self):
+        """
+        Map the files of the store, replacing the previous mappings.
+
+        The new mappings are swapped in, blob first, without closing the previous ones, so a
+        passage read while passages are appended comes from either mapping, and never from a
+        closed one. The previous mappings are unmapped once no reader holds them.
+        """
+        offsets = np.memmap(self.path / self.offsets_file, dtype=_OFFSET_DTYPE, mode="r")
+        blob = None
+        with open(self.path / self.blob_file, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Offsets are only ever read before the blob, and the new blob extends the previous one.
+        self._blob = blob
+        self._offsets = offsets
+
+    def close(self):
+        """Unmap the files of the store."""
+        if self._blob is not None:
+            self._blob.close()
+        self._blob = None
+        self._offsets = None
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, pid):
+        if isinstance(pid, slice):
+            return [self[i] for i in range(*pid.indices(len(self)))]
+        if pid < 0:
+            pid += len(self)
+        if not 0 <= pid < len(self):
+            raise IndexError(f"passage id {pid} out of range")
+        offsets = self._offsets
+        start, end = int(offsets[pid]), int(offsets[pid + 1])
+        if start == end:
+            return ""
+        return self._blob[start:end].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for pid in range(len(self)):
+            yield self[pid]
+
+    def __deepcopy__(self, memo):
+        # colbert deep-copies its configs, which reference the collection being indexed.
+        return self
+
+    def get_many(self, pids: Iterable[int]) -> List[str]:
+        """Fetch the passages with the given ids."""
+        return [self[pid] for pid in pids]
+
+    def append(self, passages: Iterable[str]):
+        """
+        Append passages to the end of the store.
+
+        Args:
+            passages (Iterable[str]): The passages to append. They get the next pids in order.
+        """
+        start = int(self._offsets[-1])
+        with open(self.path / self.blob_file, "ab") as blob, open(
+            self.path / self.offsets_file, "ab"
+        ) as offsets:
+            _write_passages(
+                blob, offsets, passages, start=start, write_first_offset=False
+            )
+        self._open()
+
+    def rewrite(self, passages: Iterable[str]):
+        """
+        Replace the content of the store, for example to compact it after a rebuild.
+
+        The passages may be read from this store, the new files only replace the
+        old ones once they are complete.
+
+        Args:
+            passages (Iterable[str]): The new passages, in pid order.
+        """
+        tmp_blob = self.path / f"{self.blob_file}.tmp"
+        tmp_offsets = self.path / f"{self.offsets_file}.tmp"
+        with open(tmp_blob, "wb") as blob, open(tmp_offsets, "wb") as offsets:
+            _write_passages(blob, offsets, passages, start=0, write_first_offset=True)
+        self.close()
+        os.replace(tmp_blob, self.path / self.blob_file)
+        os.replace(tmp_offsets, self.path / self.offsets_file)
+        self._open()
+
+
+class PassageView(Sequence):
+    """A lazy sequence of some of the passages of a store, in the given order."""
+
+    def __init__(self, store: Sequence, pids: Sequence[int]):
+        self.store = store
+        self.pids = pids
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.store[self.pids[idx]]
+
+    def __iter__(self) -> Iterator[str]:
+        for pid in self.pids:
+            yield self.store[pid]
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class ChainedPassages(Sequence):
+    """A lazy concatenation of passage sequences."""
+
+    def __init__(self, *parts: Sequence):
+        self.parts = parts
+
+    def __len__(self) -> int:
+        return sum(len(part) for part in self.parts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        for part in self.parts:
+            if idx < len(part):
+                return part[idx]
+            idx -= len(part)
+        raise IndexError("passage index out of range")
+
+    def __iter__(self) -> Iterator[str]:
+        for part in self.parts:
+            yield from part
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class PassageStoreWriter:
+    """
+    Writes a new passage store a batch of passages at a time, for passages that do not fit in memory.
+
+    The files replace the existing store of the directory once the writer is closed without an
+    error, and are discarded otherwise.
+
+    Args:
+        path (Union[str, Path]): The directory of the store.
+        store_cls (type): The PassageStore class whose files are written. Defaults to PassageStore.
+    """
+
+    def __init__(self, path: Union[str, Path], store_cls: type = PassageStore):
+        self.path = Path(path)
+        self.store_cls = store_cls
+        self.num_passages = 0
+        self._position = 0
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._blob = open(self._tmp_path(store_cls.blob_file), "wb")
+        self._offsets = open(self._tmp_path(store_cls.offsets_file), "wb")
+        self._offsets.write(np.asarray([0], dtype=_OFFSET_DTYPE).tobytes())
+
+    def _tmp_path(self, name: str) -> Path:
+        return self.path / f"{name}.tmp"
+
+    def write(self, passages: Iterable[str]):
+        """
+        Write passages after the ones already written.
+
+        Args:
+            passages (Iterable[str]): The passages, in pid order.
+        """
+        before = self._offsets.tell()
+        self._position = _write_passages(
+            self._blob,
+            self._offsets,
+            passages,
+            start=self._position,
+            write_first_offset=False,
+        )
+        self.num_passages += (self._offsets.tell() - before) // _OFFSET_DTYPE.itemsize
+
+    def close(self):
+        """Finish the files and replace the existing store with them."""
+        self._blob.close()
+        self._offsets.close()
+        for name in (self.store_cls.blob_file, self.store_cls.offsets_file):
+            os.replace(self._tmp_path(name), self.path / name)
+
+    def abort(self):
+        """Discard the files written so far."""
+        self._blob.close()
+        self._offsets.close()
+        for name in (self.store_cls.blob_file, self.store_cls.offsets_file):
+            self._tmp_path(name).unlink(missing_ok=True)
+
+    def __enter__(self) -> "PassageStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _write_passages(
+    blob, offsets, passages: Iterable[str], start: int, write_first_offset: bool
+) -> int:
+    """Write passages to open blob and offsets files, buffering the offsets, and return the end offset."""
+    position = start
+    buffer = [start] if write_first_offset else []
+    for passage in passages:
+        encoded = passage.encode("utf-8")
+        blob.write(encoded)
+        position += len(encoded)
+        buffer.append(position)
+        if len(buffer) >= 65536:
+            offsets.write(np.asarray(buffer, dtype=_OFFSET_DTYPE).tobytes())
+            buffer = []
+    if buffer:
+        offsets.write(np.asarray(buffer, dtype=_OFFSET_DTYPE).tobytes())
+    return position
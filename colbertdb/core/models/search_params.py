@@ -0,0 +1,108 @@
+"""
+The settings of a single search of a PLAID index.
+
+A loaded searcher is shared by every request to its collection. The settings that vary from one
+request to the next are passed with the search in an immutable SearchParams instead of being
+configured on the searcher, so concurrent searches never see each other's settings.
+
+Profiles trade recall for latency: "fast" probes a single centroid per query token and scores
+few candidates, "balanced" uses the settings the searcher was loaded with, which depend on the
+size of the collection, and "exhaustive" probes many centroids and scores many candidates.
+"""
+
+import copy
+from dataclasses import dataclass, replace
+from typing import Dict, Literal, Optional
+
+from colbert.infra import ColBERTConfig
+
+SearchProfile = Literal["fast", "balanced", "exhaustive"]
+
+SEARCH_PROFILES: Dict[str, dict] = {
+    "fast": {"ncells": 1, "centroid_score_threshold": 0.5, "ndocs": 256},
+    "balanced": {},
+    "exhaustive": {"ncells": 32, "centroid_score_threshold": 0.3, "ndocs": 8192},
+}
+
+
+def dense_search_defaults(k: int) -> dict:
+    """The settings colbert's dense search uses for `k` results when the searcher has none."""
+    if k <= 10:
+        return {"ncells": 1, "centroid_score_threshold": 0.5, "ndocs": 256}
+    if k <= 100:
+        return {"ncells": 2, "centroid_score_threshold": 0.45, "ndocs": 1024}
+    return {"ncells": 4, "centroid_score_threshold": 0.4, "ndocs": max(k * 4, 4096)}
+
+
+@dataclass(frozen=True)
+class SearchParams:
+    """
+    The settings of a search. Settings left to None are resolved from the searcher by `PLAIDModelIndex`.
+
+    Attributes:
+        k (int): The number of results of each query. Defaults to 10.
+        ncells (Optional[int]): The number of centroids each query token probes for candidates.
+        centroid_score_threshold (Optional[float]): The score below which the centroids of a
+            candidate are ignored when the candidates are pruned.
+        ndocs (Optional[int]): The number of candidates kept after pruning, a quarter of which are
+            scored with their full embeddings.
+        query_maxlen (Optional[int]): The number of tokens the queries are encoded to.
+    """
+
+    k: int = 10
+    ncells: Optional[int] = None
+    centroid_score_threshold: Optional[float] = None
+    ndocs: Optional[int] = None
+    query_maxlen: Optional[int] = None
+
+    @classmethod
+    def from_profile(
+        cls, profile: SearchProfile, k: int = 10, **settings
+    ) -> "SearchParams":
+        """
+        The settings of a profile, under explicit settings.
+
+        Args:
+            profile (SearchProfile): "fast", "balanced" or "exhaustive".
+            k (int): The number of results of each query. Defaults to 10.
+            **settings: Settings that replace those of the profile, unless they are None.
+
+        Returns:
+            SearchParams: The settings of the search. The profile's `ndocs` is raised to four
+                times `k`, so that `k` results are scored.
+        """
+        if profile not in SEARCH_PROFILES:
+            raise ValueError(
+                f"Unknown search profile {profile}, expected one of {list(SEARCH_PROFILES)}"
+            )
+        profile_settings = dict(SEARCH_PROFILES[profile])
+        if "ndocs" in profile_settings:
+            profile_settings["ndocs"] = max(profile_settings["ndocs"], k * 4)
+        profile_settings.update(
+            {key: value for key, value in settings.items() if value is not None}
+        )
+        return cls(k=k, **profile_settings)
+
+    def replace(self, **changes) -> "SearchParams":
+        """A copy of these settings with some of them changed."""
+        return replace(self, **changes)
+
+    def colbert_config(self, config: ColBERTConfig) -> ColBERTConfig:
+        """
+        A copy of a searcher config with these settings, for colbert's ranker.
+
+        The copy is shallow, so it shares the collection and everything else of the searcher
+        config, and only the settings that are not None replace the searcher's.
+
+        Args:
+            config (ColBERTConfig): The config of the searcher.
+
+        Returns:
+            ColBERTConfig: The config of this search.
+        """
+        config = copy.copy(config)
+        for key in ("ncells", "centroid_score_threshold", "ndocs", "query_maxlen"):
+            value = getattr(self, key)
+            if value is not None:
+                setattr(config, key, value)
+        return config
@@ -3,7 +3,13 @@ https://github.com/bclavie/RAGatouille/blob/main/ragatouille/data/corpus_process
 https://github.com/bclavie/RAGatouille/blob/main/ragatouille/data/preprocessors.py
 """
 
-from typing import Optional, Callable, List
+import bisect
+import multiprocessing
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Optional, Callable, Iterator, List, Sequence
 from uuid import uuid4
 
 from llama_index.core.node_parser import SentenceSplitter
@@ -35,16 +41,185 @@ def llama_index_sentence_splitter(
     return chunks
 
 
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+class TokenChunker:
+    """
+    Splits documents into chunks of whole sentences that fit in a number of wordpieces of a tokenizer.
+
+    Each document is tokenized once, and its sentences are packed into chunks of at most
+    `max_tokens` wordpieces, measured with the tokenizer of the encoder so that no chunk is
+    truncated when it is encoded. A sentence longer than that is cut between words. Consecutive
+    chunks can share whole sentences up to `overlap` wordpieces. It is called like
+    `llama_index_sentence_splitter`.
+
+    Args:
+        tokenizer: A fast Hugging Face tokenizer, such as the one of the checkpoint that encodes the chunks.
+        max_tokens (int): The maximum number of wordpieces in a chunk, without special tokens.
+        overlap (int): The maximum number of wordpieces at the end of a chunk that start the next one. Defaults to 0.
+
+    Raises:
+        ValueError: If the overlap is negative or not smaller than `max_tokens`.
+    """
+
+    # colbert adds [CLS], the [D] marker and [SEP] to every passage.
+    num_special_tokens = 3
+
+    def __init__(self, tokenizer, max_tokens: int, overlap: int = 0):
+        if not 0 <= overlap < max_tokens:
+            raise ValueError("overlap must be at least 0 and smaller than max_tokens")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+
+    @classmethod
+    def for_doc_maxlen(cls, tokenizer, doc_maxlen: int, overlap: int = 0):
+        """
+        Create a chunker whose chunks fill exactly `doc_maxlen` tokens once colbert adds its special tokens.
+
+        Args:
+            tokenizer: The tokenizer of the checkpoint that encodes the chunks.
+            doc_maxlen (int): The `doc_maxlen` of the colbert config.
+            overlap (int): The maximum number of wordpieces shared by consecutive chunks. Defaults to 0.
+
+        Returns:
+            TokenChunker: The chunker.
+        """
+        return cls(tokenizer, doc_maxlen - cls.num_special_tokens, overlap)
+
+    def __call__(
+        self,
+        documents: Sequence[str],
+        document_ids: Sequence[str],
+        chunk_size: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Split documents into chunks.
+
+        Args:
+            documents (Sequence[str]): The documents to split.
+            document_ids (Sequence[str]): The ID of each document.
+            chunk_size (Optional[int]): Ignored, the chunks are sized by `max_tokens`.
+
+        Returns:
+            list[dict]: The chunks, as dictionaries with the document ID and the content of the chunk.
+        """
+        _ = chunk_size
+        if len(documents) == 0:
+            return []
+        encodings = self.tokenizer(
+            list(documents),
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            verbose=False,
+        )
+        chunks = []
+        for i, (document, document_id) in enumerate(zip(documents, document_ids)):
+            chunks += [
+                {"document_id": document_id, "content": content}
+                for content in self._chunk(
+                    document,
+                    encodings["offset_mapping"][i],
+                    encodings.word_ids(i),
+                )
+            ]
+        return chunks
+
+    def _chunk(self, document: str, offsets, word_ids) -> List[str]:
+        """Pack the sentences of a tokenized document into chunks."""
+        if not offsets:
+            return []
+        units = []
+        for start, end in self._sentences(document, offsets):
+            units += self._cut(start, end, word_ids)
+
+        chunks, chunk = [], []
+        for unit in units:
+            while chunk and _num_tokens(chunk + [unit]) > self.max_tokens:
+                if not chunks or chunk[-1][1] > chunks[-1][-1][1]:
+                    chunks.append(chunk)
+                    chunk = self._overlap(chunk)
+                else:
+                    # Only overlap is left, drop it until the unit fits.
+                    chunk = chunk[1:]
+            chunk.append(unit)
+        chunks.append(chunk)
+        return [
+            document[offsets[chunk[0][0]][0] : offsets[chunk[-1][1] - 1][1]]
+            for chunk in chunks
+        ]
+
+    def _sentences(self, document: str, offsets) -> List[tuple]:
+        """The token span of every sentence of a document."""
+        sentence_starts = [0] + [x.end() for x in _SENTENCE_BOUNDARY.finditer(document)]
+        spans, sentence, start = [], 0, 0
+        for token, (char_start, _) in enumerate(offsets):
+            token_sentence = bisect.bisect_right(sentence_starts, char_start) - 1
+            if token_sentence != sentence:
+                if token > start:
+                    spans.append((start, token))
+                sentence, start = token_sentence, token
+        spans.append((start, len(offsets)))
+        return spans
+
+    def _cut(self, start: int, end: int, word_ids) -> List[tuple]:
+        """Cut a span of tokens longer than `max_tokens` between words."""
+        spans = []
+        while end - start > self.max_tokens:
+            cut = start + self.max_tokens
+            while cut > start + 1 and word_ids[cut] == word_ids[cut - 1]:
+                cut -= 1
+            if cut == start + 1 and word_ids[cut] == word_ids[cut - 1]:
+                # A single word longer than a chunk is cut between wordpieces.
+                cut = start + self.max_tokens
+            spans.append((start, cut))
+            start = cut
+        spans.append((start, end))
+        return spans
+
+    def _overlap(self, chunk: List[tuple]) -> List[tuple]:
+        """The sentences at the end of a chunk that also start the next one."""
+        overlap = []
+        for unit in reversed(chunk):
+            if _num_tokens(overlap) + unit[1] - unit[0] > self.overlap:
+                break
+            overlap.insert(0, unit)
+        return overlap
+
+
+def _num_tokens(units: List[tuple]) -> int:
+    return sum(end - start for start, end in units)
+
+
 class CorpusProcessor:
     """
     Class to process a corpus of documents using a document splitter.
+
+    With more than one worker, documents are split in shards of `shard_size` documents across a
+    pool of processes, which is started on first use and kept until `close`. The splitter must
+    then be picklable, like `llama_index_sentence_splitter`. Chunks come back in the order of the
+    documents either way.
+
+    Args:
+        document_splitter_fn (Optional[Callable]): Splits documents, called like `llama_index_sentence_splitter`.
+        num_workers (int): The number of processes that split documents. Defaults to 1, which splits them in this process.
+        shard_size (int): The number of documents split by a process at a time. Defaults to 256.
     """
 
+    # Workers are spawned rather than forked from a process that may be running threads.
+    mp_start_method = "spawn"
+
     def __init__(
         self,
         document_splitter_fn: Optional[Callable] = SentenceSplitter,
+        num_workers: int = 1,
+        shard_size: int = 256,
     ):
         self.document_splitter_fn = document_splitter_fn
+        self.num_workers = num_workers
+        self.shard_size = shard_size
+        self._executor: Optional[ProcessPoolExecutor] = None
 
     def process_corpus(
         self,
@@ -61,7 +236,66 @@ class CorpusProcessor:
             else document_ids
         )
         if self.document_splitter_fn is not None:
-            documents = self.document_splitter_fn(
-                documents, document_ids, **splitter_kwargs
+            documents = list(
+                self.iter_corpus(documents, document_ids, **splitter_kwargs)
             )
         return documents
+
+    def iter_corpus(
+        self,
+        documents: Sequence[str],
+        document_ids: Sequence[str],
+        **splitter_kwargs,
+    ) -> Iterator[dict]:
+        """
+        Split documents, yielding their chunks in order as they are ready.
+
+        At most two shards per worker are split or waiting to be read at a time, so the chunks
+        of a large corpus are not all held in memory.
+
+        Args:
+            documents (Sequence[str]): The documents to split.
+            document_ids (Sequence[str]): The ID of each document.
+            **splitter_kwargs: Passed to the document splitter, such as `chunk_size`.
+
+        Returns:
+            Iterator[dict]: The chunks, as dictionaries with the document ID and the content of the chunk.
+        """
+        split = partial(self.document_splitter_fn, **splitter_kwargs)
+        if self.num_workers <= 1 or len(documents) <= self.shard_size:
+            yield from split(documents, document_ids)
+            return
+
+        executor = self._get_executor()
+        pending = deque()
+        for start in range(0, len(documents), self.shard_size):
+            end = start + self.shard_size
+            pending.append(
+                executor.submit(
+                    split, list(documents[start:end]), list(document_ids[start:end])
+                )
+            )
+            if len(pending) >= 2 * self.num_workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context(self.mp_start_method),
+            )
+        return self._executor
+
+    def close(self):
+        """Stop the worker processes, if any were started."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self) -> "CorpusProcessor":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
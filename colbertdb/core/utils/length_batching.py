@@ -0,0 +1,125 @@
+"""
+Length-bucketed batching of the documents encoded by a colbert checkpoint.
+
+`Checkpoint.docFromText` tokenizes the documents of a call together and splits them into
+batches of `bsize` documents, which are all padded to the longest document of the call. Here
+the documents are sorted by length and grouped into batches whose padded size fits a budget of
+tokens, each batch is trimmed to its own longest document, and the embeddings are returned in
+the order of the input. Short documents thus go in large batches and long ones in small batches.
+"""
+
+from dataclasses import dataclass
+from typing import List, Literal, Optional, Sequence, Union
+
+import torch
+
+
+@dataclass
+class PaddingStats:
+    """
+    Counts the tokens of the encoded documents and the tokens of their padded batches.
+
+    Attributes:
+        tokens (int): The number of tokens of the documents, special tokens included.
+        padded_tokens (int): The number of tokens of the batches they were encoded in.
+    """
+
+    tokens: int = 0
+    padded_tokens: int = 0
+
+    def add(self, lengths: torch.Tensor, padded_length: int):
+        """Count a batch of documents of the given lengths, padded to `padded_length`."""
+        self.tokens += int(lengths.sum())
+        self.padded_tokens += len(lengths) * padded_length
+
+    @property
+    def efficiency(self) -> float:
+        """The fraction of the encoded tokens that were not padding, 1.0 if nothing was encoded."""
+        if self.padded_tokens == 0:
+            return 1.0
+        return self.tokens / self.padded_tokens
+
+
+def length_bucketed_batches(
+    lengths: torch.Tensor, max_batch_tokens: int
+) -> List[torch.Tensor]:
+    """
+    Group items by length into batches whose padded size fits a budget of tokens.
+
+    Args:
+        lengths (torch.Tensor): The length of every item.
+        max_batch_tokens (int): The maximum number of items of a batch times its longest length.
+            An item longer than that gets a batch of its own.
+
+    Returns:
+        List[torch.Tensor]: The indices of the items of each batch, from the shortest items to the longest.
+    """
+    order = torch.argsort(lengths, stable=True)
+    sorted_lengths = lengths[order].tolist()
+    batches, start = [], 0
+    for end, length in enumerate(sorted_lengths):
+        # The items are sorted, so the last one added is the longest of the batch.
+        if end > start and (end - start + 1) * length > max_batch_tokens:
+            batches.append(order[start:end])
+            start = end
+    if start < len(sorted_lengths):
+        batches.append(order[start:])
+    return batches
+
+
+def encode_documents(
+    checkpoint,
+    documents: Sequence[str],
+    max_batch_tokens: int,
+    keep_dims: Union[bool, Literal["flatten"]] = "flatten",
+    to_cpu: bool = False,
+    stats: Optional[PaddingStats] = None,
+):
+    """
+    Encode documents in length-bucketed batches, like `Checkpoint.docFromText` with a batch size.
+
+    Args:
+        checkpoint (Checkpoint): The checkpoint or checkpoint view to encode with.
+        documents (Sequence[str]): The documents.
+        max_batch_tokens (int): The budget of tokens of a batch, padding included.
+        keep_dims (Union[bool, Literal["flatten"]]): "flatten" for the embeddings of all the documents
+            concatenated and their number per document, True for a tensor of the padded embeddings
+            of every document, False for a list of the embeddings of every document. Defaults to "flatten".
+        to_cpu (bool): Whether to move the embeddings to the CPU. Defaults to False.
+        stats (Optional[PaddingStats]): Counts the tokens and the padded tokens of the batches. Defaults to None.
+
+    Returns:
+        The embeddings, in the order of the documents, as described by `keep_dims`.
+    """
+    ids, mask = checkpoint.doc_tokenizer.tensorize(list(documents))
+    lengths = mask.sum(-1)
+
+    embeddings = [None] * len(documents)
+    padded = None
+    for batch in length_bucketed_batches(lengths, max_batch_tokens):
+        padded_length = int(lengths[batch].max())
+        D, D_mask = checkpoint.doc(
+            ids[batch, :padded_length],
+            mask[batch, :padded_length],
+            keep_dims="return_mask",
+            to_cpu=to_cpu,
+        )
+        if stats is not None:
+            stats.add(lengths[batch], padded_length)
+        if keep_dims is True:
+            if padded is None:
+                padded = torch.zeros(
+                    len(documents), ids.size(1), D.size(-1), dtype=D.dtype, device=D.device
+                )
+            padded[batch, :padded_length] = D
+            continue
+        D_mask = D_mask.squeeze(-1).to(D.device)
+        for idx, d, d_mask in zip(batch.tolist(), D, D_mask):
+            embeddings[idx] = d[d_mask]
+
+    if keep_dims is True:
+        return padded
+    if keep_dims is False:
+        return embeddings
+    doclens = [d.size(0) for d in embeddings]
+    return torch.cat(embeddings).cpu(), doclens
@@ -0,0 +1,36 @@
+"""Progress reporting for long-running indexing work.
+
+Indexing code calls `report_progress` at interesting points. The reports go to the callback
+installed with `track_progress` for the current context, and are dropped when there is none.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+_progress_callback: ContextVar[Optional[ProgressCallback]] = ContextVar(
+    "colbertdb_progress_callback", default=None
+)
+
+
+@contextmanager
+def track_progress(callback: ProgressCallback) -> Iterator[None]:
+    """Send the progress reported within the context to a callback.
+
+    Args:
+        callback (ProgressCallback): Called with a dict of the updated progress fields.
+    """
+    token = _progress_callback.set(callback)
+    try:
+        yield
+    finally:
+        _progress_callback.reset(token)
+
+
+def report_progress(**progress: Any):
+    """Report progress, for example `report_progress(stage="encoding", passages_encoded=10)`."""
+    callback = _progress_callback.get()
+    if callback is not None:
+        callback(progress)
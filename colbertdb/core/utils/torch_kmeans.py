@@ -1,20 +1,84 @@
-"""https://github.com/bclavie/RAGatouille/blob/main/ragatouille/models/torch_kmeans.py"""
+"""
+https://github.com/bclavie/RAGatouille/blob/main/ragatouille/models/torch_kmeans.py
+
+`_train_kmeans` trains the centroids of an index with `CPUKMeans` on CPU, which bounds the
+memory of the distance computations and can use a set number of threads, and with
+`fast_pytorch_kmeans` on GPU.
+"""
+
+import math
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Tuple
 
 import torch
 from fast_pytorch_kmeans import KMeans
 
+from colbertdb.core.utils.progress import report_progress
+
+
+def _train_kmeans(
+    self,
+    sample,
+    shared_lists,  # noqa: ARG001
+    num_threads=None,
+    minibatch_threshold=None,
+    minibatch_size=16384,
+):
+    """
+    Train the centroids of a CollectionIndexer, in place of its `_train_kmeans`.
 
-def _train_kmeans(self, sample, shared_lists):  # noqa: ARG001
+    On CPU, training sets of more than `minibatch_threshold` points are clustered in
+    mini-batches, of `minibatch_size` points or a tenth of the set, for at least one pass over
+    it. That is a fraction of the cost of full-batch iterations, for a slightly higher inertia.
 
+    Args:
+        sample (torch.Tensor): The embeddings to train on.
+        shared_lists: Unused, for compatibility.
+        num_threads (Optional[int]): The number of threads of the CPU engine. Defaults to the
+            number torch uses.
+        minibatch_threshold (Optional[int]): The number of training points above which the CPU
+            engine runs in mini-batches. Defaults to None, never.
+        minibatch_size (int): The smallest mini-batch. Defaults to 16384.
+    """
+    init_centroids = getattr(self, "init_centroids", None)
     if self.use_gpu:
         torch.cuda.empty_cache()
-    centroids = compute_pytorch_kmeans(
-        sample,
-        self.config.dim,
-        self.num_partitions,
-        self.config.kmeans_niters,
-        self.use_gpu,
-    )
+        centroids = compute_pytorch_kmeans(
+            sample,
+            self.config.dim,
+            self.num_partitions,
+            self.config.kmeans_niters,
+            self.use_gpu,
+            init_centroids=init_centroids,
+        )
+    else:
+        kmeans = CPUKMeans(
+            self.num_partitions,
+            max_iter=self.config.kmeans_niters,
+            tol=getattr(self, "kmeans_tolerance", 1e-3),
+            num_threads=num_threads,
+        )
+        num_points = min(len(sample), self.num_partitions * kmeans.max_points_per_centroid)
+        if minibatch_threshold is not None and num_points > minibatch_threshold:
+            kmeans.minibatch = max(minibatch_size, num_points // 10)
+            kmeans.max_iter = max(
+                kmeans.max_iter, math.ceil(num_points / kmeans.minibatch)
+            )
+        report_progress(
+            stage="kmeans", kmeans_iteration=0, kmeans_iterations=kmeans.max_iter
+        )
+        kmeans.fit(
+            sample,
+            init_centroids=init_centroids,
+            on_iteration=lambda iteration, inertia: report_progress(
+                kmeans_iteration=iteration, kmeans_inertia=inertia
+            ),
+        )
+        print(
+            f"K-means stopped after {kmeans.n_iter} iterations "
+            f"with an inertia of {kmeans.inertia:.2f}."
+        )
+        centroids = kmeans.centroids
     centroids = torch.nn.functional.normalize(centroids, dim=-1)
     if self.use_gpu:
         centroids = centroids.half()
@@ -23,6 +87,299 @@ def _train_kmeans(self, sample, shared_lists):  # noqa: ARG001
     return centroids
 
 
+@contextmanager
+def intra_op_threads(num_threads: Optional[int]) -> Iterator[None]:
+    """Run torch operations with a number of threads, restoring the previous number afterwards."""
+    if not num_threads:
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def nearest_centroids(
+    points: torch.Tensor, centroids: torch.Tensor, max_elements: int = 1 << 24
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Find the closest centroid of every point, in chunks of points to bound the memory used.
+
+    Args:
+        points (torch.Tensor): The points, of shape (n, dim).
+        centroids (torch.Tensor): The centroids, of shape (k, dim).
+        max_elements (int): The maximum size of the distance matrix of a chunk. Defaults to 2**24.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: The squared distance of every point to its closest
+            centroid, and the index of that centroid.
+    """
+    centroids = centroids.float()
+    centroid_norms = (centroids**2).sum(-1)
+    chunk_size = max(1, max_elements // max(1, len(centroids)))
+    distances = torch.empty(len(points))
+    assignments = torch.empty(len(points), dtype=torch.long)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start : start + chunk_size].float()
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, where |x|^2 does not change the closest centroid.
+        chunk_distances = torch.addmm(centroid_norms, chunk, centroids.T, alpha=-2)
+        min_distances, min_indices = chunk_distances.min(-1)
+        distances[start : start + len(chunk)] = (
+            min_distances + (chunk**2).sum(-1)
+        ).clamp(min=0)
+        assignments[start : start + len(chunk)] = min_indices
+    return distances, assignments
+
+
+def seed_centroids(
+    points: torch.Tensor,
+    centroids: torch.Tensor,
+    num_new: int,
+    generator: torch.Generator,
+    rounds: int = 8,
+) -> torch.Tensor:
+    """
+    Add centroids k-means++ style, with a probability proportional to the squared distance of
+    points to their closest centroid. They are drawn in a few rounds rather than one at a time,
+    as in k-means||.
+
+    Args:
+        points (torch.Tensor): The points to draw from, of shape (n, dim).
+        centroids (torch.Tensor): The existing centroids, of shape (k, dim). May be empty.
+        num_new (int): The number of centroids to add.
+        generator (torch.Generator): The generator of the draws.
+        rounds (int): The number of rounds of draws. Defaults to 8.
+
+    Returns:
+        torch.Tensor: The existing centroids followed by the new ones.
+    """
+    if len(centroids) == 0:
+        first = torch.randint(len(points), (1,), generator=generator)
+        centroids, num_new = points[first].float(), num_new - 1
+    distances, _ = nearest_centroids(points, centroids)
+    per_round = max(1, math.ceil(num_new / rounds))
+    new_centroids = []
+    while num_new > 0:
+        num_draws = min(per_round, num_new)
+        weights = distances if distances.sum() > 0 else torch.ones_like(distances)
+        drawn = torch.multinomial(
+            weights,
+            num_draws,
+            replacement=int((weights > 0).sum()) < num_draws,
+            generator=generator,
+        )
+        new_centroids.append(points[drawn].float())
+        distances = torch.minimum(distances, nearest_centroids(points, points[drawn])[0])
+        num_new -= num_draws
+    return torch.cat([centroids.float(), *new_centroids])
+
+
+def warm_start_centroids(
+    sample: torch.Tensor,
+    init_centroids: torch.Tensor,
+    num_partitions: int,
+    seed: int = 123,
+    rounds: int = 8,
+) -> torch.Tensor:
+    """
+    Initialise k-means with the centroids of a previous index.
+
+    If the new index has fewer partitions, the previous centroids that the most sample points
+    are closest to are kept. If it has more, the missing ones are seeded from the sample with
+    `seed_centroids`.
+
+    Args:
+        sample (torch.Tensor): The training points, of shape (n, dim).
+        init_centroids (torch.Tensor): The previous centroids, of shape (k, dim).
+        num_partitions (int): The number of centroids to return.
+        seed (int): The seed of the k-means++ draws. Defaults to 123.
+        rounds (int): The number of rounds of k-means++ draws. Defaults to 8.
+
+    Returns:
+        torch.Tensor: The initial centroids, of shape (num_partitions, dim), in float32.
+    """
+    sample = sample.float().cpu()
+    centroids = init_centroids.float().cpu()
+    if len(centroids) >= num_partitions:
+        _, assignments = nearest_centroids(sample, centroids)
+        counts = torch.bincount(assignments, minlength=len(centroids))
+        return centroids[counts.topk(num_partitions).indices.sort().values]
+
+    generator = torch.Generator().manual_seed(seed)
+    return seed_centroids(
+        sample, centroids, num_partitions - len(centroids), generator, rounds
+    )
+
+
+class CPUKMeans:
+    """
+    K-means for CPU, with the distances to the centroids computed in chunks of bounded size.
+
+    Full-batch mode is Lloyd's algorithm, where empty clusters are moved to the points that are
+    the farthest from their centroid. Mini-batch mode updates the centroids from a random batch
+    of points per iteration, with a per-centroid learning rate of one over the number of points
+    it has seen. Every draw comes from a generator seeded with `seed`, so runs are deterministic
+    for a given number of threads.
+
+    Args:
+        n_clusters (int): The number of centroids.
+        max_iter (int): The maximum number of iterations. Defaults to 20.
+        tol (float): Training stops once an iteration lowers the inertia, the sum of the squared
+            distances of the points to their centroid, by less than this fraction. In mini-batch
+            mode, the inertia is smoothed across batches. Defaults to 1e-3.
+        init (str): "k-means++" to seed the centroids with `seed_centroids`, or "random" to pick
+            random points. Defaults to "k-means++".
+        init_size (Optional[int]): The number of points to draw the initial centroids from.
+            Defaults to 64 per centroid.
+        minibatch (Optional[int]): The number of points per iteration, or None to use them all.
+            Defaults to None.
+        max_points_per_centroid (int): Larger training sets are subsampled to this many points
+            per centroid, like faiss does. Defaults to 256.
+        max_elements (int): The maximum size of a chunk of the distance matrix. Defaults to 2**24.
+        num_threads (Optional[int]): The number of intra-op threads. Defaults to the number torch uses.
+        seed (int): The seed of the random draws. Defaults to 123.
+
+    Attributes:
+        centroids (torch.Tensor): The centroids, once fitted.
+        inertia (float): The inertia of the last iteration.
+        n_iter (int): The number of iterations run.
+    """
+
+    def __init__(
+        self,
+        n_clusters: int,
+        max_iter: int = 20,
+        tol: float = 1e-3,
+        init: str = "k-means++",
+        init_size: Optional[int] = None,
+        minibatch: Optional[int] = None,
+        max_points_per_centroid: int = 256,
+        max_elements: int = 1 << 24,
+        num_threads: Optional[int] = None,
+        seed: int = 123,
+    ):
+        if init not in ("k-means++", "random"):
+            raise ValueError(f"Unknown k-means initialisation: {init}")
+        self.n_clusters = n_clusters
+        self.max_iter = max_iter
+        self.tol = tol
+        self.init = init
+        self.init_size = init_size or 64 * n_clusters
+        self.minibatch = minibatch
+        self.max_points_per_centroid = max_points_per_centroid
+        self.max_elements = max_elements
+        self.num_threads = num_threads
+        self.seed = seed
+        self.centroids: Optional[torch.Tensor] = None
+        self.inertia = float("nan")
+        self.n_iter = 0
+
+    def fit(
+        self,
+        points: torch.Tensor,
+        init_centroids: Optional[torch.Tensor] = None,
+        on_iteration: Optional[Callable[[int, float], None]] = None,
+    ) -> "CPUKMeans":
+        """
+        Train the centroids.
+
+        Args:
+            points (torch.Tensor): The points, of shape (n, dim).
+            init_centroids (Optional[torch.Tensor]): Centroids to start from, such as the ones of
+                a previous index, completed or trimmed with `warm_start_centroids`. Defaults to None.
+            on_iteration (Optional[Callable[[int, float], None]]): Called with the number of
+                iterations run and the inertia after every iteration. Defaults to None.
+
+        Returns:
+            CPUKMeans: This object, with `centroids`, `inertia` and `n_iter` set.
+        """
+        with intra_op_threads(self.num_threads), torch.inference_mode():
+            generator = torch.Generator().manual_seed(self.seed)
+            points = points.cpu()
+            if len(points) > self.n_clusters * self.max_points_per_centroid:
+                subsample = torch.randperm(len(points), generator=generator)
+                points = points[subsample[: self.n_clusters * self.max_points_per_centroid]]
+            points = points.float().contiguous()
+
+            centroids = self._initial_centroids(points, init_centroids, generator)
+            seen = torch.zeros(self.n_clusters)
+            previous_inertia = None
+            for iteration in range(self.max_iter):
+                if self.minibatch is None:
+                    batch = points
+                else:
+                    batch = points[
+                        torch.randint(len(points), (self.minibatch,), generator=generator)
+                    ]
+                distances, assignments = nearest_centroids(
+                    batch, centroids, self.max_elements
+                )
+                sums = torch.zeros_like(centroids).index_add_(0, assignments, batch)
+                counts = torch.bincount(assignments, minlength=self.n_clusters).float()
+
+                if self.minibatch is None:
+                    inertia = float(distances.sum())
+                    filled = counts > 0
+                    centroids[filled] = sums[filled] / counts[filled, None]
+                    empty = (~filled).nonzero().flatten()
+                    if len(empty) > 0:
+                        farthest = distances.topk(min(len(empty), len(batch))).indices
+                        centroids[empty[: len(farthest)]] = batch[farthest]
+                else:
+                    # The inertia of the whole training set, estimated from the batches.
+                    batch_inertia = float(distances.sum()) * len(points) / len(batch)
+                    inertia = (
+                        batch_inertia
+                        if previous_inertia is None
+                        else 0.7 * previous_inertia + 0.3 * batch_inertia
+                    )
+                    seen += counts
+                    rate = (counts / seen.clamp(min=1))[:, None]
+                    centroids += rate * (sums / counts.clamp(min=1)[:, None] - centroids)
+
+                self.n_iter, self.inertia = iteration + 1, inertia
+                if on_iteration is not None:
+                    on_iteration(self.n_iter, inertia)
+                if (
+                    previous_inertia is not None
+                    and previous_inertia - inertia <= self.tol * previous_inertia
+                ):
+                    break
+                previous_inertia = inertia
+
+            self.centroids = centroids
+        return self
+
+    def _initial_centroids(
+        self,
+        points: torch.Tensor,
+        init_centroids: Optional[torch.Tensor],
+        generator: torch.Generator,
+    ) -> torch.Tensor:
+        if init_centroids is not None:
+            return warm_start_centroids(
+                points, init_centroids, self.n_clusters, seed=self.seed
+            )
+        candidates = points
+        if len(points) > self.init_size:
+            candidates = points[
+                torch.randperm(len(points), generator=generator)[: self.init_size]
+            ]
+        if self.init == "random":
+            if len(candidates) < self.n_clusters:
+                picked = torch.randint(
+                    len(candidates), (self.n_clusters,), generator=generator
+                )
+            else:
+                picked = torch.randperm(len(candidates), generator=generator)
+            return candidates[picked[: self.n_clusters]].clone()
+        return seed_centroids(
+            candidates, candidates[:0], self.n_clusters, generator
+        )
+
+
 def compute_pytorch_kmeans(
     sample,
     dim,  # noqa compatibility
@@ -34,6 +391,7 @@ def compute_pytorch_kmeans(
     seed=123,
     max_points_per_centroid=256,
     min_points_per_centroid=10,
+    init_centroids: Optional[torch.Tensor] = None,
 ):
     device = torch.device("cuda" if use_gpu else "cpu")
     sample = sample.to(device)
@@ -74,5 +432,9 @@ def compute_pytorch_kmeans(
         max_iter=kmeans_niters,
         minibatch=minibatch,
     )
-    kmeans.fit(sample)
+    if init_centroids is not None:
+        init_centroids = warm_start_centroids(
+            sample, init_centroids, num_partitions, seed=seed
+        ).to(device)
+    kmeans.fit(sample, centroids=init_centroids)
     return kmeans.centroids
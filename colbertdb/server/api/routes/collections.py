@@ -1,20 +1,42 @@
 """This module contains the FastAPI server for the ColbertDB API."""
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+
+from typing import List, Optional
 
 from colbertdb.core.models.collection import Collection
+from colbertdb.core.models.search_params import SearchParams
 from colbertdb.core.models.store import Store
 from colbertdb.server.models import (
     CreateCollectionRequest,
     SearchCollectionRequest,
     SearchResponse,
+    BatchSearchCollectionRequest,
+    BatchSearchResponse,
     AddToCollectionRequest,
     OperationResponse,
+    JobSubmittedResponse,
+    StreamIngestResponse,
     DeleteDocumentsRequest,
     ListCollectionsResponse,
     GetCollectionResponse,
+    SearchOptions,
 )
 from colbertdb.server.api.deps import get_store_from_access_token
+from colbertdb.server.core.config import settings
+from colbertdb.server.services.collection_cache import collection_cache
+from colbertdb.server.services.ingest import (
+    IngestFeed,
+    ingest_batches,
+    read_ndjson_batches,
+)
+from colbertdb.server.services.job_manager import (
+    CollectionBusyError,
+    JobQueueFullError,
+    job_manager,
+)
+from colbertdb.server.services.search_batcher import search_batcher
 
 router = APIRouter()
 
@@ -49,41 +71,66 @@ def get_collection(
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
-@router.post("/", response_model=OperationResponse)
+@router.post(
+    "/",
+    response_model=JobSubmittedResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
 def create_collection(
     request: CreateCollectionRequest,
     store: Store = Depends(get_store_from_access_token),
-) -> OperationResponse:
+) -> JobSubmittedResponse:
     """Create a collection in the specified store.
 
+    The collection is indexed in the background, poll `GET /jobs/{job_id}` for its progress.
+
     Args:
         collection (CreateCollection): The collection details.
 
     Returns:
-        str: Status of the operation.
+        JobSubmittedResponse: The id of the indexing job.
     """
     try:
         store = Store(name=store.name)
-        if (request.name in store.list_collections()) and (
-            not request.options.force_create
+        # Resuming continues the unfinished build of an existing collection directory.
+        if (request.name in store.list_collections()) and not (
+            request.options.force_create or request.options.resume
         ):
             raise HTTPException(
                 status_code=409,
                 detail="Collection already exists. Set force_create to True to overwrite.",
             )
-        Collection.create(
-            name=request.name, collection=request.documents, store_name=store.name
+        job = job_manager.submit(
+            "create_collection",
+            store.name,
+            request.name,
+            lambda: Collection.create(
+                name=request.name,
+                collection=request.documents,
+                store_name=store.name,
+                resume=request.options.resume,
+            ),
         )
-        return OperationResponse(
-            status="success", message="Collection created successfully."
+        return JobSubmittedResponse(
+            status="accepted",
+            message="Collection creation started.",
+            job_id=job.id,
         )
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+    except CollectionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
-@router.post("/{collection_name}/documents", response_model=OperationResponse)
+@router.post(
+    "/{collection_name}/documents",
+    response_model=JobSubmittedResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
 def add_documents(
     request: AddToCollectionRequest,
     collection_name: str,
@@ -91,23 +138,160 @@ def add_documents(
 ):
     """Add documents to a collection.
 
+    The documents are indexed in the background, poll `GET /jobs/{job_id}` for its progress.
+
     Args:
         collection (AddToCollection): The documents to add.
         collection_name (str): The name of the collection.
 
     Returns:
-        str: Status of the operation.
+        JobSubmittedResponse: The id of the indexing job.
     """
-    try:
-        loaded_collection = Collection.load(name=collection_name, store_name=store.name)
+
+    def add():
+        # The documents are added to the loaded collection, which keeps serving searches.
+        loaded_collection = collection_cache.get(store.name, collection_name)
         loaded_collection.add_to_index(collection=request.documents)
-        return OperationResponse(
-            status="success", message="Collection updated successfully."
+
+    try:
+        job = job_manager.submit(
+            "add_documents", store.name, collection_name, add, in_place=True
         )
+        return JobSubmittedResponse(
+            status="accepted", message="Collection update started.", job_id=job.id
+        )
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+    except CollectionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
+@router.post(
+    "/{collection_name}/documents:stream",
+    response_model=StreamIngestResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def stream_documents(
+    collection_name: str,
+    request: Request,
+    store: Store = Depends(get_store_from_access_token),
+):
+    """Add newline-delimited JSON documents to a collection as they are uploaded.
+
+    Each line is a document such as `{"content": "...", "metadata": {...}}`. The documents
+    are indexed in batches of `INGEST_BATCH_SIZE` while the upload is still in progress,
+    and the collection is created from the first batch if it does not exist. Batches that
+    were indexed before an invalid line are kept.
+
+    Args:
+        collection_name (str): The name of the collection.
+
+    Returns:
+        StreamIngestResponse: The id of the indexing job and the number of documents received.
+    """
+    feed = IngestFeed(settings.INGEST_MAX_PENDING_BATCHES)
+    try:
+        job = job_manager.submit(
+            "stream_documents",
+            store.name,
+            collection_name,
+            lambda: ingest_batches(store.name, collection_name, feed),
+        )
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+    except CollectionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+
+    documents_received = 0
+    try:
+        async for batch in read_ndjson_batches(
+            request.stream(), settings.INGEST_BATCH_SIZE
+        ):
+            await run_in_threadpool(feed.put, batch)
+            documents_received += len(batch)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{e}. The {documents_received} documents received before it are indexed by job {job.id}.",
+        ) from e
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=500, detail=f"{e} See job {job.id} for details."
+        ) from e
+    finally:
+        try:
+            await run_in_threadpool(feed.close)
+        except RuntimeError:
+            pass
+
+    return StreamIngestResponse(
+        status="accepted",
+        message="Documents received, indexing in progress.",
+        job_id=job.id,
+        documents_received=documents_received,
+    )
+
+
+def _search_params(
+    options: Optional[SearchOptions], ks: List[Optional[int]]
+) -> Optional[SearchParams]:
+    """The PLAID settings of a search request, within the limits of the server.
+
+    Explicit settings past the limits are rejected, and those of profiles are lowered to them.
+
+    Args:
+        options (Optional[SearchOptions]): The options of the request.
+        ks (List[Optional[int]]): The k of every query of the request.
+
+    Returns:
+        Optional[SearchParams]: The settings, or None for the settings of the loaded searcher.
+    """
+    if options is None:
+        return None
+    if options.ncells is not None and options.ncells > settings.SEARCH_MAX_NCELLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"ncells can be at most {settings.SEARCH_MAX_NCELLS}.",
+        )
+    if options.ndocs is not None and options.ndocs > settings.SEARCH_MAX_NDOCS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"ndocs can be at most {settings.SEARCH_MAX_NDOCS}.",
+        )
+    if (
+        options.centroid_score_threshold is not None
+        and options.centroid_score_threshold
+        < settings.SEARCH_MIN_CENTROID_SCORE_THRESHOLD
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"centroid_score_threshold must be at least {settings.SEARCH_MIN_CENTROID_SCORE_THRESHOLD}.",
+        )
+
+    params = SearchParams.from_profile(
+        "fast" if options.force_fast else options.profile,
+        max(k if k else 10 for k in ks),
+        ncells=options.ncells,
+        centroid_score_threshold=options.centroid_score_threshold,
+        ndocs=options.ndocs,
+    )
+    if params == SearchParams(k=params.k):
+        return None
+    changes = {}
+    if params.ncells is not None:
+        changes["ncells"] = min(params.ncells, settings.SEARCH_MAX_NCELLS)
+    if params.ndocs is not None:
+        changes["ndocs"] = min(params.ndocs, settings.SEARCH_MAX_NDOCS)
+    if params.centroid_score_threshold is not None:
+        changes["centroid_score_threshold"] = max(
+            params.centroid_score_threshold,
+            settings.SEARCH_MIN_CENTROID_SCORE_THRESHOLD,
+        )
+    return params.replace(**changes)
+
+
 @router.post("/{collection_name}/search", response_model=SearchResponse)
 def search_collection(
     collection_name: str,
@@ -118,43 +302,104 @@ def search_collection(
 
     Args:
         collection_name (str): The name of the collection.
-        search (SearchCollection): The search query.
+        request (SearchCollectionRequest): The query, its k and its PLAID settings.
 
     Returns:
         SearchResponse: The search results.
     """
+    search_params = _search_params(request.options, [request.k])
     try:
-        collection = Collection.load(name=collection_name, store_name=store.name)
-        docs = collection.search(query=request.query, k=request.k)
+        collection = collection_cache.get(store.name, collection_name)
+        docs = search_batcher.search(
+            store.name,
+            collection_name,
+            collection,
+            query=request.query,
+            k=request.k,
+            search_params=search_params,
+        )
         return SearchResponse(documents=docs)
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
+@router.post("/{collection_name}/search:batch", response_model=BatchSearchResponse)
+def batch_search_collection(
+    collection_name: str,
+    request: BatchSearchCollectionRequest,
+    store: Store = Depends(get_store_from_access_token),
+) -> BatchSearchResponse:
+    """Search a collection with many queries at once.
+
+    Args:
+        collection_name (str): The name of the collection.
+        request (BatchSearchCollectionRequest): The queries, each with an optional k and documents to restrict it
+            to, and their PLAID settings.
+
+    Returns:
+        BatchSearchResponse: The search results, one list per query in request order.
+    """
+    if len(request.queries) > settings.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can contain at most {settings.SEARCH_BATCH_MAX_QUERIES} queries.",
+        )
+    search_params = _search_params(request.options, [x.k for x in request.queries])
+    try:
+        collection = collection_cache.get(store.name, collection_name)
+        results = collection.search_batch(
+            queries=[x.query for x in request.queries],
+            k=[x.k for x in request.queries],
+            search_params=search_params,
+            doc_ids=[x.doc_ids for x in request.queries],
+        )
+        return BatchSearchResponse(
+            results=[SearchResponse(documents=docs) for docs in results]
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
 @router.delete("/{collection_name}", response_model=OperationResponse)
 def delete_collection(
     collection_name: str, store: Store = Depends(get_store_from_access_token)
 ):
     """Delete a collection in the specified store.
 
+    The collection is deleted under the same lock as its indexing jobs, and the request is
+    rejected with 409 while any of them is queued or running.
+
     Args:
         collection_name (str): The name of the collection.
 
     Returns:
         str: Status of the operation.
     """
+
+    def delete():
+        try:
+            collection = Collection.load(name=collection_name, store_name=store.name)
+            collection.delete()
+        finally:
+            collection_cache.invalidate(store.name, collection_name)
+
     try:
-        collection = Collection.load(name=collection_name, store_name=store.name)
-        collection.delete()
+        job_manager.run_exclusive(store.name, collection_name, delete)
         return OperationResponse(
             status="success", message="Collection deleted successfully."
         )
+    except CollectionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
-@router.post("/{collection_name}/delete", response_model=OperationResponse)
+@router.post(
+    "/{collection_name}/delete",
+    response_model=JobSubmittedResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
 def delete_documents(
     collection_name: str,
     request: DeleteDocumentsRequest,
@@ -162,16 +407,30 @@ def delete_documents(
 ):
     """Delete documents from a collection.
 
+    The documents are removed in the background, poll `GET /jobs/{job_id}` for its progress.
+
     Args:
         collection_name (str): The name of the collection.
         request (DeleteDocumentsRequest): The documents to delete.
 
+    Returns:
+        JobSubmittedResponse: The id of the indexing job.
     """
-    try:
-        collection = Collection.load(name=collection_name, store_name=store.name)
+
+    def delete():
+        collection = collection_cache.get(store.name, collection_name)
         collection.delete_from_index(document_ids=request.document_ids)
-        return OperationResponse(
-            status="success", message="Collection deleted successfully."
+
+    try:
+        job = job_manager.submit(
+            "delete_documents", store.name, collection_name, delete, in_place=True
+        )
+        return JobSubmittedResponse(
+            status="accepted", message="Document deletion started.", job_id=job.id
         )
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+    except CollectionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
@@ -0,0 +1,37 @@
+"""This module contains the routes for background jobs."""
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from colbertdb.core.models.store import Store
+from colbertdb.server.models import JobResponse
+from colbertdb.server.api.deps import get_store_from_access_token
+from colbertdb.server.services.job_manager import job_manager
+
+router = APIRouter()
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+def get_job(job_id: str, store: Store = Depends(get_store_from_access_token)):
+    """Get the state, progress and timing of a background job.
+
+    Args:
+        job_id (str): The id of the job.
+
+    Returns:
+        JobResponse: The job.
+    """
+    job = job_manager.get(job_id)
+    if job is None or job.store_name != store.name:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return JobResponse(
+        id=job.id,
+        kind=job.kind,
+        collection_name=job.collection_name,
+        state=job.state,
+        progress=job.progress,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        duration_seconds=job.duration_seconds,
+    )
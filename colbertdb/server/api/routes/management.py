@@ -6,8 +6,10 @@ from colbertdb.server.models import (
     CreateStoreRequest,
     CreateStoreResponse,
     GetStoreResponse,
+    SearchBatchingMetricsResponse,
 )
 from colbertdb.server.api.deps import verify_management_api_key
+from colbertdb.server.services.search_batcher import search_batcher
 
 router = APIRouter()
 
@@ -38,3 +40,13 @@ def get_store(store_name: str):
     if not store:
         return status.HTTP_404_NOT_FOUND
     return {"name": store.name, "api_key": store.api_key}
+
+
+@router.get(
+    "/metrics/search-batching",
+    response_model=SearchBatchingMetricsResponse,
+    dependencies=[Depends(verify_management_api_key)],
+)
+def get_search_batching_metrics():
+    """Get the batch size and queueing delay of batched searches."""
+    return search_batcher.metrics.snapshot()
@@ -21,6 +21,21 @@ class Settings(BaseSettings):
     DEFAULT_API_KEY: str
     DATA_DIR: str = ".data"
     STORES_FILE: str = "stores.json"
+    COLLECTION_CACHE_MAX_ENTRIES: int = 16
+    # The budget of the collection cache is the size of the cached indexes on disk.
+    COLLECTION_CACHE_MAX_DISK_MB: int = 4096
+    SEARCH_BATCH_MAX_QUERIES: int = 256
+    SEARCH_BATCH_MAX_SIZE: int = 32
+    SEARCH_BATCH_WAIT_MS: float = 2.0
+    # The most work the PLAID settings of a search request may ask for.
+    SEARCH_MAX_NCELLS: int = 32
+    SEARCH_MAX_NDOCS: int = 8192
+    SEARCH_MIN_CENTROID_SCORE_THRESHOLD: float = 0.3
+    INDEXING_MAX_WORKERS: int = 1
+    INDEXING_MAX_QUEUED_JOBS: int = 64
+    INDEXING_MAX_RETAINED_JOBS: int = 1000
+    INGEST_BATCH_SIZE: int = 1000
+    INGEST_MAX_PENDING_BATCHES: int = 2
 
     class Config:
         env_file = ".env"
@@ -1,7 +1,8 @@
 """ Pydantic models app. """
 
-from typing import List, Optional
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import BaseModel, Field
 
 from colbertdb.core.models.pydantic_models import Document
 
@@ -56,12 +57,46 @@ class OperationResponse(BaseModel):
     message: str
 
 
+class JobSubmittedResponse(OperationResponse):
+    """
+    Pydantic model for the response of an operation that runs as a background job.
+    """
+
+    job_id: str
+
+
+class StreamIngestResponse(JobSubmittedResponse):
+    """
+    Pydantic model for the response of a streaming ingest.
+    """
+
+    documents_received: int
+
+
+class JobResponse(BaseModel):
+    """
+    Pydantic model for the state of a background job.
+    """
+
+    id: str
+    kind: str
+    collection_name: str
+    state: str
+    progress: Dict[str, Any]
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    duration_seconds: Optional[float] = None
+
+
 class CreateCollectionsOptions(BaseModel):
     """
     Pydantic model for options for creating a collection.
     """
 
     force_create: Optional[bool] = False
+    resume: Optional[bool] = False
 
 
 class CreateCollectionRequest(BaseModel):
@@ -95,10 +130,16 @@ class SearchResponse(BaseModel):
 
 class SearchOptions(BaseModel):
     """
-    Pydantic model for search options.
+    Pydantic model for the PLAID settings of a search.
+
+    A profile trades recall for latency, and explicit settings replace those of the profile.
     """
 
-    top_k: Optional[int] = 10
+    profile: Literal["fast", "balanced", "exhaustive"] = "balanced"
+    force_fast: bool = False
+    ncells: Optional[int] = Field(default=None, ge=1)
+    centroid_score_threshold: Optional[float] = Field(default=None, ge=-1.0, le=1.0)
+    ndocs: Optional[int] = Field(default=None, ge=1)
 
 
 class SearchCollectionRequest(BaseModel):
@@ -108,6 +149,34 @@ class SearchCollectionRequest(BaseModel):
 
     k: Optional[int] = None
     query: str
+    options: Optional[SearchOptions] = None
+
+
+class BatchSearchQuery(BaseModel):
+    """
+    Pydantic model for a single query of a batch search.
+    """
+
+    k: Optional[int] = None
+    query: str
+    doc_ids: Optional[List[str]] = None
+
+
+class BatchSearchCollectionRequest(BaseModel):
+    """
+    Pydantic model for searching a collection with many queries.
+    """
+
+    queries: List[BatchSearchQuery] = Field(min_length=1)
+    options: Optional[SearchOptions] = None
+
+
+class BatchSearchResponse(BaseModel):
+    """
+    Pydantic model for the response of a batch search, with one result list per query.
+    """
+
+    results: List[SearchResponse]
 
 
 class DeleteDocumentsRequest(BaseModel):
@@ -142,3 +211,17 @@ class GetStoreResponse(BaseModel):
 
     name: str
     api_key: str
+
+
+class SearchBatchingMetricsResponse(BaseModel):
+    """
+    Pydantic model for the batch size and queueing delay of batched searches.
+    """
+
+    batches: int
+    queries: int
+    mean_batch_size: float
+    max_batch_size: int
+    mean_queue_delay_ms: float
+    p50_queue_delay_ms: float
+    p99_queue_delay_ms: float
@@ -0,0 +1,132 @@
+"""This module contains the CollectionCache class, a process-wide registry of loaded collections."""
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Tuple
+
+from colbertdb.core.models.collection import Collection
+from colbertdb.core.models.index_versions import IndexVersions
+from colbertdb.server.core.config import settings
+
+CacheKey = Tuple[str, str]
+
+
+def collection_disk_size(store_name: str, collection_name: str) -> int:
+    """Return the size on disk of the current index of a collection, with its shared files."""
+    index_path = Path(settings.DATA_DIR) / store_name / "indexes" / collection_name
+    if not index_path.is_dir():
+        return 0
+    versions = IndexVersions(index_path)
+    version_path = versions.path_of(versions.current())
+    # The shared files, and the index itself for collections built before versioning.
+    files = [x for x in index_path.iterdir() if x.is_file()]
+    if version_path != index_path:
+        files.extend(x for x in version_path.rglob("*") if x.is_file())
+    return sum(x.stat().st_size for x in files)
+
+
+class CollectionCache:
+    """An LRU cache of loaded collections keyed by (store, collection).
+
+    The cache is bounded both by the number of entries and by the size on disk of the
+    indexes of the cached collections, which approximates their resident memory without
+    the shared encoder or the buffers of searches. The most recently used collection is
+    always kept, even if it alone exceeds the budget.
+
+    Each collection has a load lock while it is cached or a thread is loading it, so that
+    concurrent misses load it once.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.COLLECTION_CACHE_MAX_ENTRIES,
+        max_disk_mb: int = settings.COLLECTION_CACHE_MAX_DISK_MB,
+    ):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_disk_size = max_disk_mb * 1024 * 1024
+        self.entries: "OrderedDict[CacheKey, Tuple[Collection, int]]" = OrderedDict()
+        self.load_locks: Dict[CacheKey, threading.Lock] = {}
+        # The number of threads that hold or wait for the load lock of a collection.
+        self.loaders: Dict[CacheKey, int] = {}
+        self.generations: Dict[CacheKey, int] = {}
+
+    def get(self, store_name: str, collection_name: str) -> Collection:
+        """Return the loaded collection, loading it from disk on a cache miss."""
+        key = (store_name, collection_name)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+            self.loaders[key] = self.loaders.get(key, 0) + 1
+
+        # Only one thread loads a given collection, the others wait for it.
+        try:
+            with load_lock:
+                with self.lock:
+                    if key in self.entries:
+                        self.entries.move_to_end(key)
+                        return self.entries[key][0]
+                    generation = self.generations.get(key, 0)
+
+                collection = Collection.load(name=collection_name, store_name=store_name)
+                size = collection_disk_size(store_name, collection_name)
+
+                with self.lock:
+                    # Don't cache a collection that was invalidated while it was loading.
+                    if self.generations.get(key, 0) == generation:
+                        self.entries[key] = (collection, size)
+                        self._evict()
+            return collection
+        finally:
+            with self.lock:
+                self.loaders[key] -= 1
+                if self.loaders[key] == 0:
+                    del self.loaders[key]
+                self._drop_load_lock(key)
+
+    def invalidate(self, store_name: str, collection_name: str):
+        """Drop a collection from the cache after it has been changed on disk."""
+        key = (store_name, collection_name)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.generations[key] = self.generations.get(key, 0) + 1
+            self._drop_load_lock(key)
+
+    def clear(self):
+        """Drop all cached collections."""
+        with self.lock:
+            keys = list(self.entries)
+            for key in keys:
+                self.generations[key] = self.generations.get(key, 0) + 1
+            self.entries.clear()
+            for key in keys:
+                self._drop_load_lock(key)
+
+    def disk_usage(self) -> int:
+        """Return the size on disk of the indexes of the cached collections in bytes."""
+        with self.lock:
+            return sum(size for _, size in self.entries.values())
+
+    def _evict(self):
+        """Evict least recently used collections until the cache is within budget."""
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_entries
+            or (
+                self.max_disk_size > 0
+                and sum(size for _, size in self.entries.values()) > self.max_disk_size
+            )
+        ):
+            key, _ = self.entries.popitem(last=False)
+            self._drop_load_lock(key)
+
+    def _drop_load_lock(self, key: CacheKey):
+        """Forget the load lock of a collection that is neither cached nor being loaded."""
+        if key not in self.entries and key not in self.loaders:
+            self.load_locks.pop(key, None)
+
+
+# Initialize the collection cache
+collection_cache = CollectionCache()
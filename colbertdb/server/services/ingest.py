@@ -0,0 +1,142 @@
+"""This module contains the streaming ingest of newline-delimited JSON documents."""
+
+import json
+import queue
+import threading
+from typing import AsyncIterator, Iterator, List, Optional
+
+from pydantic import ValidationError
+
+from colbertdb.core.models.collection import Collection
+from colbertdb.core.models.store import Store
+from colbertdb.core.utils.progress import report_progress
+from colbertdb.server.models import CreateCollectionDocument
+
+
+class IngestFeed:
+    """A bounded hand-off of document batches from a streaming upload to its indexing job.
+
+    The upload blocks once `max_pending_batches` batches are waiting to be indexed, so
+    the memory used by an upload does not depend on its size.
+    """
+
+    def __init__(self, max_pending_batches: int):
+        self.queue: "queue.Queue[Optional[List[CreateCollectionDocument]]]" = (
+            queue.Queue(maxsize=max_pending_batches)
+        )
+        self.consumer_done = threading.Event()
+
+    def put(self, batch: Optional[List[CreateCollectionDocument]]):
+        """Hand a batch to the indexing job, waiting while it is busy.
+
+        Raises:
+            RuntimeError: If the indexing job stopped before taking the batch.
+        """
+        while True:
+            if self.consumer_done.is_set():
+                raise RuntimeError(
+                    "The indexing job stopped before the upload was finished."
+                )
+            try:
+                self.queue.put(batch, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """Signal the end of the upload."""
+        self.put(None)
+
+    def batches(self) -> Iterator[List[CreateCollectionDocument]]:
+        """Iterate over the batches as they arrive, until the upload is closed."""
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            self.consumer_done.set()
+
+
+def ingest_batches(store_name: str, collection_name: str, feed: IngestFeed):
+    """Index the batches of a feed as they arrive.
+
+    The collection is created from the first batch if it does not exist yet.
+
+    Args:
+        store_name (str): The name of the store.
+        collection_name (str): The name of the collection.
+        feed (IngestFeed): The feed of document batches.
+    """
+    # The upload stops waiting for the job once it is done, however it ends.
+    try:
+        collection = None
+        if Store(name=store_name).collection_exists(collection_name):
+            collection = Collection.load(name=collection_name, store_name=store_name)
+
+        documents_indexed, batches_indexed = 0, 0
+        for batch in feed.batches():
+            if collection is None:
+                collection = Collection.create(
+                    name=collection_name, collection=batch, store_name=store_name
+                )
+            else:
+                collection.add_to_index(collection=batch)
+            documents_indexed += len(batch)
+            batches_indexed += 1
+            report_progress(
+                stage="streaming",
+                documents_indexed=documents_indexed,
+                batches_indexed=batches_indexed,
+            )
+
+        # The collection is reloaded from disk once the job is done, merge what this copy added.
+        if collection is not None:
+            collection.merge_delta()
+    finally:
+        feed.consumer_done.set()
+
+async def read_ndjson_batches(
+    stream: AsyncIterator[bytes], batch_size: int
+) -> AsyncIterator[List[CreateCollectionDocument]]:
+    """Parse a stream of newline-delimited JSON documents into batches.
+
+    Args:
+        stream (AsyncIterator[bytes]): The raw request body.
+        batch_size (int): The number of documents per batch. The last batch may be smaller.
+
+    Raises:
+        ValueError: If a line is not a valid document.
+    """
+    buffer = b""
+    batch: List[CreateCollectionDocument] = []
+    line_number = 0
+
+    def parse(line: bytes) -> Optional[CreateCollectionDocument]:
+        if not line.strip():
+            return None
+        try:
+            return CreateCollectionDocument.model_validate(json.loads(line))
+        except (ValueError, ValidationError) as e:
+            raise ValueError(f"Invalid document on line {line_number}: {e}") from e
+
+    async for chunk in stream:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_number += 1
+            document = parse(line)
+            if document is not None:
+                batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    line_number += 1
+    document = parse(buffer)
+    if document is not None:
+        batch.append(document)
+    if batch:
+        yield batch
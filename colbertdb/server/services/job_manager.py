@@ -0,0 +1,227 @@
+"""This module contains the JobManager class, which runs index mutations in the background."""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+from uuid import uuid4
+
+from colbertdb.core.utils.progress import track_progress
+from colbertdb.server.core.config import settings
+from colbertdb.server.services.collection_cache import collection_cache
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when too many jobs are already waiting to run."""
+
+
+class CollectionBusyError(RuntimeError):
+    """Raised when a collection cannot be changed because jobs on it have not finished."""
+
+
+@dataclass
+class Job:
+    """The state of an indexing job."""
+
+    id: str
+    kind: str
+    store_name: str
+    collection_name: str
+    state: str = "queued"
+    progress: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    duration_seconds: Optional[float] = None
+
+
+class JobManager:
+    """Runs index mutations on a bounded pool of worker threads.
+
+    Jobs on the same collection run one at a time, in submission order. The loaded
+    collection keeps serving searches until its job has finished. Jobs that update the
+    cached collection itself keep it cached, the others, and any job that fails, drop it
+    from the collection cache so the next search loads the index from disk.
+
+    Changes that must not wait in the queue, such as deleting a collection, run on the
+    calling thread with `run_exclusive`, under the same per-collection lock as the jobs.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = settings.INDEXING_MAX_WORKERS,
+        max_queued_jobs: int = settings.INDEXING_MAX_QUEUED_JOBS,
+        max_retained_jobs: int = settings.INDEXING_MAX_RETAINED_JOBS,
+    ):
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="colbertdb-indexing"
+        )
+        self.max_queued_jobs = max_queued_jobs
+        self.max_retained_jobs = max_retained_jobs
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.futures: Dict[str, Future] = {}
+        self.collection_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        # The collections that `run_exclusive` is changing, which accept no new jobs.
+        self.exclusive: Set[Tuple[str, str]] = set()
+
+    def submit(
+        self,
+        kind: str,
+        store_name: str,
+        collection_name: str,
+        fn: Callable[[], Any],
+        in_place: bool = False,
+    ) -> Job:
+        """Queue a job.
+
+        Args:
+            kind (str): What the job does, e.g. "create_collection".
+            store_name (str): The name of the store.
+            collection_name (str): The name of the collection the job changes.
+            fn (Callable[[], Any]): The work to run.
+            in_place (bool): Whether the job updates the collection in the collection cache,
+                which then stays cached if the job succeeds. Defaults to False.
+
+        Returns:
+            Job: A snapshot of the queued job.
+
+        Raises:
+            JobQueueFullError: If too many jobs are already waiting to run.
+            CollectionBusyError: If the collection is being changed by `run_exclusive`.
+        """
+        with self.lock:
+            if (store_name, collection_name) in self.exclusive:
+                raise CollectionBusyError(
+                    f"Collection {collection_name} is being changed, try again later."
+                )
+            queued = sum(1 for job in self.jobs.values() if job.state == "queued")
+            if queued >= self.max_queued_jobs:
+                raise JobQueueFullError(
+                    f"Too many indexing jobs are queued ({queued}), try again later."
+                )
+            job = Job(
+                id=str(uuid4()),
+                kind=kind,
+                store_name=store_name,
+                collection_name=collection_name,
+            )
+            self.jobs[job.id] = job
+            self.collection_locks.setdefault(
+                (store_name, collection_name), threading.Lock()
+            )
+            self._evict()
+            snapshot = replace(job, progress=dict(job.progress))
+            self.futures[job.id] = self.executor.submit(
+                self._run, job, fn, in_place
+            )
+        return snapshot
+
+    def run_exclusive(
+        self, store_name: str, collection_name: str, fn: Callable[[], Any]
+    ) -> Any:
+        """Run a change to a collection now, on the calling thread, while no job runs on it.
+
+        Jobs on the collection are not cancelled, the change is rejected while any of them is
+        queued or running, and no job can be submitted on the collection until it is done.
+
+        Args:
+            store_name (str): The name of the store.
+            collection_name (str): The name of the collection the change applies to.
+            fn (Callable[[], Any]): The change to run.
+
+        Returns:
+            Any: The return value of `fn`.
+
+        Raises:
+            CollectionBusyError: If a job on the collection is queued or running.
+        """
+        key = (store_name, collection_name)
+        with self.lock:
+            collection_lock = self.collection_locks.setdefault(key, threading.Lock())
+            pending = sum(
+                1
+                for job in self.jobs.values()
+                if (job.store_name, job.collection_name) == key
+                and job.state in ("queued", "running")
+            )
+            if pending or key in self.exclusive:
+                raise CollectionBusyError(
+                    f"Collection {collection_name} has {pending} unfinished jobs, try again later."
+                )
+            # Only a job that has finished but not yet released the lock can hold it.
+            collection_lock.acquire()
+            self.exclusive.add(key)
+        try:
+            return fn()
+        finally:
+            with self.lock:
+                self.exclusive.discard(key)
+            collection_lock.release()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return a snapshot of a job, or None if it is unknown."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return replace(job, progress=dict(job.progress))
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """Wait for a job to finish and return its final state."""
+        with self.lock:
+            future = self.futures.get(job_id)
+        if future is not None:
+            future.result(timeout=timeout)
+        return self.get(job_id)
+
+    def _run(self, job: Job, fn: Callable[[], Any], in_place: bool):
+        """Run a job on a worker thread and record its outcome."""
+        key = (job.store_name, job.collection_name)
+        with self.collection_locks[key]:
+            with self.lock:
+                job.state = "running"
+                job.started_at = datetime.now(timezone.utc)
+            started = time.monotonic()
+            state = "failed"
+            try:
+                with track_progress(lambda progress: self._update(job, progress)):
+                    fn()
+                state, error = "succeeded", None
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Job {job.id} ({job.kind}) failed: {e}")
+                state, error = "failed", str(e)
+            finally:
+                # A failed update may have left the cached collection half changed.
+                if not in_place or state == "failed":
+                    collection_cache.invalidate(job.store_name, job.collection_name)
+
+            with self.lock:
+                job.state = state
+                job.error = error
+                job.finished_at = datetime.now(timezone.utc)
+                job.duration_seconds = time.monotonic() - started
+                self.futures.pop(job.id, None)
+
+    def _update(self, job: Job, progress: Dict[str, Any]):
+        """Merge a progress report into a job."""
+        with self.lock:
+            job.progress.update(progress)
+
+    def _evict(self):
+        """Forget the oldest finished jobs beyond the retention limit."""
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.state in ("succeeded", "failed")
+        ]
+        for job_id in finished[: max(0, len(self.jobs) - self.max_retained_jobs)]:
+            del self.jobs[job_id]
+
+
+# Initialize the job manager
+job_manager = JobManager()
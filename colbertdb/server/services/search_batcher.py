@@ -0,0 +1,178 @@
+"""This module contains the SearchBatcher class, which merges concurrent searches into batches."""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from colbertdb.core.models.collection import Collection
+from colbertdb.core.models.search_params import SearchParams
+from colbertdb.server.core.config import settings
+
+# Queries are only batched with queries on the same collection with the same settings.
+BatchKey = Tuple[str, str, Optional[SearchParams]]
+
+
+@dataclass
+class _PendingQuery:
+    """A query waiting for its batch to run."""
+
+    query: str
+    k: Optional[int]
+    enqueued_at: float = field(default_factory=time.monotonic)
+    future: Future = field(default_factory=Future)
+
+
+@dataclass
+class _Batch:
+    """The queries collected for a collection and settings during one batching window."""
+
+    collection: Collection
+    search_params: Optional[SearchParams] = None
+    queries: List[_PendingQuery] = field(default_factory=list)
+    full: threading.Event = field(default_factory=threading.Event)
+
+
+class SearchBatcherMetrics:
+    """Batch size and queueing delay statistics over the most recent batches."""
+
+    def __init__(self, window: int = 1024):
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.batch_sizes: Deque[int] = deque(maxlen=window)
+        self.queue_delays_ms: Deque[float] = deque(maxlen=window)
+
+    def record(self, batch_size: int, queue_delays_ms: List[float]):
+        """Record a batch that has been run."""
+        with self.lock:
+            self.batches += 1
+            self.queries += batch_size
+            self.batch_sizes.append(batch_size)
+            self.queue_delays_ms.extend(queue_delays_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current statistics."""
+        with self.lock:
+            sizes = list(self.batch_sizes)
+            delays = sorted(self.queue_delays_ms)
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+                "max_batch_size": max(sizes, default=0),
+                "mean_queue_delay_ms": sum(delays) / len(delays) if delays else 0.0,
+                "p50_queue_delay_ms": _percentile(delays, 0.50),
+                "p99_queue_delay_ms": _percentile(delays, 0.99),
+            }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Return the q-th percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class SearchBatcher:
+    """Merges concurrent single-query searches on the same collection into batches.
+
+    Searches with different PLAID settings go in different batches, since a batch is
+    searched with a single set of settings. The first query to reach an idle collection
+    with its settings opens a batch and waits for the
+    batching window, or until the batch is full, then runs every collected query with
+    a single encoder forward pass. The other requests wait for their own result.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = settings.SEARCH_BATCH_MAX_SIZE,
+        max_wait_ms: float = settings.SEARCH_BATCH_WAIT_MS,
+    ):
+        self.lock = threading.Lock()
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.pending: Dict[BatchKey, _Batch] = {}
+        self.metrics = SearchBatcherMetrics()
+
+    def search(
+        self,
+        store_name: str,
+        collection_name: str,
+        collection: Collection,
+        query: str,
+        k: Optional[int] = None,
+        search_params: Optional[SearchParams] = None,
+    ) -> List[dict]:
+        """Search a collection, batching the query with concurrent searches.
+
+        Args:
+            store_name (str): The name of the store.
+            collection_name (str): The name of the collection.
+            collection (Collection): The loaded collection.
+            query (str): The query.
+            k (Optional[int]): The number of results to return.
+            search_params (Optional[SearchParams]): The PLAID settings of the search. Defaults to None.
+
+        Returns:
+            List[dict]: The search results for the query.
+        """
+        if self.max_batch_size <= 1 or self.max_wait_ms <= 0:
+            self.metrics.record(1, [0.0])
+            return collection.search(query=query, k=k, search_params=search_params)
+
+        key = (store_name, collection_name, search_params)
+        pending = _PendingQuery(query=query, k=k)
+        with self.lock:
+            batch = self.pending.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = _Batch(collection=collection, search_params=search_params)
+                self.pending[key] = batch
+            batch.queries.append(pending)
+            if len(batch.queries) >= self.max_batch_size:
+                self.pending.pop(key)
+                batch.full.set()
+
+        if is_leader:
+            batch.full.wait(timeout=self.max_wait_ms / 1000)
+            with self.lock:
+                if self.pending.get(key) is batch:
+                    self.pending.pop(key)
+            self._run(batch)
+        return pending.future.result()
+
+    def _run(self, batch: _Batch):
+        """Run a closed batch and hand each query its result."""
+        started_at = time.monotonic()
+        self.metrics.record(
+            len(batch.queries),
+            [(started_at - x.enqueued_at) * 1000 for x in batch.queries],
+        )
+        try:
+            if len(batch.queries) == 1:
+                results = [
+                    batch.collection.search(
+                        query=batch.queries[0].query,
+                        k=batch.queries[0].k,
+                        search_params=batch.search_params,
+                    )
+                ]
+            else:
+                results = batch.collection.search_batch(
+                    queries=[x.query for x in batch.queries],
+                    k=[x.k for x in batch.queries],
+                    search_params=batch.search_params,
+                )
+        except Exception as e:
+            for pending in batch.queries:
+                pending.future.set_exception(e)
+            return
+        for pending, result in zip(batch.queries, results):
+            pending.future.set_result(result)
+
+
+# Initialize the search batcher
+search_batcher = SearchBatcher()
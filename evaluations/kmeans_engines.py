@@ -0,0 +1,131 @@
+"""
+Benchmark of the k-means engines that can train the centroids of an index on CPU.
+
+For each sample size it clusters normalized embeddings drawn around random centers, with as
+many partitions as colbert creates for that many embeddings, and times:
+- fast_pytorch_kmeans: `compute_pytorch_kmeans`, the previous PyTorch engine. Its assignment
+  step builds a partitions x sample matrix, so it is skipped when that does not fit in
+  `--max-memory-gb`;
+- cpu full-batch and cpu mini-batch: `CPUKMeans`;
+- faiss: the default engine, for reference.
+
+Every engine runs the same number of iterations, without early stopping, and the inertia of
+the resulting centroids is computed on the whole sample. Lower is better.
+
+Usage:
+    python -m evaluations.kmeans_engines --sizes 10000 100000 1000000 --threads 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from colbertdb.core.utils.torch_kmeans import (
+    CPUKMeans,
+    compute_pytorch_kmeans,
+    intra_op_threads,
+    nearest_centroids,
+)
+
+DIM = 128
+
+
+def _sample(size: int, seed: int = 0) -> torch.Tensor:
+    """Normalized embeddings around `size // 100` random centers."""
+    generator = torch.Generator().manual_seed(seed)
+    centers = torch.randn(max(1, size // 100), DIM, generator=generator)
+    points = centers[torch.randint(len(centers), (size,), generator=generator)]
+    points += 0.5 * torch.randn(size, DIM, generator=generator)
+    return torch.nn.functional.normalize(points, dim=-1)
+
+
+def _num_partitions(size: int) -> int:
+    """The number of partitions colbert creates for `size` embeddings."""
+    return int(2 ** np.floor(np.log2(16 * np.sqrt(size))))
+
+
+def _faiss(sample: torch.Tensor, num_partitions: int, iterations: int):
+    import faiss  # pylint: disable=import-outside-toplevel
+
+    kmeans = faiss.Kmeans(DIM, num_partitions, niter=iterations, seed=123)
+    kmeans.train(sample.numpy())
+    return torch.from_numpy(kmeans.centroids)
+
+
+def run(size: int, iterations: int, threads: int, max_memory_gb: float) -> dict:
+    """
+    Time every engine on one sample.
+
+    Args:
+        size (int): The number of embeddings in the sample.
+        iterations (int): The number of k-means iterations.
+        threads (int): The number of intra-op threads.
+        max_memory_gb (float): The memory fast_pytorch_kmeans may use for its assignments.
+
+    Returns:
+        dict: The time in seconds and the inertia of each engine, None if it was skipped.
+    """
+    sample = _sample(size)
+    num_partitions = _num_partitions(size)
+    engines = {
+        "cpu full-batch": lambda: CPUKMeans(
+            num_partitions, max_iter=iterations, tol=-1
+        ).fit(sample).centroids,
+        "cpu mini-batch": lambda: CPUKMeans(
+            num_partitions,
+            max_iter=iterations,
+            tol=-1,
+            minibatch=max(10_000, len(sample) // 10),
+        ).fit(sample).centroids,
+        "faiss": lambda: _faiss(sample, num_partitions, iterations),
+    }
+    # Its one-hot assignment matrix and the distances, in float32.
+    if 2 * 4 * num_partitions * min(size, 256 * num_partitions) <= max_memory_gb * 2**30:
+        engines["fast_pytorch_kmeans"] = lambda: compute_pytorch_kmeans(
+            sample, DIM, num_partitions, iterations, use_gpu=False, verbose=0
+        )
+
+    results = {"partitions": num_partitions}
+    with intra_op_threads(threads):
+        for name in ["fast_pytorch_kmeans", "cpu full-batch", "cpu mini-batch", "faiss"]:
+            if name not in engines:
+                results[name] = None
+                continue
+            started = time.perf_counter()
+            centroids = engines[name]()
+            elapsed = time.perf_counter() - started
+            inertia = float(nearest_centroids(sample, centroids)[0].sum())
+            results[name] = (elapsed, inertia)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--max-memory-gb", type=float, default=8.0)
+    args = parser.parse_args()
+
+    print(
+        f"{'sample':>10} {'partitions':>10} {'engine':>20} {'time (s)':>10} {'inertia':>12}"
+    )
+    for size in args.sizes:
+        results = run(size, args.iterations, args.threads, args.max_memory_gb)
+        for name, result in results.items():
+            if name == "partitions":
+                continue
+            timing, inertia = (
+                (f"{result[0]:>10.2f}", f"{result[1]:>12.1f}")
+                if result is not None
+                else (f"{'skipped':>10}", f"{'-':>12}")
+            )
+            print(f"{size:>10,} {results['partitions']:>10,} {name:>20} {timing} {inertia}")
+
+
+if __name__ == "__main__":
+    main()
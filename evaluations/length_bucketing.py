@@ -0,0 +1,101 @@
+"""
+Benchmark of encoding documents in length-bucketed batches against colbert's fixed-size batches.
+
+It encodes a synthetic corpus whose documents have skewed lengths, most of them short and a
+few long, once with `Checkpoint.docFromText` and a batch size, where every batch is padded to
+the longest document, and once with `encode_documents` and a budget of `bsize * doc_maxlen`
+tokens per batch. It reports the time, the padding efficiency of each run and the largest
+difference between the embeddings, which should only come from floating point rounding.
+
+Usage:
+    python -m evaluations.length_bucketing --checkpoint colbert-ir/colbertv2.0 --documents 5000
+"""
+
+import argparse
+import random
+import time
+from typing import List
+
+import torch
+from colbert.infra import ColBERTConfig
+
+from colbertdb.core.models.checkpoint_registry import checkpoint_registry
+from colbertdb.core.utils.length_batching import PaddingStats, encode_documents
+
+WORDS = (
+    "the of and to in is was for on that with as by at from his her an were which "
+    "are this be has had not their also its after first new two one they been other "
+    "city year time state world system school music film game team river house water"
+).split()
+
+
+def _corpus(num_documents: int, seed: int = 0) -> List[str]:
+    """Documents of 4 to 300 words, with a median of about 15."""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choices(WORDS, k=min(300, int(rng.lognormvariate(2.7, 0.9)) + 4)))
+        for _ in range(num_documents)
+    ]
+
+
+def run(checkpoint: str, num_documents: int, doc_maxlen: int, bsize: int) -> dict:
+    """
+    Time both ways of batching on one corpus.
+
+    Args:
+        checkpoint (str): The checkpoint to encode with.
+        num_documents (int): The number of documents in the corpus.
+        doc_maxlen (int): The maximum document length.
+        bsize (int): The batch size of colbert, and the number of longest documents in a bucketed batch.
+
+    Returns:
+        dict: The time in seconds and the padding efficiency of each run, and the largest difference.
+    """
+    ckpt = checkpoint_registry.view(checkpoint, colbert_config=ColBERTConfig(doc_maxlen=doc_maxlen))
+    documents = _corpus(num_documents)
+
+    started = time.perf_counter()
+    fixed, fixed_doclens = ckpt.docFromText(documents, bsize=bsize, keep_dims="flatten")
+    fixed_time = time.perf_counter() - started
+
+    # Every batch of colbert is padded to the longest document of the call.
+    _, mask = ckpt.doc_tokenizer.tensorize(documents)
+    fixed_efficiency = float(mask.sum()) / mask.numel()
+
+    stats = PaddingStats()
+    started = time.perf_counter()
+    bucketed, bucketed_doclens = encode_documents(
+        ckpt, documents, max_batch_tokens=bsize * doc_maxlen, stats=stats
+    )
+    bucketed_time = time.perf_counter() - started
+
+    if bucketed_doclens != fixed_doclens:
+        raise AssertionError("length bucketing changed the number of embeddings")
+    return {
+        "fixed": (fixed_time, fixed_efficiency),
+        "bucketed": (bucketed_time, stats.efficiency),
+        "max_difference": float((fixed.float() - bucketed.float()).abs().max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--checkpoint", default="colbert-ir/colbertv2.0")
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--doc-maxlen", type=int, default=300)
+    parser.add_argument("--bsize", type=int, default=32)
+    args = parser.parse_args()
+
+    with torch.inference_mode():
+        results = run(args.checkpoint, args.documents, args.doc_maxlen, args.bsize)
+    print(f"{args.documents:,} documents, largest difference {results['max_difference']:.2e}")
+    print(f"{'batching':>10} {'time (s)':>10} {'docs/s':>10} {'padding efficiency':>20}")
+    for name in ["fixed", "bucketed"]:
+        elapsed, efficiency = results[name]
+        print(
+            f"{name:>10} {elapsed:>10.2f} {args.documents / elapsed:>10,.0f} {efficiency:>20.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
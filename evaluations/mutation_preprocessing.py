@@ -0,0 +1,119 @@
+"""
+Benchmark of the bookkeeping done by add_to_index and delete_from_index before the index is touched.
+
+For each index size and batch size it times:
+- add: selecting the passages of documents that are not indexed yet, then appending them to the
+  document id map;
+- delete: resolving the passages of the deleted documents, then marking them as deleted;
+- legacy add: the previous `docid not in pid_docid_map.values()` scan, for the smaller sizes only,
+  since it grows with index size times batch size.
+
+The times should grow linearly with the batch size and stay flat across index sizes.
+
+Usage:
+    python -m evaluations.mutation_preprocessing --index-sizes 100000 1000000 --batch-sizes 1000 10000
+"""
+
+import argparse
+import tempfile
+import time
+from typing import List
+
+from colbertdb.core.models.colbertplaid import ColbertPLAID
+from colbertdb.core.models.docid_map import DocIdMap
+
+PASSAGES_PER_DOCUMENT = 4
+LEGACY_MAX_COMPARISONS = 10**9
+
+
+def _docids(start: int, count: int) -> List[str]:
+    """The document id of each passage of `count` documents, starting at document `start`."""
+    return [
+        f"doc-{i}"
+        for i in range(start, start + count)
+        for _ in range(PASSAGES_PER_DOCUMENT)
+    ]
+
+
+def _time(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def run(index_size: int, batch_size: int) -> dict:
+    """
+    Time the add and delete bookkeeping of one batch against one index.
+
+    Args:
+        index_size (int): The number of documents in the index.
+        batch_size (int): The number of documents in the batch.
+
+    Returns:
+        dict: The timings, in seconds.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        docid_map = DocIdMap.create(path, _docids(0, index_size))
+        # Build the docid lookup, which is done once per loaded collection.
+        docid_map.existing(["doc-0"])
+
+        # Half of the batch is already indexed, like a retried upload.
+        new_docids = _docids(index_size - batch_size // 2, batch_size)
+        new_pid_docid_map = dict(enumerate(new_docids))
+        new_documents = ["passage"] * len(new_docids)
+
+        def add():
+            selected = ColbertPLAID._select_new_documents(
+                docid_map, new_documents, new_pid_docid_map
+            )
+            docid_map.append([doc["document_id"] for doc in selected])
+
+        timings = {"add": _time(add)}
+
+        deleted_docids = [f"doc-{i}" for i in range(0, index_size, index_size // batch_size)]
+        timings["delete"] = _time(
+            lambda: docid_map.remove(docid_map.pids(deleted_docids))
+        )
+
+        pid_docid_map = dict(enumerate(_docids(0, index_size)))
+        if len(pid_docid_map) * len(new_docids) <= LEGACY_MAX_COMPARISONS:
+            timings["legacy add"] = _time(
+                lambda: [
+                    doc
+                    for pid, doc in enumerate(new_documents)
+                    if new_pid_docid_map[pid] not in pid_docid_map.values()
+                ]
+            )
+        docid_map.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--index-sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[100, 1_000, 10_000]
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'index docs':>12} {'batch docs':>12} {'add (ms)':>10} "
+        f"{'delete (ms)':>12} {'legacy add (ms)':>16}"
+    )
+    for index_size in args.index_sizes:
+        for batch_size in args.batch_sizes:
+            if batch_size > index_size:
+                continue
+            timings = run(index_size, batch_size)
+            legacy = timings.get("legacy add")
+            legacy = f"{legacy * 1000:>16.1f}" if legacy is not None else f"{'-':>16}"
+            print(
+                f"{index_size:>12,} {batch_size:>12,} {timings['add'] * 1000:>10.1f} "
+                f"{timings['delete'] * 1000:>12.1f} {legacy}"
+            )
+
+
+if __name__ == "__main__":
+    main()
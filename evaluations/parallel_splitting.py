@@ -0,0 +1,107 @@
+"""
+Benchmark of document splitting with CorpusProcessor, serially and across a pool of processes.
+
+It splits a synthetic corpus of documents made of random sentences with
+`llama_index_sentence_splitter`, as `Collection.index` does, once in this process and once
+for each number of workers. The time includes starting the workers, and every parallel run
+is checked to return exactly the chunks of the serial run, in the same order.
+
+Usage:
+    python -m evaluations.parallel_splitting --documents 100000 --workers 2 4 8 16 32
+"""
+
+import argparse
+import os
+import random
+import time
+from typing import List
+
+from colbertdb.core.utils.documentutils import (
+    CorpusProcessor,
+    llama_index_sentence_splitter,
+)
+
+WORDS = (
+    "the of and to in is was for on that with as by at from his her an were which "
+    "are this be has had not their also its after first new two one they been other "
+    "city year time state world system school music film game team river house water"
+).split()
+
+
+def _corpus(num_documents: int, seed: int = 0) -> List[str]:
+    """Documents of 5 to 60 sentences of 5 to 25 words, about 1 to 12 chunks each."""
+    rng = random.Random(seed)
+    documents = []
+    for _ in range(num_documents):
+        sentences = []
+        for _ in range(rng.randint(5, 60)):
+            words = rng.choices(WORDS, k=rng.randint(5, 25))
+            sentences.append(" ".join(words).capitalize() + ".")
+        documents.append(" ".join(sentences))
+    return documents
+
+
+def run(
+    num_documents: int, workers: List[int], shard_size: int, chunk_size: int
+) -> dict:
+    """
+    Time the serial split and the parallel split of one corpus.
+
+    Args:
+        num_documents (int): The number of documents in the corpus.
+        workers (List[int]): The numbers of worker processes to time.
+        shard_size (int): The number of documents split by a worker at a time.
+        chunk_size (int): The chunk size given to the splitter.
+
+    Returns:
+        dict: The number of chunks, and the time in seconds for each number of workers, 1 being serial.
+    """
+    documents = _corpus(num_documents)
+    document_ids = [str(i) for i in range(num_documents)]
+
+    started = time.perf_counter()
+    serial = CorpusProcessor(llama_index_sentence_splitter).process_corpus(
+        documents, document_ids, chunk_size=chunk_size
+    )
+    results = {"chunks": len(serial), 1: time.perf_counter() - started}
+
+    for num_workers in workers:
+        started = time.perf_counter()
+        with CorpusProcessor(
+            llama_index_sentence_splitter,
+            num_workers=num_workers,
+            shard_size=shard_size,
+        ) as processor:
+            parallel = processor.process_corpus(
+                documents, document_ids, chunk_size=chunk_size
+            )
+        results[num_workers] = time.perf_counter() - started
+        if parallel != serial:
+            raise AssertionError(f"{num_workers} workers changed the chunks")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[2, 4, os.cpu_count() or 1]
+    )
+    parser.add_argument("--shard-size", type=int, default=256)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    args = parser.parse_args()
+
+    workers = [x for x in args.workers if x > 1]
+    results = run(args.documents, workers, args.shard_size, args.chunk_size)
+    print(f"{args.documents:,} documents, {results['chunks']:,} chunks")
+    print(f"{'workers':>8} {'time (s)':>10} {'docs/s':>10} {'speedup':>8}")
+    for num_workers in [1, *workers]:
+        elapsed = results[num_workers]
+        print(
+            f"{num_workers:>8} {elapsed:>10.2f} {args.documents / elapsed:>10,.0f}"
+            f" {results[1] / elapsed:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Recall parity and speed of the int8 encoder against the float32 encoder, on CPU.
+
+It indexes a sample collection with the float32 encoder, then searches it with queries taken
+from its documents, once with a collection whose queries are encoded in float32 and once with
+a collection that uses the int8 encoder of the checkpoint. It reports the recall@k of both, the
+overlap of their top k, and fails if the int8 recall is more than `--max-recall-drop` below.
+
+It then times the encoding with both encoders:
+- query latency: one query at a time, as a search does;
+- query throughput: queries encoded in batches of `--bsize`;
+- document throughput: documents encoded in batches of `--bsize`.
+
+Usage:
+    python -m evaluations.quantized_encoder --checkpoint .data/.checkpoints/colbertv2.0 --documents 2000 --queries 200
+"""
+
+import argparse
+import random
+import time
+from statistics import mean
+from typing import List, Tuple
+
+import torch
+
+from colbertdb.core.models.checkpoint_registry import checkpoint_registry
+from colbertdb.core.models.collection import Collection
+from colbertdb.core.models.colbertplaid import ColbertPLAID
+from colbertdb.core.models.pydantic_models import Document
+from colbertdb.core.utils.length_batching import encode_documents
+
+WORDS = (
+    "the of and to in is was for on that with as by at from his her an were which "
+    "are this be has had not their also its after first new two one they been other "
+    "city year time state world system school music film game team river house water "
+    "north south war church island village station company album season league party "
+    "river bridge castle forest museum garden mountain lake valley harbour railway"
+).split()
+
+
+def _sample(num_documents: int, num_queries: int, seed: int = 0) -> Tuple[List[str], List[Tuple[str, int]]]:
+    """Documents of 30 to 120 words, and queries of 6 to 12 consecutive words of one of them."""
+    rng = random.Random(seed)
+    documents = [
+        " ".join(rng.choices(WORDS, k=rng.randint(30, 120))) for _ in range(num_documents)
+    ]
+    queries = []
+    for target in rng.sample(range(num_documents), num_queries):
+        words = documents[target].split()
+        length = rng.randint(6, 12)
+        start = rng.randint(0, len(words) - length)
+        queries.append((" ".join(words[start : start + length]), target))
+    return documents, queries
+
+
+def _top_k(model: ColbertPLAID, queries: List[str], k: int) -> List[List[str]]:
+    results = [model.search(query, k=k) or [] for query in queries]
+    return [[result["document_id"] for result in query_results] for query_results in results]
+
+
+def _per_second(fn, count: int) -> float:
+    started = time.perf_counter()
+    fn()
+    return count / (time.perf_counter() - started)
+
+
+def _timings(checkpoint: str, quantized: bool, documents: List[str], queries: List[str], bsize: int) -> dict:
+    ckpt = checkpoint_registry.view(checkpoint, quantized=quantized)
+    # Warm up the kernels before timing.
+    ckpt.queryFromText(queries[:bsize], bsize=bsize)
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        ckpt.queryFromText([query])
+        latencies.append(time.perf_counter() - started)
+    return {
+        "query latency (ms)": 1000 * mean(latencies),
+        "queries/s": _per_second(lambda: ckpt.queryFromText(queries, bsize=bsize), len(queries)),
+        "documents/s": _per_second(
+            lambda: encode_documents(ckpt, documents, bsize * ckpt.doc_tokenizer.doc_maxlen),
+            len(documents),
+        ),
+    }
+
+
+def run(
+    checkpoint: str, num_documents: int, num_queries: int, k: int, bsize: int, store_name: str
+) -> dict:
+    """
+    Search and time a sample collection with both encoders.
+
+    Args:
+        checkpoint (str): The checkpoint to encode with.
+        num_documents (int): The number of documents in the collection.
+        num_queries (int): The number of queries.
+        k (int): The number of results of a search.
+        bsize (int): The batch size of the throughput measurements.
+        store_name (str): The store the sample collection is indexed in.
+
+    Returns:
+        dict: The recall@k of each encoder, the overlap of their top k, and their timings.
+    """
+    documents, queries = _sample(num_documents, num_queries)
+    texts = [query for query, _ in queries]
+    Collection.create(
+        [Document(content=content, document_id=str(idx)) for idx, content in enumerate(documents)],
+        name="quantized_encoder",
+        store_name=store_name,
+        checkpoint=checkpoint,
+    )
+
+    top_k = {}
+    for name, quantized in [("float32", False), ("int8", True)]:
+        model = ColbertPLAID(
+            index_name="quantized_encoder",
+            store_name=store_name,
+            load_from_index=True,
+            quantize_encoder=quantized,
+        )
+        top_k[name] = _top_k(model, texts, k)
+
+    results = {
+        name: {
+            f"recall@{k}": mean(str(target) in ids for ids, (_, target) in zip(top_k[name], queries))
+        }
+        for name in top_k
+    }
+    results["overlap"] = mean(
+        len(set(a) & set(b)) / max(1, len(a)) for a, b in zip(top_k["float32"], top_k["int8"])
+    )
+    with torch.inference_mode():
+        for name, quantized in [("float32", False), ("int8", True)]:
+            results[name].update(_timings(checkpoint, quantized, documents, texts, bsize))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--checkpoint", default=".data/.checkpoints/colbertv2.0")
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--bsize", type=int, default=32)
+    parser.add_argument("--store-name", default="evaluations")
+    parser.add_argument("--max-recall-drop", type=float, default=0.01)
+    args = parser.parse_args()
+
+    results = run(
+        args.checkpoint, args.documents, args.queries, args.k, args.bsize, args.store_name
+    )
+    metrics = list(results["float32"])
+    print(f"{'encoder':>8} " + " ".join(f"{metric:>20}" for metric in metrics))
+    for name in ["float32", "int8"]:
+        print(f"{name:>8} " + " ".join(f"{results[name][metric]:>20.3f}" for metric in metrics))
+    print(f"top {args.k} overlap: {results['overlap']:.1%}")
+
+    drop = results["float32"][f"recall@{args.k}"] - results["int8"][f"recall@{args.k}"]
+    if drop > args.max_recall_drop:
+        raise SystemExit(
+            f"The int8 encoder loses {drop:.3f} recall@{args.k}, more than {args.max_recall_drop}"
+        )
+
+
+if __name__ == "__main__":
+    main()
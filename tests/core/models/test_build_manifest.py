@@ -0,0 +1,20 @@
+""" Tests for the BuildManifest class """
+
+from colbertdb.core.models.build_manifest import KMEANS, SPLIT, BuildManifest
+
+
+def test_stages_and_chunks_are_recorded_durably(tmp_path):
+    """Test that recorded stages and chunks are read back, and that finishing removes the record."""
+    assert BuildManifest.load(tmp_path) is None
+
+    manifest = BuildManifest.start(tmp_path)
+    (tmp_path / "0.codes.pt").write_bytes(b"codes")
+    manifest.complete(SPLIT)
+    manifest.complete_chunk(0, ["0.codes.pt"])
+
+    reopened = BuildManifest.start(tmp_path)
+    assert reopened.is_complete(SPLIT) and not reopened.is_complete(KMEANS)
+    assert reopened.has_chunk(0) and not reopened.has_chunk(1)
+
+    reopened.finish()
+    assert not BuildManifest.exists(tmp_path)
@@ -0,0 +1,74 @@
+""" Tests for the CheckpointRegistry class """
+
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+import torch
+from colbert.infra import ColBERTConfig
+
+from colbertdb.core.models.checkpoint_registry import CheckpointRegistry
+
+
+class FakeCheckpoint(torch.nn.Module):
+    """A stand-in for colbert's Checkpoint that does not load any weights."""
+
+    def __init__(self, name, colbert_config=None, verbose=3):
+        super().__init__()
+        self.name = name
+        self.colbert_config = colbert_config
+        self.linear = torch.nn.Linear(4, 4)
+        self.bert = torch.nn.Sequential(torch.nn.Linear(4, 4))
+        self.query_tokenizer = SimpleNamespace(tok=object(), query_maxlen=32)
+        self.doc_tokenizer = SimpleNamespace(tok=object(), doc_maxlen=180)
+
+
+@pytest.fixture(autouse=True)
+def fake_checkpoint():
+    """Replace checkpoint loading with the fake checkpoint."""
+    with patch(
+        "colbertdb.core.models.checkpoint_registry.Checkpoint", FakeCheckpoint
+    ), patch(
+        "colbertdb.core.models.checkpoint_registry.ColBERTConfig.load_from_checkpoint",
+        return_value=ColBERTConfig(checkpoint="fake-checkpoint"),
+    ):
+        yield
+
+
+def test_checkpoint_is_loaded_once():
+    """Test that every view of a checkpoint shares the same weights."""
+    registry = CheckpointRegistry()
+    first = registry.view("fake-checkpoint")
+    second = registry.view("fake-checkpoint")
+
+    assert registry.loaded_checkpoints() == ["fake-checkpoint"]
+    assert first is not second
+    assert first.linear is second.linear
+    assert first.linear.weight.data_ptr() == second.linear.weight.data_ptr()
+
+
+def test_view_lengths_are_independent():
+    """Test that changing the lengths of a view does not change the shared checkpoint."""
+    registry = CheckpointRegistry()
+    view = registry.view("fake-checkpoint", query_maxlen=64, doc_maxlen=256)
+    other = registry.view("fake-checkpoint")
+    shared = registry.get("fake-checkpoint")
+
+    view.query_tokenizer.query_maxlen = 128
+    assert view.doc_tokenizer.doc_maxlen == 256
+    assert other.query_tokenizer.query_maxlen == shared.query_tokenizer.query_maxlen
+    assert shared.query_tokenizer.query_maxlen == 32
+    assert shared.doc_tokenizer.doc_maxlen == 180
+
+
+def test_quantized_encoder_is_a_separate_copy():
+    """Test that the int8 encoder quantizes the BERT linear layers of its own copy of the weights."""
+    registry = CheckpointRegistry()
+    view = registry.view("fake-checkpoint")
+    quantized = registry.view("fake-checkpoint", quantized=True)
+
+    assert registry.loaded_checkpoints() == ["fake-checkpoint", "fake-checkpoint (int8)"]
+    assert isinstance(view.bert[0], torch.nn.Linear)
+    assert isinstance(quantized.bert[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert isinstance(quantized.linear, torch.nn.Linear)
+    assert quantized.bert is registry.view("fake-checkpoint", quantized=True).bert
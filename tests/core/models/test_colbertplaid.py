@@ -0,0 +1,77 @@
+""" Tests for the updates of ColbertPLAID """
+
+import threading
+from unittest.mock import MagicMock, patch
+
+import torch
+
+from colbertdb.core.models.colbertplaid import ColbertPLAID
+from colbertdb.core.models.delta_segment import DeltaSegment
+from colbertdb.core.models.docid_map import DocIdMap
+from colbertdb.core.models.index import PLAIDModelIndex
+from colbertdb.core.models.index_versions import IndexVersions
+from colbertdb.core.models.passage_store import PassageStore
+from colbertdb.core.utils.rwlock import RWLock
+
+
+def _encode(documents, bsize=32, verbose=False):
+    """Stand-in embeddings, one token per passage."""
+    return torch.ones(len(documents), 1, 2), torch.ones(len(documents), 1)
+
+
+def _loaded_plaid(path, num_passages, num_delta):
+    """A loaded collection whose last `num_delta` passages are in the delta, without an encoder."""
+    plaid = ColbertPLAID.__new__(ColbertPLAID)
+    plaid.index_name = "collection"
+    plaid.store_name = "test"
+    plaid.checkpoint = "checkpoint"
+    plaid.config = MagicMock()
+    plaid.loaded_from_index = True
+    plaid.rebuild_from_embeddings = False
+    plaid.lock = RWLock()
+    plaid.model_index = MagicMock()
+    plaid.metadata_store = MagicMock()
+    plaid._merge_thread = None
+    plaid.run_context = MagicMock()
+    plaid._version_reference = None
+    plaid.index_versions = IndexVersions(path)
+    plaid.index_version = plaid.index_versions.acquire_current()
+    plaid.collection = PassageStore.create(path, (f"passage {i}" for i in range(num_passages)))
+    plaid.docid_map = DocIdMap.create(path, (f"doc{i}" for i in range(num_passages)))
+    plaid.delta = DeltaSegment(num_passages - num_delta)
+    plaid.delta.append(*_encode(range(num_delta)))
+    return plaid
+
+
+def test_add_to_index_during_a_rebuild_merge(tmp_path):
+    """Test that passages added while the index is rebuilt neither break it nor get lost."""
+    plaid = _loaded_plaid(tmp_path / "collection", 20000, 10)
+    rebuilding = threading.Event()
+    added = []
+
+    def add():
+        rebuilding.wait(5)
+        for i in range(200):
+            plaid.add_to_index([f"new passage {i}"], {0: f"new{i}"})
+            added.append(i)
+
+    with patch.object(
+        ColbertPLAID, "_encode_index_free_documents", side_effect=_encode
+    ), patch.object(ColbertPLAID, "_save_index_metadata"), patch.object(
+        PLAIDModelIndex, "load_centroids"
+    ):
+        adder = threading.Thread(target=add)
+        adder.start()
+        with plaid.index_versions.update_lock:
+            rebuilding.set()
+            plaid._rebuild_index(1, 20000, 32)
+        adder.join()
+
+    assert plaid.index_versions.current() == plaid.index_version == 1
+    assert len(plaid.collection) == len(plaid.docid_map) == 20000 + len(added)
+    assert plaid.collection[19999] == "passage 19999"
+    assert plaid.collection[-1] == f"new passage {added[-1]}"
+    assert plaid.docid_map.docid(len(plaid.collection) - 1) == f"new{added[-1]}"
+    # The passages added during the rebuild stay in the delta, after the merged ones.
+    assert plaid.delta.first_pid == 20000
+    assert plaid.delta.end_pid == len(plaid.collection)
@@ -0,0 +1,52 @@
+""" Tests for the Collection class """
+
+import pytest
+import srsly
+
+from colbertdb.core.models.collection import Collection, read_jsonl_documents
+
+
+def _split_words(documents, document_ids, chunk_size):
+    """A splitter that makes a passage of every word."""
+    return [
+        {"document_id": document_id, "content": word}
+        for document, document_id in zip(documents, document_ids)
+        for word in document.split()
+    ]
+
+
+def test_stream_corpus_splits_in_batches(tmp_path):
+    """Test that documents read from a file are split a batch at a time, keeping their ids."""
+    path = tmp_path / "documents.jsonl"
+    srsly.write_jsonl(
+        path,
+        [
+            {"content": "a b", "document_id": "x", "metadata": {"n": 1}},
+            {"content": "c"},
+            {"content": "d e f", "document_id": "z"},
+        ],
+    )
+
+    batches = list(
+        Collection()._stream_corpus(
+            read_jsonl_documents(path), _split_words, 256, batch_size=2
+        )
+    )
+
+    assert len(batches) == 2
+    passages, docids, metadata = batches[0]
+    assert passages == ["a", "b", "c"]
+    assert docids[:2] == ["x", "x"]
+    assert metadata == {"x": {"n": 1}, docids[2]: {}}
+    assert batches[1] == (["d", "e", "f"], ["z", "z", "z"], {"z": {}})
+
+
+def test_stream_corpus_rejects_duplicate_ids_across_batches(tmp_path):
+    """Test that a document id used in an earlier batch is rejected."""
+    path = tmp_path / "documents.jsonl"
+    srsly.write_jsonl(
+        path, [{"content": "a", "document_id": "x"}, {"content": "b", "document_id": "x"}]
+    )
+
+    with pytest.raises(ValueError):
+        list(Collection()._stream_corpus(read_jsonl_documents(path), None, 256, 1))
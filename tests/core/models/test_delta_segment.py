@@ -0,0 +1,72 @@
+""" Tests for the DeltaSegment class """
+
+import torch
+
+from colbertdb.core.models.delta_segment import DeltaSegment
+from colbertdb.core.models.index import _merge_results
+
+
+def _batch(doclens, num_tokens=4, dim=2):
+    """A padded batch where passage i has doclens[i] embeddings filled with i + 1."""
+    embeddings = torch.zeros(len(doclens), num_tokens, dim)
+    for i, doclen in enumerate(doclens):
+        embeddings[i, :doclen] = i + 1
+    return embeddings, torch.full((len(doclens), num_tokens), -float("inf"))
+
+
+def test_flatten_and_drop_keep_pids_aligned():
+    """Test that merged batches are unpadded and that the remaining passages keep their pids."""
+    delta = DeltaSegment(10)
+    delta.append(*_batch([2, 3]))
+    delta.append(*_batch([1]))
+    assert len(delta) == 3
+    assert 12 in delta and 13 not in delta
+
+    embeddings, doclens = delta.flatten(1)
+    assert doclens == [2, 3]
+    assert embeddings.shape == (5, 2)
+
+    delta.drop(1)
+    assert [pid for pid, _, _ in delta.enumerate_batches()] == [12]
+
+    delta.drop(0, first_pid=4)
+    assert delta.first_pid == 4 and delta.end_pid == 5
+
+
+def test_merge_results_ranks_both_sources_by_score():
+    """Test that index and delta results are merged into the best k, ranked from 1."""
+    pids, ranks, scores = _merge_results([1, 2], [9.0, 5.0], [7], [6.0], 2)
+    assert pids == [1, 7]
+    assert ranks == [1, 2]
+    assert scores == [9.0, 6.0]
+
+
+def test_batches_are_saved_with_the_version(tmp_path):
+    """Test that a loaded segment has the batches that were saved, and not the merged ones."""
+    delta = DeltaSegment(10, path=tmp_path)
+    delta.append(*_batch([2, 3]))
+    delta.append(*_batch([1]))
+    delta.append(*_batch([4]))
+    delta.drop(1)
+
+    loaded = DeltaSegment.load(tmp_path, 12, num_pids=14)
+    assert [pid for pid, _, _ in loaded.enumerate_batches()] == [12, 13]
+    assert torch.equal(loaded.batches[1][0], delta.batches[1][0])
+    assert sorted(x.name for x in (tmp_path / "delta").iterdir()) == ["12.pt", "13.pt"]
+
+    # Passages that are not in the version, or follow a batch that was not saved, are left out.
+    assert DeltaSegment.load(tmp_path, 12, num_pids=13).end_pid == 13
+    assert len(DeltaSegment.load(tmp_path, 11, num_pids=14)) == 0
+
+
+def test_rebuild_saves_the_carried_batches_in_the_new_version(tmp_path):
+    """Test that the batches left after a rebuild are saved in the new version, under their new pids."""
+    delta = DeltaSegment(10, path=tmp_path / "1")
+    delta.append(*_batch([2, 3]))
+    delta.append(*_batch([1]))
+
+    delta.drop(1, first_pid=4, path=tmp_path / "2")
+
+    loaded = DeltaSegment.load(tmp_path / "2", 4, num_pids=5)
+    assert len(loaded) == 1
+    assert torch.equal(loaded.batches[0][0], delta.batches[0][0])
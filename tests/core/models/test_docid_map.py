@@ -0,0 +1,74 @@
+""" Tests for the DocIdMap class """
+
+import srsly
+
+from colbertdb.core.models.docid_map import (
+    HASH_FILE,
+    INDICES_FILE,
+    LEGACY_PID_DOCID_MAP_FILE,
+    DocIdMap,
+)
+
+
+def test_lookups_after_append_and_remove(tmp_path):
+    """Test both directions of the mapping as passages are added and deleted."""
+    docid_map = DocIdMap.create(tmp_path, ["a", "a", "b"])
+    assert docid_map.pids(["a"]) == [0, 1]
+
+    docid_map.append(["c", "c", "d"])
+    docid_map.append(["b"])
+    docid_map.remove([0, 4])
+
+    reloaded = DocIdMap(tmp_path)
+    for mapping in (docid_map, reloaded):
+        assert len(mapping) == 7
+        assert mapping.docid(0) is None
+        assert mapping.docid(5) == "d"
+        assert mapping.pids(["b", "a", "unknown"]) == [2, 6, 1]
+        assert mapping.pids(["c"]) == [3]
+        assert "d" in mapping and "e" not in mapping
+        assert mapping.live_pids().tolist() == [1, 2, 3, 5, 6]
+        assert mapping.num_live == 5
+        assert mapping.existing(["a", "a", "e", "d"]) == {"a", "d"}
+
+
+def test_load_converts_legacy_map(tmp_path):
+    """Test that a pid_docid_map.json written by older versions is converted on load."""
+    srsly.write_json(tmp_path / LEGACY_PID_DOCID_MAP_FILE, {"0": "a", "2": "b"})
+
+    docid_map = DocIdMap.load(tmp_path, num_pids=3)
+
+    assert [docid_map.docid(pid) for pid in range(3)] == ["a", None, "b"]
+    assert docid_map.pids(["b"]) == [2]
+    assert not (tmp_path / LEGACY_PID_DOCID_MAP_FILE).exists()
+
+
+def test_readded_documents_get_new_ordinals(tmp_path):
+    """Test that passages added to known documents extend the index instead of rebuilding it."""
+    docid_map = DocIdMap.create(tmp_path, ["a", "b", "b"])
+    docid_map.remove(docid_map.pids(["a"]))
+    indices = (tmp_path / INDICES_FILE).stat().st_ino
+
+    # Enough documents to grow the hash table past its first size.
+    docid_map.append(["b", "a", "b"] + [f"doc{i}" for i in range(20)])
+    docid_map.append(["a"])
+
+    assert (tmp_path / INDICES_FILE).stat().st_ino == indices
+    assert len(docid_map.table) == 2 + 22 + 1
+    reloaded = DocIdMap(tmp_path)
+    for mapping in (docid_map, reloaded):
+        assert mapping.pids(["a"]) == [4, 26]
+        assert mapping.pids(["b"]) == [1, 2, 3, 5]
+        assert mapping.pids(["doc19"]) == [25]
+        assert mapping.docid(26) == "a"
+
+
+def test_hash_table_is_built_for_maps_without_one(tmp_path):
+    """Test that maps written before the hash table was kept on disk get one when opened."""
+    DocIdMap.create(tmp_path, ["a", "b", "a"])
+    (tmp_path / HASH_FILE).unlink()
+
+    docid_map = DocIdMap(tmp_path)
+
+    assert (tmp_path / HASH_FILE).exists()
+    assert docid_map.pids(["a", "b"]) == [0, 2, 1]
@@ -0,0 +1,162 @@
+""" Tests for the index updates of PLAIDModelIndex """
+
+import dataclasses
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+import torch
+from colbert.infra import ColBERTConfig
+
+from colbertdb.core.models.index import PLAIDModelIndex, _merge_into_ivf, _token_indices
+from colbertdb.core.models.search_params import SearchParams
+from colbertdb.core.utils import torch_kmeans
+
+
+def test_merge_into_ivf_appends_pids_per_centroid():
+    """Test that new passages are listed once per centroid, after the existing pids."""
+    ivf = torch.tensor([0, 2, 1, 0, 1, 2], dtype=torch.int32)
+    ivf_lengths = torch.tensor([2, 1, 0, 3])
+    # Passage 3 has embeddings in centroids 2, 0 and 2, passage 4 in centroid 3.
+    codes = torch.tensor([2, 0, 2, 3], dtype=torch.int32)
+
+    new_ivf, new_lengths = _merge_into_ivf(ivf, ivf_lengths, codes, [3, 1], 3)
+
+    assert new_lengths.tolist() == [3, 1, 1, 4]
+    assert new_ivf.dtype == torch.int32
+    assert new_ivf.tolist() == [0, 2, 3, 1, 3, 0, 1, 2, 4]
+
+
+def test_token_indices_gathers_passages_in_order():
+    """Test that the embeddings of passages are found from their doclens, skipping deleted ones."""
+    doclens = torch.tensor([2, 0, 3, 1])
+    offsets = torch.cumsum(doclens, 0) - doclens
+
+    tokens = _token_indices(offsets, doclens, torch.tensor([0, 2, 3]))
+
+    assert tokens.tolist() == [0, 1, 2, 3, 4, 5]
+    assert _token_indices(offsets, doclens, torch.tensor([3, 0])).tolist() == [5, 0, 1]
+    assert _token_indices(offsets, doclens, torch.tensor([], dtype=torch.long)).tolist() == []
+
+
+def test_search_params_are_resolved_without_changing_the_searcher():
+    """Test that the settings of a search come from the searcher and the request, leaving the searcher as is."""
+    searcher_config = ColBERTConfig(ncells=8, centroid_score_threshold=0.4, ndocs=1024)
+    index = PLAIDModelIndex(ColBERTConfig())
+    index.searcher = SimpleNamespace(
+        config=searcher_config,
+        collection=["passage"] * 500,
+        ranker=SimpleNamespace(codec=SimpleNamespace(centroids=torch.zeros(16, 8))),
+    )
+
+    params = index.resolve_search_params(SearchParams(k=300), ["a short query"], 510)
+    assert params == SearchParams(
+        k=300, ncells=8, centroid_score_threshold=0.4, ndocs=1200, query_maxlen=32
+    )
+
+    params = index.resolve_search_params(
+        SearchParams(k=1000, ncells=2, query_maxlen=600), ["query"], 510
+    )
+    assert (params.k, params.ncells, params.ndocs, params.query_maxlen) == (500, 2, 2000, 510)
+    assert params.colbert_config(searcher_config).ncells == 2
+
+    assert (searcher_config.ncells, searcher_config.ndocs, searcher_config.query_maxlen) == (8, 1024, 32)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        params.k = 5
+
+
+def test_search_config_keeps_the_searcher_settings_that_are_not_set():
+    """Test that a search config only replaces the settings of a search that are set."""
+    searcher_config = ColBERTConfig(
+        ncells=8, ndocs=1024, query_maxlen=64, collection=["passage"] * 3
+    )
+
+    config = SearchParams(k=10, ncells=2).colbert_config(searcher_config)
+
+    assert (config.ncells, config.ndocs, config.query_maxlen) == (2, 1024, 64)
+    assert config.collection is searcher_config.collection
+    assert searcher_config.ncells == 8
+
+
+def test_search_profiles():
+    """Test that profiles fill in the settings that are not set, within the size of the index."""
+    index = PLAIDModelIndex(ColBERTConfig())
+    index.searcher = SimpleNamespace(
+        config=ColBERTConfig(ncells=8, centroid_score_threshold=0.4, ndocs=1024),
+        collection=["passage"] * 500,
+        ranker=SimpleNamespace(codec=SimpleNamespace(centroids=torch.zeros(16, 8))),
+    )
+
+    assert SearchParams.from_profile("fast", 100) == SearchParams(
+        k=100, ncells=1, centroid_score_threshold=0.5, ndocs=400
+    )
+    assert SearchParams.from_profile("balanced", 5, ndocs=64) == SearchParams(k=5, ndocs=64)
+    with pytest.raises(ValueError):
+        SearchParams.from_profile("slow")
+
+    params = index.resolve_search_params(
+        SearchParams.from_profile("exhaustive", 10, centroid_score_threshold=0.2),
+        ["query"],
+        510,
+    )
+    assert (params.ncells, params.centroid_score_threshold, params.ndocs) == (16, 0.2, 8192)
+
+
+def test_batch_search_restricts_each_query_to_its_pids():
+    """Test that the queries of a batch are restricted to their own pids, or search the whole index."""
+    scored = []
+
+    def score_pids(config, Q, pids, centroid_scores):
+        scored.append((pids.tolist(), centroid_scores is None))
+        return pids.float(), pids
+
+    index = PLAIDModelIndex(ColBERTConfig())
+    index.searcher = SimpleNamespace(
+        config=ColBERTConfig(),
+        ranker=SimpleNamespace(
+            use_gpu=False,
+            codec=SimpleNamespace(centroids=torch.eye(4)),
+            ivf=SimpleNamespace(lookup=lambda cells: (torch.arange(4, dtype=torch.int32), None)),
+            score_pids=score_pids,
+        ),
+    )
+    params = SearchParams(
+        k=2, ncells=1, centroid_score_threshold=0.5, ndocs=8, query_maxlen=2
+    )
+
+    with patch.object(PLAIDModelIndex, "_encode_queries", return_value=torch.randn(3, 2, 4)):
+        results = index._batch_search(["a", "b", "c"], params, pids=[None, [1, 3], []])
+
+    assert [result[0] for result in results] == [[3, 2], [3, 1], []]
+    assert scored == [([0, 1, 2, 3], False), ([1, 3], True)]
+
+
+def test_build_clusters_with_cpu_kmeans_on_cpu():
+    """Test that builds on CPU train their centroids with CPUKMeans, in mini-batches for large samples."""
+    index = PLAIDModelIndex(ColBERTConfig(checkpoint="checkpoint"))
+    collection_indexer = SimpleNamespace(
+        use_gpu=False,
+        num_partitions=4,
+        config=SimpleNamespace(kmeans_niters=20),
+        init_centroids=None,
+        kmeans_tolerance=1e-3,
+    )
+    fitted, cpu_kmeans_cls = [], torch_kmeans.CPUKMeans
+
+    def cpu_kmeans(*args, **kwargs):
+        fitted.append(cpu_kmeans_cls(*args, **kwargs))
+        return fitted[-1]
+
+    for threshold in [None, 32]:
+        with patch(
+            "colbertdb.core.models.index.ColbertDBIndexer"
+        ) as indexer, patch.object(
+            PLAIDModelIndex, "kmeans_minibatch_threshold", threshold
+        ), patch.object(PLAIDModelIndex, "kmeans_minibatch_size", 16):
+            index.build("checkpoint", ["passage"] * 10, "index", store_name="test")
+        engine = indexer.return_value.index.call_args.kwargs["kmeans_engine"]
+        with patch.object(torch_kmeans, "CPUKMeans", side_effect=cpu_kmeans):
+            centroids = engine(collection_indexer, torch.randn(64, 8), None)
+        assert centroids.shape == (4, 8)
+
+    assert [kmeans.minibatch for kmeans in fitted] == [None, 16]
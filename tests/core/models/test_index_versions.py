@@ -0,0 +1,86 @@
+""" Tests for the IndexVersions class """
+
+from colbertdb.core.models.build_manifest import SPLIT, BuildManifest
+from colbertdb.core.models.index_versions import (
+    CURRENT_FILE,
+    IndexVersions,
+    version_name,
+)
+from colbertdb.core.models.metadata_store import METADATA_STORE_FILE
+
+
+def test_old_versions_are_deleted_once_released(tmp_path):
+    """Test that a version is only deleted once it is neither current nor referenced."""
+    versions = IndexVersions(tmp_path)
+    first = versions.create()
+    versions.switch(first)
+    assert versions.acquire_current() == first
+
+    second = versions.create()
+    versions.switch(second)
+    versions.release(first)
+    assert versions.path_of(first).exists()
+
+    versions.release(first)
+    assert not versions.path_of(first).exists()
+    assert versions.current() == second
+    assert version_name("c", second) == "c/versions/2"
+
+
+def test_unversioned_index_is_version_zero(tmp_path):
+    """Test that the files of an index built before versioning are deleted once replaced."""
+    (tmp_path / "metadata.json").write_text("{}")
+    (tmp_path / METADATA_STORE_FILE).write_text("")
+    versions = IndexVersions(tmp_path)
+    assert versions.current() == 0
+    assert versions.path_of(0) == tmp_path
+    assert version_name("c", 0) == "c"
+
+    version = versions.create()
+    versions.switch(version)
+    versions.release(version)
+
+    assert versions.current() == version
+    assert sorted(x.name for x in tmp_path.iterdir()) == [
+        CURRENT_FILE,
+        METADATA_STORE_FILE,
+        "versions",
+    ]
+
+
+def test_unfinished_builds_are_kept_until_resumed_or_discarded(tmp_path):
+    """Test that an unfinished build survives garbage collection and can be resumed."""
+    versions = IndexVersions(tmp_path)
+    version = versions.create()
+    BuildManifest.start(versions.path_of(version)).complete(SPLIT)
+    assert versions.acquire_unfinished() is None
+
+    versions.release(version)
+    assert versions.path_of(version).exists()
+
+    assert versions.acquire_unfinished() == version
+    assert BuildManifest(versions.path_of(version)).is_complete(SPLIT)
+    versions.release(version)
+
+    versions.discard_unfinished()
+    assert not versions.path_of(version).exists()
+
+
+def test_metadata_of_a_build_replaces_the_shared_store_on_switch(tmp_path):
+    """Test that the shared metadata store is only replaced once the build is current."""
+    (tmp_path / METADATA_STORE_FILE).write_text("current")
+    versions = IndexVersions(tmp_path)
+    version = versions.create()
+    (versions.path_of(version) / METADATA_STORE_FILE).write_text("new")
+    assert (tmp_path / METADATA_STORE_FILE).read_text() == "current"
+
+    versions.switch(version)
+    assert (tmp_path / METADATA_STORE_FILE).read_text() == "new"
+    assert not (versions.path_of(version) / METADATA_STORE_FILE).exists()
+
+    # A switch interrupted after CURRENT was replaced is completed by the next load.
+    second = versions.create()
+    (versions.path_of(second) / METADATA_STORE_FILE).write_text("second")
+    (tmp_path / CURRENT_FILE).write_text(str(second))
+    assert versions.acquire_current() == second
+    assert (tmp_path / METADATA_STORE_FILE).read_text() == "second"
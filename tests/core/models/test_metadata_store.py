@@ -0,0 +1,38 @@
+""" Tests for the MetadataStore class """
+
+import srsly
+
+from colbertdb.core.models.metadata_store import LEGACY_METADATA_FILE, MetadataStore
+
+
+def test_put_get_and_delete(tmp_path):
+    """Test that metadata is written and deleted per document."""
+    store = MetadataStore.create(tmp_path, {"a": {"x": 1}, "b": {}})
+    store.put_many({"c": {"nested": [1, "two"]}, "a": {"x": 2}})
+    store.delete_many(["b", "unknown"])
+
+    reopened = MetadataStore.load(tmp_path)
+    assert len(reopened) == 2
+    assert reopened.get("a") == {"x": 2}
+    assert reopened.get("b") is None
+    assert reopened.get_many(["c", "a", "c"]) == {
+        "c": {"nested": [1, "two"]},
+        "a": {"x": 2},
+    }
+
+
+def test_get_many_batches_parameters(tmp_path):
+    """Test lookups of more documents than SQLite accepts parameters in one statement."""
+    store = MetadataStore.create(tmp_path, {str(i): {"i": i} for i in range(2500)})
+
+    assert len(store.get_many(str(i) for i in range(0, 2500, 2))) == 1250
+
+
+def test_load_converts_legacy_metadata(tmp_path):
+    """Test that a docid_metadata_map.json written by older versions is converted on load."""
+    srsly.write_json(tmp_path / LEGACY_METADATA_FILE, {"a": {"x": 1}})
+
+    store = MetadataStore.load(tmp_path)
+
+    assert store.get("a") == {"x": 1}
+    assert not (tmp_path / LEGACY_METADATA_FILE).exists()
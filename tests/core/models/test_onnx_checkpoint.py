@@ -0,0 +1,102 @@
+""" Tests for the ONNX Runtime backend of the encoder """
+
+import os
+
+import pytest
+import torch
+from colbert.infra import ColBERTConfig
+from colbert.modeling.checkpoint import Checkpoint
+from colbert.modeling.hf_colbert import class_factory
+from transformers import BertConfig, BertTokenizerFast
+
+from colbertdb.core.models.onnx_checkpoint import (
+    ONNX_MODEL_FILE,
+    OnnxCheckpoint,
+    export_dir,
+)
+from colbertdb.core.utils.length_batching import encode_documents
+
+pytest.importorskip("onnxruntime")
+
+WORDS = ["rice", "snack", "salt", "seaweed", "river", "city", "train", "search", "index", "."]
+
+
+@pytest.fixture(name="checkpoint_path")
+def fixture_checkpoint_path(tmp_path):
+    """A tiny checkpoint with random weights."""
+    path = str(tmp_path / "checkpoint")
+    os.makedirs(path)
+    vocab = ["[PAD]", "[unused0]", "[unused1]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS]
+    with open(os.path.join(path, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab))
+    BertTokenizerFast(os.path.join(path, "vocab.txt")).save_pretrained(path)
+    bert_config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+    )
+    bert_config.save_pretrained(path)
+    colbert_config = ColBERTConfig(
+        dim=16,
+        doc_maxlen=32,
+        query_maxlen=8,
+        checkpoint=path,
+        query_token_id="[unused0]",
+        doc_token_id="[unused1]",
+    )
+    torch.manual_seed(0)
+    class_factory(path)(bert_config, colbert_config).save_pretrained(path)
+    colbert_config.save_for_checkpoint(path)
+    return path
+
+
+def _load(checkpoint_cls, path):
+    return checkpoint_cls(
+        path, colbert_config=ColBERTConfig.load_from_checkpoint(path), verbose=0
+    )
+
+
+def test_onnx_embeddings_match_torch(checkpoint_path):
+    """Test that queries and documents are encoded like with the PyTorch encoder."""
+    torch_checkpoint = _load(Checkpoint, checkpoint_path)
+    onnx_checkpoint = _load(OnnxCheckpoint, checkpoint_path)
+    queries = ["rice snack", "search the index of the city ."]
+    documents = ["rice .", "seaweed salt snack , river city train .", "search index " * 5]
+
+    assert torch.allclose(
+        onnx_checkpoint.queryFromText(queries),
+        torch_checkpoint.queryFromText(queries),
+        atol=1e-5,
+    )
+
+    expected, expected_doclens = torch_checkpoint.docFromText(
+        documents, bsize=2, keep_dims="flatten"
+    )
+    embeddings, doclens = encode_documents(onnx_checkpoint, documents, max_batch_tokens=32)
+    assert doclens == expected_doclens
+    assert torch.allclose(embeddings, expected, atol=1e-5)
+
+
+def test_onnx_checkpoint_releases_the_torch_weights(checkpoint_path):
+    """Test that only the session holds the weights, and the model config stays available."""
+    onnx_checkpoint = _load(OnnxCheckpoint, checkpoint_path)
+
+    assert all(x.is_meta for x in onnx_checkpoint.parameters())
+    assert onnx_checkpoint.bert.config.max_position_embeddings == 512
+    assert onnx_checkpoint.queryFromText(["rice snack"]).device == torch.device("cpu")
+
+
+def test_onnx_export_is_cached(checkpoint_path):
+    """Test that the export is reused, and made again once the checkpoint changes."""
+    _load(OnnxCheckpoint, checkpoint_path)
+    model_path = export_dir(checkpoint_path) / ONNX_MODEL_FILE
+    exported = model_path.stat().st_mtime_ns
+
+    _load(OnnxCheckpoint, checkpoint_path)
+    assert model_path.stat().st_mtime_ns == exported
+
+    os.utime(os.path.join(checkpoint_path, "config.json"), ns=(0, 0))
+    _load(OnnxCheckpoint, checkpoint_path)
+    assert model_path.stat().st_mtime_ns != exported
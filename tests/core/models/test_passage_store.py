@@ -0,0 +1,57 @@
+""" Tests for the PassageStore class """
+
+import srsly
+
+from colbertdb.core.models.passage_store import (
+    LEGACY_COLLECTION_FILE,
+    ChainedPassages,
+    PassageStore,
+    PassageStoreWriter,
+    PassageView,
+)
+
+
+def test_create_append_and_rewrite(tmp_path):
+    """Test that passages keep their ids across appends and can be compacted."""
+    store = PassageStore.create(tmp_path, ["first", "", "ünïcode"])
+    assert list(store) == ["first", "", "ünïcode"]
+
+    store.append(["fourth"])
+    assert len(store) == 4
+    assert store[-1] == "fourth"
+    assert list(PassageStore(tmp_path)) == ["first", "", "ünïcode", "fourth"]
+
+    store.rewrite(ChainedPassages(PassageView(store, [0, 2]), ["fifth"]))
+    assert list(store) == ["first", "ünïcode", "fifth"]
+    assert store.get_many([2, 0]) == ["fifth", "first"]
+
+
+def test_load_converts_legacy_collection(tmp_path):
+    """Test that a collection.json written by older versions is converted on load."""
+    srsly.write_json(tmp_path / LEGACY_COLLECTION_FILE, ["a", "b"])
+
+    store = PassageStore.load(tmp_path)
+
+    assert list(store) == ["a", "b"]
+    assert not (tmp_path / LEGACY_COLLECTION_FILE).exists()
+    assert PassageStore.exists(tmp_path)
+
+
+def test_writer_replaces_store_only_on_success(tmp_path):
+    """Test that a store written in batches replaces the existing one, unless writing fails."""
+    PassageStore.create(tmp_path, ["old"])
+
+    with PassageStoreWriter(tmp_path) as writer:
+        writer.write(["a", "b"])
+        writer.write(iter(["c"]))
+    assert writer.num_passages == 3
+    assert list(PassageStore(tmp_path)) == ["a", "b", "c"]
+
+    try:
+        with PassageStoreWriter(tmp_path) as writer:
+            writer.write(["d"])
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert list(PassageStore(tmp_path)) == ["a", "b", "c"]
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,71 @@
+""" Tests for the document splitting helpers """
+
+from transformers import BertTokenizerFast
+
+from colbertdb.core.utils.documentutils import (
+    CorpusProcessor,
+    TokenChunker,
+    llama_index_sentence_splitter,
+)
+
+
+def test_parallel_splitting_keeps_order_and_ids():
+    """Test that splitting across processes gives the same chunks, in the same order, as serially."""
+    documents = [
+        " ".join(f"Sentence {i} number {j} of the document." for j in range(i * 5))
+        for i in range(1, 8)
+    ]
+    document_ids = [f"doc-{i}" for i in range(len(documents))]
+    serial = CorpusProcessor(llama_index_sentence_splitter).process_corpus(
+        documents, document_ids, chunk_size=64
+    )
+
+    with CorpusProcessor(
+        llama_index_sentence_splitter, num_workers=2, shard_size=2
+    ) as processor:
+        parallel = processor.process_corpus(documents, document_ids, chunk_size=64)
+
+    assert parallel == serial
+    assert len(serial) > len(documents)
+
+
+def _tokenizer(tmp_path):
+    """A wordpiece tokenizer where every word is one token, except for 'unbelievable'."""
+    words = ["alpha", "beta", "gamma", "delta", "un", "##believ", "##able", ".", ","]
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *words]))
+    return BertTokenizerFast(vocab_file=str(vocab))
+
+
+def test_token_chunker_packs_whole_sentences(tmp_path):
+    """Test that sentences are packed into chunks that fit, and that a long sentence is cut between words."""
+    tokenizer = _tokenizer(tmp_path)
+    document = "alpha beta. gamma delta. alpha. " + " ".join(["beta"] * 7) + " unbelievable beta."
+    chunker = TokenChunker(tokenizer, max_tokens=6)
+
+    chunks = chunker([document], ["d"])
+
+    contents = [x["content"] for x in chunks]
+    assert contents == [
+        "alpha beta. gamma delta.",
+        "alpha.",
+        "beta beta beta beta beta beta",
+        "beta unbelievable beta.",
+    ]
+    assert {x["document_id"] for x in chunks} == {"d"}
+    for content in contents:
+        assert len(tokenizer(content, add_special_tokens=False)["input_ids"]) <= 6
+
+
+def test_token_chunker_overlap(tmp_path):
+    """Test that consecutive chunks share whole sentences up to the overlap."""
+    chunker = TokenChunker.for_doc_maxlen(_tokenizer(tmp_path), doc_maxlen=8, overlap=2)
+
+    chunks = chunker(["alpha. beta. gamma delta. alpha beta gamma."], ["d"])
+
+    # 5 wordpieces per chunk, and only sentences of at most 2 of them are repeated.
+    assert [x["content"] for x in chunks] == [
+        "alpha. beta.",
+        "beta. gamma delta.",
+        "alpha beta gamma.",
+    ]
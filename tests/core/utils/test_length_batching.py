@@ -0,0 +1,73 @@
+""" Tests for the length-bucketed batching of documents """
+
+import torch
+
+from colbertdb.core.utils.length_batching import (
+    PaddingStats,
+    encode_documents,
+    length_bucketed_batches,
+)
+
+
+class FakeTokenizer:
+    """Tokenizes a document into one token per word, padded to the longest document."""
+
+    def tensorize(self, documents):
+        lengths = [len(document.split()) for document in documents]
+        mask = torch.zeros(len(documents), max(lengths), dtype=torch.long)
+        for idx, length in enumerate(lengths):
+            mask[idx, :length] = 1
+        return mask.cumsum(-1) * mask, mask
+
+
+class FakeCheckpoint:
+    """Embeds a token as its position, and records the shapes of the batches it encodes."""
+
+    def __init__(self):
+        self.doc_tokenizer = FakeTokenizer()
+        self.shapes = []
+
+    def doc(self, ids, mask, keep_dims="return_mask", to_cpu=False):
+        self.shapes.append(tuple(ids.shape))
+        return ids.unsqueeze(-1).float(), mask.bool().unsqueeze(-1)
+
+
+def test_batches_fit_the_budget():
+    """Test that every item is batched once, with the padded size of its batch within the budget."""
+    lengths = torch.tensor([5, 1, 9, 3, 3, 20, 2, 7])
+
+    batches = length_bucketed_batches(lengths, max_batch_tokens=10)
+
+    assert sorted(torch.cat(batches).tolist()) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) == 1 or len(batch) * int(lengths[batch].max()) <= 10
+    assert [lengths[batch].tolist() for batch in batches] == [
+        [1, 2, 3],
+        [3, 5],
+        [7],
+        [9],
+        [20],
+    ]
+
+
+def test_encode_documents_restores_the_order():
+    """Test that the embeddings are returned in the order of the documents, and that padding is counted."""
+    documents = ["a b c", "a", "a b c d e f", "a b"]
+    checkpoint = FakeCheckpoint()
+    stats = PaddingStats()
+
+    embs, doclens = encode_documents(
+        checkpoint, documents, max_batch_tokens=6, stats=stats
+    )
+
+    assert doclens == [3, 1, 6, 2]
+    assert embs.squeeze(-1).tolist() == [1, 2, 3, 1, 1, 2, 3, 4, 5, 6, 1, 2]
+    assert checkpoint.shapes == [(2, 2), (1, 3), (1, 6)]
+    assert (stats.tokens, stats.padded_tokens) == (12, 13)
+
+    padded = encode_documents(checkpoint, documents, max_batch_tokens=6, keep_dims=True)
+    assert padded.shape == (4, 6, 1)
+    assert padded[1].squeeze(-1).tolist() == [1, 0, 0, 0, 0, 0]
+
+    embeddings = encode_documents(checkpoint, documents, max_batch_tokens=6, keep_dims=False)
+    assert [e.squeeze(-1).tolist() for e in embeddings] == [[1, 2, 3], [1], [1, 2, 3, 4, 5, 6], [1, 2]]
@@ -0,0 +1,48 @@
+""" Tests for the k-means helpers """
+
+import torch
+
+from colbertdb.core.utils.torch_kmeans import (
+    CPUKMeans,
+    nearest_centroids,
+    warm_start_centroids,
+)
+
+
+def test_nearest_centroids_in_chunks():
+    """Test that chunking the distance computation does not change the assignments."""
+    points = torch.tensor([[0.0, 0.0], [1.0, 1.0], [5.0, 5.0], [4.0, 6.0]])
+    centroids = torch.tensor([[5.0, 5.0], [0.0, 0.0]])
+
+    distances, assignments = nearest_centroids(points, centroids, max_elements=2)
+
+    assert assignments.tolist() == [1, 1, 0, 0]
+    assert distances.tolist() == [0.0, 2.0, 0.0, 2.0]
+
+
+def test_warm_start_keeps_previous_centroids():
+    """Test that previous centroids are kept, and that new ones are seeded from uncovered points."""
+    sample = torch.cat([torch.zeros(50, 2), torch.full((50, 2), 10.0)])
+    previous = torch.tensor([[0.0, 0.0], [-5.0, -5.0]])
+
+    grown = warm_start_centroids(sample, previous, 3)
+    assert grown[:2].tolist() == previous.tolist()
+    assert grown[2].tolist() == [10.0, 10.0]
+
+    shrunk = warm_start_centroids(sample, previous, 1)
+    assert shrunk.tolist() == [[0.0, 0.0]]
+
+
+def test_cpu_kmeans_finds_separated_clusters():
+    """Test that both modes find well separated clusters, deterministically."""
+    generator = torch.Generator().manual_seed(0)
+    centers = torch.tensor([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+    points = centers.repeat_interleave(100, 0) + 0.1 * torch.randn(300, 2, generator=generator)
+
+    for minibatch in (None, 64):
+        kmeans = CPUKMeans(3, max_iter=30, minibatch=minibatch, max_elements=16)
+        centroids = kmeans.fit(points).centroids
+        again = CPUKMeans(3, max_iter=30, minibatch=minibatch, max_elements=16)
+        assert torch.equal(centroids, again.fit(points).centroids)
+        assert sorted(centroids.round().tolist()) == sorted(centers.tolist())
+        assert kmeans.n_iter <= 30
@@ -1,5 +1,6 @@
 """Test the ColbertDB API routes."""
 
+import threading
 from unittest.mock import patch, MagicMock
 
 import pytest
@@ -8,10 +9,20 @@ from colbertdb.server.main import app
 from colbertdb.server.models import CreateCollectionDocument, DeleteDocumentsRequest
 from colbertdb.server.core.config import settings
 from colbertdb.server.services.auth import create_access_token
+from colbertdb.server.services.collection_cache import collection_cache
+from colbertdb.server.services.job_manager import job_manager
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def clear_collection_cache():
+    """Make sure no loaded collection leaks between tests."""
+    collection_cache.clear()
+    yield
+    collection_cache.clear()
+
+
 @pytest.fixture
 def api_client():
     """Create a test client for the API."""
@@ -80,17 +91,17 @@ def test_create_collection(api_client):
                         headers={"Authorization": f"Bearer {token}"},
                     )
 
-                    assert response.status_code == 200
-                    assert response.json() == {
-                        "status": "success",
-                        "message": "Collection created successfully.",
-                    }
+                    assert response.status_code == 202
+                    assert response.json()["status"] == "accepted"
+                    job = job_manager.wait(response.json()["job_id"])
+                    assert job.state == "succeeded"
                     mock_create.assert_called_once_with(
                         name="test",
                         collection=[
                             CreateCollectionDocument(content="foo", metadata=None)
                         ],
                         store_name="test",
+                        resume=False,
                     )
 
 
@@ -151,16 +162,53 @@ def test_create_duplicate_collection_force_create(api_client):
                             headers={"Authorization": f"Bearer {token}"},
                         )
 
-                        assert response.status_code == 200
+                        assert response.status_code == 202
+                        job_manager.wait(response.json()["job_id"])
                         mock_create.assert_called_once_with(
                             name="test",
                             collection=[
                                 CreateCollectionDocument(content="foo", metadata=None)
                             ],
                             store_name="test",
+                            resume=False,
                         )
 
 
+def test_create_duplicate_collection_resume(api_client):
+    """Test that resuming the build of an existing collection is accepted."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch(
+                "colbertdb.core.models.store.Store.list_collections"
+            ) as mock_list_collections:
+                with patch(
+                    "colbertdb.core.models.collection.Collection.create"
+                ) as mock_create:
+                    with patch(
+                        "colbertdb.server.api.deps.verify_store"
+                    ) as mock_verify_store:
+                        mock_store = MagicMock()
+                        mock_verify_store.return_value = mock_store
+                        mock_list_collections.return_value = ["test"]
+                        token = create_access_token({"store": "test"})
+                        response = api_client.post(
+                            f"{settings.API_V1_STR}/collections",
+                            json={
+                                "name": "test",
+                                "documents": [{"content": "foo"}],
+                                "options": {"resume": True},
+                            },
+                            headers={"Authorization": f"Bearer {token}"},
+                        )
+
+                        assert response.status_code == 202
+                        job_manager.wait(response.json()["job_id"])
+                        assert mock_create.call_args.kwargs["resume"] is True
+
+
 def test_add_documents(api_client):
     """Test adding documents to a collection in a store."""
     with patch(
@@ -179,11 +227,9 @@ def test_add_documents(api_client):
                     headers={"Authorization": f"Bearer {token}"},
                 )
 
-                assert response.status_code == 200
-                assert response.json() == {
-                    "status": "success",
-                    "message": "Collection updated successfully.",
-                }
+                assert response.status_code == 202
+                assert response.json()["status"] == "accepted"
+                job_manager.wait(response.json()["job_id"])
                 mock_load.assert_called_once_with(name="test", store_name="test")
                 mock_collection.add_to_index.assert_called_once_with(
                     collection=[CreateCollectionDocument(content="foo", metadata=None)]
@@ -219,6 +265,35 @@ def test_delete_collection(api_client):
                 mock_collection.delete.assert_called_once()
 
 
+def test_delete_collection_with_unfinished_jobs(api_client):
+    """Test that a collection is not deleted while a job on it is unfinished."""
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch("colbertdb.core.models.collection.Collection.load") as mock_load:
+                job = job_manager.submit("add_documents", "test", "busy", block)
+                started.wait(5)
+
+                token = create_access_token({"store": "test"})
+                response = api_client.delete(
+                    f"{settings.API_V1_STR}/collections/busy",
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+                release.set()
+                job_manager.wait(job.id)
+
+                assert response.status_code == 409
+                mock_load.assert_not_called()
+
 def test_delete_documents(api_client):
     """Test deleting documents from a collection in a store."""
 
@@ -239,14 +314,312 @@ def test_delete_documents(api_client):
                     headers={"Authorization": f"Bearer {token}"},
                 )
 
-                assert response.status_code == 200
-                assert response.json() == {
-                    "status": "success",
-                    "message": "Collection deleted successfully.",
-                }
+                assert response.status_code == 202
+                assert response.json()["status"] == "accepted"
+                job_manager.wait(response.json()["job_id"])
                 mock_load.assert_called_once_with(
                     name="test_collection", store_name="test"
                 )
                 mock_collection.delete_from_index.assert_called_once_with(
                     document_ids=["1", "2", "3"]
                 )
+
+
+def test_search_collection_uses_cache(api_client):
+    """Test that repeated searches reuse the loaded collection."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch("colbertdb.core.models.collection.Collection.load") as mock_load:
+                mock_collection = MagicMock()
+                mock_collection.search.return_value = [
+                    {"content": "foo", "document_id": "1", "score": 1.0, "rank": 1}
+                ]
+                mock_load.return_value = mock_collection
+
+                token = create_access_token({"store": "test"})
+                for _ in range(2):
+                    response = api_client.post(
+                        f"{settings.API_V1_STR}/collections/test_collection/search",
+                        json={"query": "foo", "k": 1},
+                        headers={"Authorization": f"Bearer {token}"},
+                    )
+                    assert response.status_code == 200
+                    assert response.json()["documents"][0]["content"] == "foo"
+
+                mock_load.assert_called_once_with(
+                    name="test_collection", store_name="test"
+                )
+                assert mock_collection.search.call_count == 2
+
+
+def test_search_collection_options_are_capped(api_client):
+    """Test that search profiles are lowered to the server limits and explicit settings past them are rejected."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch("colbertdb.core.models.collection.Collection.load") as mock_load:
+                with patch.object(settings, "SEARCH_MAX_NCELLS", 8):
+                    mock_collection = MagicMock()
+                    mock_collection.search.return_value = []
+                    mock_load.return_value = mock_collection
+
+                    token = create_access_token({"store": "test"})
+                    response = api_client.post(
+                        f"{settings.API_V1_STR}/collections/test_collection/search",
+                        json={"query": "foo", "k": 5, "options": {"profile": "exhaustive"}},
+                        headers={"Authorization": f"Bearer {token}"},
+                    )
+                    assert response.status_code == 200
+                    search_params = mock_collection.search.call_args.kwargs["search_params"]
+                    assert (search_params.ncells, search_params.ndocs) == (8, 8192)
+
+                    response = api_client.post(
+                        f"{settings.API_V1_STR}/collections/test_collection/search",
+                        json={"query": "foo", "options": {"force_fast": True}},
+                        headers={"Authorization": f"Bearer {token}"},
+                    )
+                    assert response.status_code == 200
+                    search_params = mock_collection.search.call_args.kwargs["search_params"]
+                    assert (search_params.ncells, search_params.ndocs) == (1, 256)
+
+                    response = api_client.post(
+                        f"{settings.API_V1_STR}/collections/test_collection/search",
+                        json={"query": "foo", "options": {"ncells": 16}},
+                        headers={"Authorization": f"Bearer {token}"},
+                    )
+                    assert response.status_code == 400
+                    assert mock_collection.search.call_count == 2
+
+
+def test_add_documents_updates_cached_collection(api_client):
+    """Test that documents are added to the cached collection, which stays cached."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch("colbertdb.core.models.collection.Collection.load") as mock_load:
+                mock_load.return_value = MagicMock()
+                cached = collection_cache.get("test", "test")
+
+                token = create_access_token({"store": "test"})
+                response = api_client.post(
+                    f"{settings.API_V1_STR}/collections/test/documents",
+                    json={"documents": [{"content": "foo"}]},
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+
+                assert response.status_code == 202
+                job_manager.wait(response.json()["job_id"])
+                mock_load.assert_called_once()
+                cached.add_to_index.assert_called_once()
+                assert collection_cache.get("test", "test") is cached
+
+
+def test_failed_add_documents_invalidates_cache(api_client):
+    """Test that a failed update drops the cached collection, which it may have left half changed."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch("colbertdb.core.models.collection.Collection.load") as mock_load:
+                mock_load.return_value = MagicMock()
+                mock_load.return_value.add_to_index.side_effect = RuntimeError("boom")
+                collection_cache.get("test", "test")
+
+                token = create_access_token({"store": "test"})
+                response = api_client.post(
+                    f"{settings.API_V1_STR}/collections/test/documents",
+                    json={"documents": [{"content": "foo"}]},
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+
+                assert response.status_code == 202
+                job = job_manager.wait(response.json()["job_id"])
+                assert job.state == "failed"
+                assert ("test", "test") not in collection_cache.entries
+
+
+def test_batch_search_collection(api_client):
+    """Test that a batch search returns one result list per query."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch("colbertdb.core.models.collection.Collection.load") as mock_load:
+                mock_collection = MagicMock()
+                mock_collection.search_batch.return_value = [
+                    [{"content": "foo", "document_id": "1", "score": 1.0, "rank": 1}],
+                    [{"content": "bar", "document_id": "2", "score": 0.5, "rank": 1}],
+                ]
+                mock_load.return_value = mock_collection
+
+                token = create_access_token({"store": "test"})
+                response = api_client.post(
+                    f"{settings.API_V1_STR}/collections/test_collection/search:batch",
+                    json={
+                        "queries": [
+                            {"query": "foo", "k": 1},
+                            {"query": "bar", "doc_ids": ["2"]},
+                        ]
+                    },
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+
+                assert response.status_code == 200
+                results = response.json()["results"]
+                assert [x["documents"][0]["content"] for x in results] == ["foo", "bar"]
+                mock_collection.search_batch.assert_called_once_with(
+                    queries=["foo", "bar"],
+                    k=[1, None],
+                    search_params=None,
+                    doc_ids=[None, ["2"]],
+                )
+
+
+def test_batch_search_collection_too_many_queries(api_client):
+    """Test that a batch over the configured size is rejected."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch.object(settings, "SEARCH_BATCH_MAX_QUERIES", 1):
+                token = create_access_token({"store": "test"})
+                response = api_client.post(
+                    f"{settings.API_V1_STR}/collections/test_collection/search:batch",
+                    json={"queries": [{"query": "foo"}, {"query": "bar"}]},
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+
+                assert response.status_code == 400
+
+
+def test_get_job(api_client):
+    """Test that a job can be polled by its store only."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            job = job_manager.submit("add_documents", "test", "test", lambda: None)
+            job_manager.wait(job.id)
+
+            token = create_access_token({"store": "test"})
+            response = api_client.get(
+                f"{settings.API_V1_STR}/jobs/{job.id}",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            assert response.status_code == 200
+            assert response.json()["state"] == "succeeded"
+            assert response.json()["collection_name"] == "test"
+
+            token = create_access_token({"store": "other"})
+            response = api_client.get(
+                f"{settings.API_V1_STR}/jobs/{job.id}",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            assert response.status_code == 404
+
+
+def test_stream_documents(api_client):
+    """Test that streamed documents are indexed in batches."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch(
+                "colbertdb.core.models.store.Store.collection_exists", return_value=True
+            ):
+                with patch(
+                    "colbertdb.core.models.collection.Collection.load"
+                ) as mock_load:
+                    with patch.object(settings, "INGEST_BATCH_SIZE", 2):
+                        mock_collection = MagicMock()
+                        mock_load.return_value = mock_collection
+
+                        body = "\n".join(
+                            f'{{"content": "doc {i}", "metadata": {{"i": {i}}}}}'
+                            for i in range(5)
+                        )
+                        token = create_access_token({"store": "test"})
+                        response = api_client.post(
+                            f"{settings.API_V1_STR}/collections/test/documents:stream",
+                            content=body.encode(),
+                            headers={
+                                "Authorization": f"Bearer {token}",
+                                "Content-Type": "application/x-ndjson",
+                            },
+                        )
+
+                        assert response.status_code == 202
+                        assert response.json()["documents_received"] == 5
+                        job = job_manager.wait(response.json()["job_id"])
+                        assert job.state == "succeeded"
+                        assert job.progress["documents_indexed"] == 5
+                        batches = [
+                            call.kwargs["collection"]
+                            for call in mock_collection.add_to_index.call_args_list
+                        ]
+                        assert [len(x) for x in batches] == [2, 2, 1]
+                        assert batches[2][0] == CreateCollectionDocument(
+                            content="doc 4", metadata={"i": 4}
+                        )
+
+
+def test_stream_documents_when_the_collection_fails_to_load(api_client):
+    """Test that the upload stops once its job has failed before taking any batch."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch(
+                "colbertdb.core.models.store.Store.collection_exists", return_value=True
+            ):
+                with patch(
+                    "colbertdb.core.models.collection.Collection.load",
+                    side_effect=RuntimeError("corrupt index"),
+                ):
+                    with patch.object(settings, "INGEST_BATCH_SIZE", 1), patch.object(
+                        settings, "INGEST_MAX_PENDING_BATCHES", 1
+                    ):
+                        body = "\n".join(f'{{"content": "doc {i}"}}' for i in range(5))
+                        token = create_access_token({"store": "test"})
+                        response = api_client.post(
+                            f"{settings.API_V1_STR}/collections/test/documents:stream",
+                            content=body.encode(),
+                            headers={"Authorization": f"Bearer {token}"},
+                        )
+
+                        assert response.status_code == 500
+                        assert "stopped" in response.json()["detail"]
+
+def test_stream_documents_invalid_line(api_client):
+    """Test that an invalid line is reported with its line number."""
+    with patch(
+        "colbertdb.server.services.file_ops.load_mappings",
+        return_value={"supersecret": "test"},
+    ):
+        with patch("colbertdb.core.models.store.Store.exists", return_value=True):
+            with patch(
+                "colbertdb.core.models.store.Store.collection_exists", return_value=True
+            ):
+                with patch("colbertdb.core.models.collection.Collection.load"):
+                    token = create_access_token({"store": "test"})
+                    response = api_client.post(
+                        f"{settings.API_V1_STR}/collections/test/documents:stream",
+                        content=b'{"content": "foo"}\n{"metadata": {}}\n',
+                        headers={"Authorization": f"Bearer {token}"},
+                    )
+
+                    assert response.status_code == 400
+                    assert "line 2" in response.json()["detail"]
@@ -0,0 +1,107 @@
+""" Tests for the CollectionCache class """
+
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from colbertdb.server.services.collection_cache import CollectionCache
+
+
+def test_get_loads_once():
+    """Test that a cached collection is only loaded from disk once."""
+    cache = CollectionCache(max_entries=2, max_disk_mb=0)
+    with patch(
+        "colbertdb.core.models.collection.Collection.load", return_value=MagicMock()
+    ) as mock_load:
+        first = cache.get("test", "collection")
+        second = cache.get("test", "collection")
+
+    assert first is second
+    mock_load.assert_called_once_with(name="collection", store_name="test")
+
+
+def test_invalidate_reloads():
+    """Test that an invalidated collection is loaded again on the next access."""
+    cache = CollectionCache(max_entries=2, max_disk_mb=0)
+    with patch(
+        "colbertdb.core.models.collection.Collection.load",
+        side_effect=[MagicMock(), MagicMock()],
+    ) as mock_load:
+        first = cache.get("test", "collection")
+        cache.invalidate("test", "collection")
+        second = cache.get("test", "collection")
+
+    assert first is not second
+    assert mock_load.call_count == 2
+
+
+def test_evicts_least_recently_used():
+    """Test that the least recently used collection is evicted over the count budget."""
+    cache = CollectionCache(max_entries=2, max_disk_mb=0)
+    with patch(
+        "colbertdb.core.models.collection.Collection.load",
+        side_effect=lambda name, store_name: MagicMock(),
+    ):
+        cache.get("test", "a")
+        cache.get("test", "b")
+        cache.get("test", "a")
+        cache.get("test", "c")
+
+    assert list(cache.entries) == [("test", "a"), ("test", "c")]
+
+
+def test_evicts_over_disk_budget():
+    """Test that collections are evicted once the size of their indexes exceeds the budget."""
+    cache = CollectionCache(max_entries=10, max_disk_mb=1)
+    with patch(
+        "colbertdb.core.models.collection.Collection.load",
+        side_effect=lambda name, store_name: MagicMock(),
+    ):
+        with patch(
+            "colbertdb.server.services.collection_cache.collection_disk_size",
+            return_value=600 * 1024,
+        ):
+            cache.get("test", "a")
+            cache.get("test", "b")
+
+    assert list(cache.entries) == [("test", "b")]
+    assert cache.disk_usage() == 600 * 1024
+
+
+def test_concurrent_misses_load_once():
+    """Test that threads that miss the same collection at once share a single load."""
+    cache = CollectionCache(max_entries=2, max_disk_mb=0)
+
+    def load(name, store_name):
+        time.sleep(0.05)
+        return MagicMock()
+
+    with patch(
+        "colbertdb.core.models.collection.Collection.load", side_effect=load
+    ) as mock_load:
+        threads = [
+            threading.Thread(target=cache.get, args=("test", "collection"))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    mock_load.assert_called_once()
+
+
+def test_load_lock_is_kept_while_cached():
+    """Test that the load lock of a collection is kept until it is evicted or invalidated."""
+    cache = CollectionCache(max_entries=1, max_disk_mb=0)
+    with patch(
+        "colbertdb.core.models.collection.Collection.load",
+        side_effect=lambda name, store_name: MagicMock(),
+    ):
+        cache.get("test", "a")
+        assert list(cache.load_locks) == [("test", "a")]
+        cache.get("test", "b")
+        assert list(cache.load_locks) == [("test", "b")]
+        cache.invalidate("test", "b")
+
+    assert not cache.load_locks and not cache.loaders
@@ -0,0 +1,102 @@
+""" Tests for the JobManager class """
+
+import threading
+
+import pytest
+
+from colbertdb.core.utils.progress import report_progress
+from colbertdb.server.services.job_manager import (
+    CollectionBusyError,
+    JobManager,
+    JobQueueFullError,
+)
+
+
+def test_job_reports_progress_and_timing():
+    """Test that a job records its progress, outcome and timing."""
+    manager = JobManager(max_workers=1, max_queued_jobs=4, max_retained_jobs=4)
+
+    def work():
+        report_progress(stage="encoding", passages_total=2)
+        report_progress(passages_encoded=2)
+
+    job = manager.submit("create_collection", "test", "collection", work)
+    job = manager.wait(job.id, timeout=5)
+
+    assert job.state == "succeeded"
+    assert job.progress == {
+        "stage": "encoding",
+        "passages_total": 2,
+        "passages_encoded": 2,
+    }
+    assert job.started_at is not None and job.finished_at is not None
+    assert job.duration_seconds >= 0
+
+
+def test_failed_job_records_error():
+    """Test that an exception in a job marks it as failed."""
+    manager = JobManager(max_workers=1, max_queued_jobs=4, max_retained_jobs=4)
+
+    def work():
+        raise ValueError("boom")
+
+    job = manager.wait(manager.submit("add_documents", "test", "c", work).id, 5)
+
+    assert job.state == "failed"
+    assert job.error == "boom"
+
+
+def test_queue_is_bounded():
+    """Test that submissions are rejected once the queue is full."""
+    manager = JobManager(max_workers=1, max_queued_jobs=1, max_retained_jobs=4)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    running = manager.submit("create_collection", "test", "a", block)
+    started.wait(5)
+    queued = manager.submit("create_collection", "test", "b", lambda: None)
+    with pytest.raises(JobQueueFullError):
+        manager.submit("create_collection", "test", "c", lambda: None)
+
+    release.set()
+    assert manager.wait(running.id, 5).state == "succeeded"
+    assert manager.wait(queued.id, 5).state == "succeeded"
+
+
+def test_run_exclusive_waits_for_no_job_on_the_collection():
+    """Test that an exclusive change is rejected while a job on its collection is unfinished."""
+    manager = JobManager(max_workers=1, max_queued_jobs=4, max_retained_jobs=4)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    running = manager.submit("add_documents", "test", "a", block)
+    started.wait(5)
+    with pytest.raises(CollectionBusyError):
+        manager.run_exclusive("test", "a", lambda: None)
+    # Other collections are not affected.
+    assert manager.run_exclusive("test", "b", lambda: "deleted") == "deleted"
+
+    release.set()
+    manager.wait(running.id, 5)
+    assert manager.run_exclusive("test", "a", lambda: "deleted") == "deleted"
+
+
+def test_run_exclusive_rejects_new_jobs_on_the_collection():
+    """Test that no job can be submitted on a collection while an exclusive change runs."""
+    manager = JobManager(max_workers=1, max_queued_jobs=4, max_retained_jobs=4)
+
+    def change():
+        with pytest.raises(CollectionBusyError):
+            manager.submit("add_documents", "test", "a", lambda: None)
+
+    manager.run_exclusive("test", "a", change)
+    job = manager.submit("add_documents", "test", "a", lambda: None)
+    assert manager.wait(job.id, 5).state == "succeeded"
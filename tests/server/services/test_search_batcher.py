@@ -0,0 +1,113 @@
+""" Tests for the SearchBatcher class """
+
+import threading
+from unittest.mock import MagicMock
+
+from colbertdb.core.models.search_params import SearchParams
+from colbertdb.server.services.search_batcher import SearchBatcher
+
+
+def test_concurrent_searches_are_batched():
+    """Test that concurrent searches on a collection run as a single batch."""
+    batcher = SearchBatcher(max_batch_size=3, max_wait_ms=5000)
+    collection = MagicMock()
+    collection.search_batch.side_effect = lambda queries, k, search_params: [
+        [{"content": query, "k": query_k}] for query, query_k in zip(queries, k)
+    ]
+
+    results = {}
+
+    def search(query, k):
+        results[query] = batcher.search("test", "collection", collection, query, k)
+
+    threads = [
+        threading.Thread(target=search, args=(f"q{i}", i + 1)) for i in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    collection.search_batch.assert_called_once()
+    collection.search.assert_not_called()
+    assert results == {f"q{i}": [{"content": f"q{i}", "k": i + 1}] for i in range(3)}
+    metrics = batcher.metrics.snapshot()
+    assert metrics["batches"] == 1
+    assert metrics["queries"] == 3
+    assert metrics["max_batch_size"] == 3
+
+
+def test_lone_search_runs_after_window():
+    """Test that a search without company runs on its own once the window closes."""
+    batcher = SearchBatcher(max_batch_size=8, max_wait_ms=1)
+    collection = MagicMock()
+    collection.search.return_value = [{"content": "foo"}]
+
+    assert batcher.search("test", "collection", collection, "foo", 1) == [
+        {"content": "foo"}
+    ]
+    collection.search.assert_called_once_with(query="foo", k=1, search_params=None)
+    assert batcher.pending == {}
+
+
+def test_searches_with_different_settings_are_not_batched():
+    """Test that concurrent searches only share a batch with searches with the same settings."""
+    batcher = SearchBatcher(max_batch_size=2, max_wait_ms=5000)
+    collection = MagicMock()
+    collection.search_batch.side_effect = lambda queries, k, search_params: [
+        [{"content": query, "ncells": search_params.ncells}] for query in queries
+    ]
+    fast = SearchParams.from_profile("fast")
+    exhaustive = SearchParams.from_profile("exhaustive")
+
+    results = {}
+
+    def search(query, search_params):
+        results[query] = batcher.search(
+            "test", "collection", collection, query, search_params=search_params
+        )
+
+    threads = [
+        threading.Thread(target=search, args=(query, search_params))
+        for query, search_params in [
+            ("a", fast),
+            ("b", exhaustive),
+            ("c", fast),
+            ("d", exhaustive),
+        ]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert collection.search_batch.call_count == 2
+    assert {query: result[0]["ncells"] for query, result in results.items()} == {
+        "a": 1,
+        "b": 32,
+        "c": 1,
+        "d": 32,
+    }
+
+
+def test_batch_errors_reach_every_query():
+    """Test that a failing batch raises in every waiting request."""
+    batcher = SearchBatcher(max_batch_size=2, max_wait_ms=5000)
+    collection = MagicMock()
+    collection.search_batch.side_effect = RuntimeError("boom")
+
+    errors = []
+
+    def search(query):
+        try:
+            batcher.search("test", "collection", collection, query)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=search, args=(q,)) for q in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ["boom", "boom"]